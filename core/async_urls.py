@@ -0,0 +1,10 @@
+from django.urls import path
+
+from . import async_views
+
+urlpatterns = [
+    path('spam/<phone:phone_number>/', async_views.AsyncSpamNumberDetailView.as_view(), name='async-spam-number-detail'),
+    path('search/name/', async_views.AsyncNameSearchView.as_view(), name='async-search-name'),
+    path('search/phone/', async_views.AsyncPhoneSearchView.as_view(), name='async-search-phone'),
+    path('users/<int:id>/', async_views.AsyncUserDetailView.as_view(), name='async-user-detail'),
+]
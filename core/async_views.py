@@ -0,0 +1,144 @@
+"""
+Async versions of the lookup and search endpoints, mounted under /api/async/.
+
+Under ASGI the event loop keeps serving other requests while these views wait. The waits
+themselves are not concurrent: Django's async ORM, and the async methods of its built-in
+cache backends, run each call through sync_to_async on the one thread shared by all
+thread-sensitive sync code, so a view's queries run one after another and occupy that
+thread while they do. Responses match the synchronous views in core/views.py, which remain
+at their usual routes.
+
+DRF's request handling is synchronous, so these are plain Django views. They accept token
+authentication (through the cached token lookup) and session authentication, and spend from
+the same token buckets as the DRF views (core/throttling.py).
+"""
+from django.conf import settings
+from django.http import Http404, HttpResponse, JsonResponse
+from django.shortcuts import aget_object_or_404
+from django.views import View
+from rest_framework import status
+from rest_framework.exceptions import APIException, NotAuthenticated, Throttled
+from rest_framework.request import Request
+
+from . import stats, throttling
+from .authentication import CachedTokenAuthentication
+from .bloom import spam_filter
+from .fast_serializers import SearchResultRowSerializer
+from .pagination import SearchCursorPagination
+from .phone import phone_key
+from .renderers import dumps
+from .search_index import CONTACT, USER, name_index
+from .spam_cache import spam_cache
+from .views import (
+    name_search_contacts,
+    name_search_users,
+    phone_directory_entry,
+    phone_search_matches,
+    search_rows,
+    user_detail_data,
+    user_details,
+)
+
+
+async def alist(queryset):
+    return [row async for row in queryset]
+
+class AsyncAPIView(View):
+    """Authenticates the caller and renders API errors the way DRF would."""
+    authentication = CachedTokenAuthentication()
+
+    async def dispatch(self, request, *args, **kwargs):
+        try:
+            await self.authenticate(request)
+            await self.throttle(request)
+            return await super().dispatch(request, *args, **kwargs)
+        except Http404 as exc:
+            return JsonResponse({'detail': str(exc) or 'Not found.'}, status=status.HTTP_404_NOT_FOUND)
+        except APIException as exc:
+            response = JsonResponse({'detail': exc.detail}, status=exc.status_code)
+            if exc.status_code == status.HTTP_401_UNAUTHORIZED:
+                response['WWW-Authenticate'] = self.authentication.authenticate_header(request)
+            return response
+
+    async def authenticate(self, request):
+        credentials = await self.authentication.aauthenticate(request)
+        if credentials is not None:
+            request.user, request.auth = credentials
+            return
+        user = await request.auser()
+        if not user.is_authenticated:
+            raise NotAuthenticated()
+        request.user = user
+
+    async def throttle(self, request):
+        if not settings.THROTTLE_ENABLED:
+            return
+        request.throttle_budget = await throttling.aspend(throttling.caller(request), throttling.route_cost(request, self))
+        if not request.throttle_budget.allowed:
+            raise Throttled(request.throttle_budget.retry_after)
+
+class AsyncSearchView(AsyncAPIView):
+    async def get(self, request):
+        drf_request = Request(request)
+        paginator = SearchCursorPagination()
+        after = paginator.decode_cursor(drf_request)
+        limit = paginator.get_fetch_size(drf_request)
+        rows = await self.search_rows(drf_request.query_params.get('q', None), after, limit)
+        results = paginator.paginate_queryset(rows, drf_request)
+        return HttpResponse(dumps({
+            'next': paginator.get_next_link(),
+            'results': [SearchResultRowSerializer.represent(row) for row in results],
+        }), content_type='application/json')
+
+class AsyncNameSearchView(AsyncSearchView):
+    def throttle_cost(self, request, cost):
+        return throttling.short_query_cost(request.GET.get('q'), cost)
+
+    async def search_rows(self, query, after, limit):
+        if not query:
+            return []
+        indexed = name_index.search(query, limit, after)
+        if indexed is not None:
+            spam_counts = await stats.areport_counts({key for *_, key in indexed})
+            total_reports = await stats.atotal_reports()
+            return search_rows([(*match[:5], spam_counts[match[5]]) for match in indexed], total_reports)
+
+        users = name_search_users(query, after)
+        if after is not None and after[0] != USER:
+            users = users.none()
+        registered_users = await alist(users[:limit])
+        total_reports = await stats.atotal_reports()
+        matches = [(USER, *row) for row in registered_users]
+        # The contact scan is the expensive query, so it only runs when users leave room on the page.
+        if len(matches) < limit:
+            contacts = await alist(name_search_contacts(query, after)[:limit - len(matches)])
+            matches += [(CONTACT, *row) for row in contacts]
+        return search_rows(matches, total_reports)
+
+class AsyncPhoneSearchView(AsyncSearchView):
+    async def search_rows(self, query, after, limit):
+        key = phone_key(query)
+        if key is None:
+            return []
+        entry = await phone_directory_entry(key).afirst()
+        total_reports = await stats.atotal_reports()
+        return search_rows(phone_search_matches(entry, after)[:limit], total_reports)
+
+class AsyncSpamNumberDetailView(AsyncAPIView):
+    async def get(self, request, phone_number):
+        if not await spam_filter.amight_contain(phone_number.key):
+            return JsonResponse({'phone_number': phone_number, 'is_spam': False, 'report_count': 0})
+        report_count = await spam_cache.areport_count(phone_number.key)
+        if not report_count and spam_filter.ready:
+            spam_filter.record_false_positive()
+        return JsonResponse({
+            'phone_number': phone_number,
+            'is_spam': report_count > 0,
+            'report_count': report_count,
+        })
+
+class AsyncUserDetailView(AsyncAPIView):
+    async def get(self, request, id):
+        instance = await aget_object_or_404(user_details(request.user), id=id)
+        total_reports = await stats.atotal_reports()
+        return JsonResponse(user_detail_data([instance], total_reports)[0])
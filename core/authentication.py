@@ -0,0 +1,87 @@
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.authentication import TokenAuthentication, get_authorization_header
+from rest_framework.exceptions import AuthenticationFailed
+
+
+def token_cache():
+    return caches[settings.AUTH_TOKEN_CACHE]
+
+def _token_key(key):
+    return f'auth-token:{key}'
+
+def _user_key(user_id):
+    return f'auth-token-user:{user_id}'
+
+def forget_token(key):
+    """Drop a cached token so the next request carrying it is checked against the database."""
+    token_cache().delete(_token_key(key))
+
+def forget_user(user_id):
+    """Drop the cached token of `user_id`, e.g. after the user is deactivated or edited."""
+    cache = token_cache()
+    key = cache.get(_user_key(user_id))
+    if key is not None:
+        cache.delete_many([_token_key(key), _user_key(user_id)])
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that remembers token -> (user, token) for AUTH_TOKEN_CACHE_TIMEOUT
+    seconds, saving the Token/User query on most requests.
+
+    Logout, token deletion and any change to the user drop the entry straight away. With the
+    default local-memory cache that only reaches the current process; deployments running
+    several processes should point the AUTH_TOKEN_CACHE alias at a shared backend so a
+    revoked token is refused everywhere at once.
+    """
+
+    def token_from_header(self, request):
+        """The key from an `Authorization: Token <key>` header, or None if no token was sent."""
+        auth = get_authorization_header(request).split()
+        if not auth or auth[0].lower() != self.keyword.lower().encode():
+            return None
+        if len(auth) == 1:
+            raise AuthenticationFailed('Invalid token header. No credentials provided.')
+        elif len(auth) > 2:
+            raise AuthenticationFailed('Invalid token header. Token string should not contain spaces.')
+        try:
+            return auth[1].decode()
+        except UnicodeError:
+            raise AuthenticationFailed('Invalid token header. Token string should not contain invalid characters.')
+
+    def authenticate(self, request):
+        key = self.token_from_header(request)
+        if key is None:
+            return None
+        return self.authenticate_credentials(key)
+
+    async def aauthenticate(self, request):
+        """`authenticate()` for async views; only a cache miss leaves the event loop."""
+        key = self.token_from_header(request)
+        if key is None:
+            return None
+        credentials = await self.acached_credentials(key)
+        if credentials is None:
+            credentials = await sync_to_async(self.authenticate_credentials)(key)
+        return credentials
+
+    def _usable(self, cached):
+        # A cached inactive user goes back to the database, which rejects it with the usual error.
+        if cached is not None and cached[0].is_active:
+            return cached
+        return None
+
+    def cached_credentials(self, key):
+        return self._usable(token_cache().get(_token_key(key)))
+
+    async def acached_credentials(self, key):
+        return self._usable(await token_cache().aget(_token_key(key)))
+
+    def authenticate_credentials(self, key):
+        credentials = self.cached_credentials(key)
+        if credentials is None:
+            credentials = super().authenticate_credentials(key)
+            timeout = settings.AUTH_TOKEN_CACHE_TIMEOUT
+            token_cache().set_many({_token_key(key): credentials, _user_key(credentials[0].pk): key}, timeout)
+        return credentials
@@ -0,0 +1,380 @@
+"""
+Per-endpoint benchmarks: seed a dataset of a given size, drive every API route through the
+test client and record p50/p95 latency and SQL queries per request.
+
+`python manage.py run_benchmarks` runs this against a throwaway test database and fails when an
+endpoint exceeds its budget in benchmark_budgets.json. Query budgets hold at every scale, since
+no endpoint may issue more queries as the data grows. Latency budgets are set per scale.
+`measure_serialization()` times the list serializers on their own, DRF's against core/fast_serializers.py.
+"""
+import gc
+import json
+import math
+import random
+import tempfile
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.contrib.auth.hashers import make_password
+from django.core.cache import caches
+from django.db import connection, reset_queries
+from django.test.utils import CaptureQueriesContext, override_settings
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import directory, search_index, stats, versions
+from .bloom import spam_filter
+from .fast_serializers import ContactRowSerializer, SearchResultRowSerializer, SpamNumberRowSerializer
+from .models import Contact, PhoneSpamStat, SpamReport, User
+from .phone import phone_key
+from .renderers import FastJSONRenderer
+from .reports import file_reports
+from .search_index import name_index
+from .snapshot import export_snapshot
+from .spam_cache import spam_cache
+
+BUDGETS_PATH = Path(__file__).with_name('benchmark_budgets.json')
+SCALES = {'1k': 1_000, '10k': 10_000, '100k': 100_000, '1m': 1_000_000}
+PASSWORD = 'benchmark-password'
+FIRST_NAMES = [
+    'Aarav', 'Aditi', 'Akash', 'Ananya', 'Arjun', 'Deepa', 'Divya', 'Farhan', 'Gaurav', 'Ishaan',
+    'Kavya', 'Kiran', 'Meera', 'Neha', 'Nikhil', 'Pooja', 'Priya', 'Rahul', 'Riya', 'Rohan',
+    'Sanjay', 'Shreya', 'Sneha', 'Tanvi', 'Varun', 'Vikram', 'Yash', 'Zara',
+]
+LAST_NAMES = [
+    'Agarwal', 'Bose', 'Chopra', 'Das', 'Gupta', 'Iyer', 'Joshi', 'Kapoor', 'Khan', 'Kumar',
+    'Mehta', 'Menon', 'Nair', 'Patel', 'Rao', 'Reddy', 'Shah', 'Sharma', 'Singh', 'Verma',
+]
+
+# Routes deliberately left out, with the reason.
+SKIPPED_ROUTES = {
+    'populate-test-data': 'generates a whole dataset per call',
+}
+
+
+def parse_scale(value):
+    """'100k' or '250000' -> number of contacts to seed."""
+    if value.lower() in SCALES:
+        return SCALES[value.lower()]
+    return int(value)
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[max(math.ceil(fraction * len(ordered)) - 1, 0)]
+
+def user_phone(i):
+    return f'70{i:08d}'
+
+def pool_phone(i):
+    return f'8{i:09d}'
+
+def seed_database(contacts, contacts_per_user=100, spam_fraction=0.1, seed=0, batch_size=5000):
+    """
+    Fill an empty database with `contacts` contacts spread over `contacts / contacts_per_user`
+    users, plus `spam_fraction * contacts` spam reports, reproducibly for a given `seed`.
+
+    A fifth of the contacts are registered users' numbers. The rest come from a shared pool, so
+    popular numbers show up in many phonebooks the way they do in real contact lists.
+    """
+    rng = random.Random(seed)
+    user_count = max(contacts // contacts_per_user, 2)
+    pool_size = max(contacts // 2, 1)
+    password = make_password(PASSWORD)
+
+    for start in range(0, user_count, batch_size):
+        User.objects.bulk_create([
+            User(
+                username=f'{rng.choice(FIRST_NAMES)}{rng.choice(LAST_NAMES)}{i}'.lower(),
+                phone_number=user_phone(i),
+                phone_key=phone_key(user_phone(i)),
+                email=f'user{i}@example.com',
+                password=password,
+            )
+            for i in range(start, min(start + batch_size, user_count))
+        ])
+    user_ids = list(User.objects.order_by('pk').values_list('pk', flat=True))
+    versions.start_many(user_ids)
+
+    batch = []
+    for index, user_id in enumerate(user_ids):
+        numbers = set()
+        for _ in range(min(contacts_per_user, contacts - index * contacts_per_user)):
+            while True:
+                if rng.random() < 0.2:
+                    number = user_phone(rng.randrange(user_count))
+                else:
+                    number = pool_phone(rng.randrange(pool_size))
+                if number not in numbers:
+                    break
+            numbers.add(number)
+            name = f'{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}'
+            batch.append(Contact(user_id=user_id, name=name, phone_number=number, phone_key=phone_key(number)))
+            if len(batch) >= batch_size:
+                Contact.objects.bulk_create(batch)
+                batch = []
+    if batch:
+        Contact.objects.bulk_create(batch)
+
+    reports = set()
+    for _ in range(int(contacts * spam_fraction)):
+        reports.add((pool_phone(rng.randrange(pool_size)), rng.choice(user_ids)))
+    reports = sorted(reports)
+    for start in range(0, len(reports), batch_size):
+        SpamReport.objects.bulk_create([
+            SpamReport(phone_number=number, phone_key=phone_key(number), reported_by_id=user_id)
+            for number, user_id in reports[start:start + batch_size]
+        ])
+
+    counts = stats.rebuild(batch_size=batch_size)
+    directory.rebuild(batch_size=batch_size)
+    reset_caches()
+    if settings.NAME_SEARCH_INDEX_ENABLED:
+        search_index.log_bulk_load()
+        name_index.build()
+    if settings.SPAM_FILTER_ENABLED:
+        spam_filter.build()
+    return {'users': counts['users'], 'contacts': Contact.objects.count(), 'spam_reports': counts['spam_reports']}
+
+def reset_caches():
+    spam_cache.clear()
+    caches[settings.AUTH_TOKEN_CACHE].clear()
+
+
+class Endpoint:
+    """
+    One benchmarked request. `request(ctx, i)` returns the (path, data) of iteration `i`, or
+    (path, data, headers); it may also prepare state the request needs (e.g. a report to
+    withdraw), which is not timed.
+    """
+
+    def __init__(self, name, method, request, route=None, client='user', status=200):
+        self.name = name
+        self.route = route or name
+        self.method = method
+        self.request = request
+        self.client = client
+        self.status = status
+
+class Context:
+    """The users, clients and sample data the endpoints draw their requests from."""
+
+    def __init__(self):
+        self.user = User.objects.order_by('pk').first()
+        self.admin = User.objects.create_superuser(username='bench-admin', phone_number='6999999990', password=PASSWORD)
+        self.leaver = User.objects.create_user(username='bench-leaver', phone_number='6999999991', password=PASSWORD)
+        self.user_ids = list(User.objects.order_by('pk').values_list('pk', flat=True)[:100])
+        self.contact_numbers = list(self.user.contacts.order_by('pk').values_list('phone_number', flat=True))
+        self.spam_numbers = list(PhoneSpamStat.objects.order_by('-report_count').values_list('phone_number', flat=True)[:100])
+        self.snapshot_version = export_snapshot()['version']
+        self.clients = {'anonymous': APIClient()}
+        for name, user in (('user', self.user), ('admin', self.admin)):
+            self.clients[name] = self.client_for(user)
+
+    def client_for(self, user):
+        token, _ = Token.objects.get_or_create(user=user)
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+    def name_query(self, i):
+        return FIRST_NAMES[i % len(FIRST_NAMES)][:3].lower()
+
+    def popular_number(self, i):
+        return self.spam_numbers[i % len(self.spam_numbers)] if self.spam_numbers else pool_phone(i)
+
+    def log_in_leaver(self):
+        self.clients['leaver'] = self.client_for(self.leaver)
+
+    def revalidate(self, path):
+        """(path, data, headers) of a poll for `path` that holds its current ETag."""
+        return path, None, {'If-None-Match': self.clients['user'].get(path)['ETag']}
+
+    def report_for_withdrawal(self, i):
+        number = f'51{i:08d}'
+        file_reports(self.user, [number])
+        return number
+
+def _spam_detail(ctx, i, prefix=''):
+    # Alternate between a reported number and one nobody reported.
+    number = ctx.popular_number(i) if i % 2 else f'52{i:08d}'
+    return f'/api{prefix}/spam/{number}/', None
+
+def _logout(ctx, i):
+    ctx.log_in_leaver()
+    return '/api/logout/', None
+
+def _call_log(ctx, i):
+    # A call log mixing reported, saved and registered numbers with ones nobody knows.
+    numbers = [ctx.popular_number(i + n) for n in range(50)] + ctx.contact_numbers[:100]
+    numbers += [user_phone(n) for n in range(i, i + 25)] + [f'53{n:08d}' for n in range(i * 25, i * 25 + 25)]
+    return '/api/search/phone/batch/', {'phone_numbers': numbers}
+
+def _user_detail(ctx, i, prefix=''):
+    return f'/api{prefix}/users/{ctx.user_ids[i % len(ctx.user_ids)]}/', None
+
+def _user_details(ctx, i):
+    # The users on one screen of a client's list.
+    return '/api/users/batch/', {'ids': [ctx.user_ids[(i + n) % len(ctx.user_ids)] for n in range(50)]}
+
+
+ENDPOINTS = [
+    Endpoint('register', 'post', lambda ctx, i: ('/api/register/', {
+        'username': f'bench-new-{i}', 'phone_number': f'50{i:08d}', 'email': f'new{i}@example.com',
+        'password': PASSWORD, 'password2': PASSWORD,
+    }), client='anonymous', status=201),
+    Endpoint('login', 'post', lambda ctx, i: ('/api/login/', {
+        'phone_number': ctx.user.phone_number, 'password': PASSWORD,
+    }), client='anonymous'),
+    Endpoint('logout', 'delete', _logout, client='leaver', status=204),
+    Endpoint('profile', 'get', lambda ctx, i: ('/api/profile/', None)),
+    Endpoint('profile-not-modified', 'get', lambda ctx, i: ctx.revalidate('/api/profile/'), route='profile', status=304),
+    Endpoint('profile-update', 'patch', lambda ctx, i: ('/api/profile/', {'email': f'bench{i}@example.com'}),
+             route='profile'),
+    Endpoint('add-contact', 'post', lambda ctx, i: ('/api/contacts/create/', {
+        'name': f'New Contact {i}', 'phone_number': f'53{i:08d}',
+    }), status=201),
+    Endpoint('sync-contacts', 'post', lambda ctx, i: ('/api/contacts/sync/', {
+        'contacts': [{'name': f'Synced {n}', 'phone_number': f'54{n:08d}'} for n in range(i, i + 50)],
+        'delete_missing': False,
+    })),
+    Endpoint('list-contacts', 'get', lambda ctx, i: ('/api/contacts/', None)),
+    Endpoint('list-contacts-not-modified', 'get', lambda ctx, i: ctx.revalidate('/api/contacts/'),
+             route='list-contacts', status=304),
+    Endpoint('list-contacts-stream', 'get', lambda ctx, i: ('/api/contacts/', {'stream': '1'}), route='list-contacts'),
+    Endpoint('spam-report', 'post', lambda ctx, i: ('/api/spam/create/', {'phone_number': f'55{i:08d}'}), status=201),
+    Endpoint('all-spam-numbers', 'get', lambda ctx, i: ('/api/spam/', None)),
+    Endpoint('spam-report-batch', 'post', lambda ctx, i: ('/api/spam/batch/', {
+        'phone_numbers': [f'56{n:08d}' for n in range(i * 20, i * 20 + 20)],
+    })),
+    Endpoint('spam-filter-stats', 'get', lambda ctx, i: ('/api/spam/filter-stats/', None), client='admin'),
+    Endpoint('spam-cache-stats', 'get', lambda ctx, i: ('/api/spam/cache-stats/', None), client='admin'),
+    Endpoint('spam-queue-stats', 'get', lambda ctx, i: ('/api/spam/queue-stats/', None), client='admin'),
+    Endpoint('metrics', 'get', lambda ctx, i: ('/api/metrics/', None), client='admin'),
+    Endpoint('profiler', 'get', lambda ctx, i: ('/api/profiler/', None), client='admin'),
+    Endpoint('profiler-stacks', 'get', lambda ctx, i: ('/api/profiler/stacks/', None), client='admin'),
+    Endpoint('spam-snapshot', 'get', lambda ctx, i: ('/api/spam/snapshot/', None)),
+    Endpoint('spam-list-changes', 'get', lambda ctx, i: ('/api/spam/changes/', {'since': ctx.snapshot_version})),
+    Endpoint('remove-spam', 'delete', lambda ctx, i: (f'/api/spam/{ctx.report_for_withdrawal(i)}/delete/', None)),
+    Endpoint('spam-number-detail', 'get', _spam_detail),
+    Endpoint('spam-likelihood', 'get', lambda ctx, i: (f'/api/spam/{ctx.popular_number(i)}/likelihood/', None)),
+    Endpoint('search-name', 'get', lambda ctx, i: ('/api/search/name/', {'q': ctx.name_query(i)})),
+    Endpoint('search-phone', 'get', lambda ctx, i: ('/api/search/phone/', {'q': ctx.popular_number(i)})),
+    Endpoint('search-phone-batch', 'post', _call_log),
+    Endpoint('user-detail', 'get', _user_detail),
+    Endpoint('user-detail-batch', 'post', _user_details),
+    Endpoint('async-spam-number-detail', 'get', lambda ctx, i: _spam_detail(ctx, i, '/async')),
+    Endpoint('async-search-name', 'get', lambda ctx, i: ('/api/async/search/name/', {'q': ctx.name_query(i)})),
+    Endpoint('async-search-phone', 'get', lambda ctx, i: ('/api/async/search/phone/', {'q': ctx.popular_number(i)})),
+    Endpoint('async-user-detail', 'get', lambda ctx, i: _user_detail(ctx, i, '/async')),
+]
+
+def measure(iterations=20, endpoints=ENDPOINTS):
+    """Run each endpoint `iterations` times against the current database and summarise it."""
+    with tempfile.TemporaryDirectory() as directory, override_settings(SPAM_SNAPSHOT_DIR=directory):
+        return _measure(iterations, endpoints)
+
+def _measure(iterations, endpoints):
+    ctx = Context()
+    results = {}
+    for endpoint in endpoints:
+        # Don't bill one endpoint for a collection of the garbage the ones before it left.
+        gc.collect()
+        timings = []
+        queries = []
+        for i in range(iterations):
+            path, data, *headers = endpoint.request(ctx, i)
+            headers = headers[0] if headers else {}
+            client = ctx.clients[endpoint.client]
+            # The query log is a bounded deque; once full, CaptureQueriesContext would count 0.
+            reset_queries()
+            with CaptureQueriesContext(connection) as captured:
+                start = time.perf_counter()
+                if endpoint.method == 'get':
+                    response = client.get(path, data, headers=headers)
+                else:
+                    response = getattr(client, endpoint.method)(path, data, format='json', headers=headers)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                timings.append((time.perf_counter() - start) * 1000)
+            queries.append(len(captured))
+            if response.status_code != endpoint.status:
+                raise AssertionError(
+                    f'{endpoint.name}: {endpoint.method.upper()} {path} returned {response.status_code}, '
+                    f'expected {endpoint.status}'
+                )
+        results[endpoint.name] = {
+            'route': endpoint.route,
+            'method': endpoint.method.upper(),
+            'p50_ms': round(percentile(timings, 0.5), 3),
+            'p95_ms': round(percentile(timings, 0.95), 3),
+            'max_ms': round(max(timings), 3),
+            'queries': max(queries),
+        }
+    return results
+
+def _serialization_rows(rows):
+    return {
+        ContactRowSerializer: [
+            {'id': i, 'name': f'Contact {i}', 'phone_number': pool_phone(i)} for i in range(rows)
+        ],
+        SearchResultRowSerializer: [
+            {'name': f'Contact {i}', 'phone_number': pool_phone(i), 'spam_likelihood': i % 7 / 3} for i in range(rows)
+        ],
+        SpamNumberRowSerializer: [{'phone_key': i, 'phone_number': pool_phone(i)} for i in range(rows)],
+    }
+
+def _per_row_us(serialize, rows, repeat):
+    best = math.inf
+    # Like timeit, time without the collector, whose pauses depend on whatever else is in memory.
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            serialize(rows)
+            best = min(best, time.perf_counter() - start)
+    finally:
+        gc.enable()
+    return round(best / len(rows) * 1000000, 3)
+
+def measure_serialization(rows=10000, repeat=5):
+    """Best-of-`repeat` microseconds per row to serialize and render `rows` rows, DRF against the fast path."""
+    drf_renderer, fast_renderer = JSONRenderer(), FastJSONRenderer()
+    results = {}
+    for fast, data in _serialization_rows(rows).items():
+        drf = _per_row_us(lambda rows: drf_renderer.render(fast.drf_serializer(rows, many=True).data), data, repeat)
+        fast_us = _per_row_us(lambda rows: fast_renderer.render(fast(rows, many=True).data), data, repeat)
+        results[fast.drf_serializer.__name__] = {
+            'drf_us_per_row': drf,
+            'fast_us_per_row': fast_us,
+            'speedup': round(drf / fast_us, 1),
+        }
+    return results
+
+def run_scale(contacts, iterations=20, seed=0):
+    """Seed `contacts` contacts into the current (empty) database and measure every endpoint."""
+    start = time.perf_counter()
+    seeded = seed_database(contacts, seed=seed)
+    seed_seconds = time.perf_counter() - start
+    return {'dataset': seeded, 'seed_seconds': round(seed_seconds, 1), 'endpoints': measure(iterations)}
+
+def load_budgets(path=BUDGETS_PATH):
+    with open(path) as f:
+        return json.load(f)
+
+def check_budgets(scale, results, budgets, latency=True):
+    """Return a description of every budget `results` (one scale's endpoints) exceeds."""
+    violations = []
+    for name, result in results.items():
+        budget = budgets['endpoints'].get(name)
+        if budget is None:
+            violations.append(f'{scale} {name}: no budget in benchmark_budgets.json')
+            continue
+        if result['queries'] > budget['queries']:
+            violations.append(f"{scale} {name}: {result['queries']} queries, budget {budget['queries']}")
+        p95_budget = budget.get('p95_ms', {}).get(scale)
+        if latency and p95_budget is not None and result['p95_ms'] > p95_budget:
+            violations.append(f"{scale} {name}: p95 {result['p95_ms']}ms, budget {p95_budget}ms")
+    return violations
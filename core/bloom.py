@@ -0,0 +1,261 @@
+"""
+Bloom filter over every phone number that has at least one spam report.
+
+Most caller-ID lookups are for numbers nobody ever reported. A definite miss in the
+filter answers those without touching the database; only possible hits (real spam
+numbers plus a small false-positive fraction) fall through to the stats table.
+
+The filter lives in each process (`SPAM_FILTER_ENABLED`). It is built in bulk in a
+background thread at startup, grows incrementally as reports are committed here, and is
+rebuilt every `SPAM_FILTER_REBUILD_SECONDS` so that withdrawn reports age out.
+
+Reports filed through other processes are picked up from the spam list change log: the
+filter remembers the latest SpamListChange it reflects, and a miss is only trusted if the
+log was checked within `SPAM_FILTER_POLL_SECONDS`. Otherwise the miss first reads the
+changes logged since (usually none, and an indexed range scan either way) into the filter.
+When the log can't bring it up to date (too many changes, pruned or a statistics rebuild),
+the filter is dropped and rebuilt, and lookups go to the database meanwhile.
+"""
+import logging
+import math
+import threading
+import time
+from hashlib import blake2b
+
+from django.conf import settings
+from django.db import close_old_connections
+from django.db.models import Max
+
+from . import replicas
+
+logger = logging.getLogger(__name__)
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate):
+        capacity = max(int(capacity), 1)
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.size = max(8, math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = blake2b(key.to_bytes(8, 'big', signed=True), digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'big')
+        second = int.from_bytes(digest[8:], 'big') | 1
+        return [(first + i * second) % self.size for i in range(self.hash_count)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position >> 3] |= 1 << (position & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+    @property
+    def memory_bytes(self):
+        return len(self.bits)
+
+class SpamNumberFilter:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._pending = None
+        self.filter = None
+        self.built_at = None
+        # Id of the latest SpamListChange reflected, and when the log was last checked.
+        self.version = None
+        self.checked_at = None
+        self.lookups = 0
+        self.definite_misses = 0
+        self.false_positives = 0
+
+    @property
+    def ready(self):
+        return self.filter is not None
+
+    def _current(self):
+        current = self.filter
+        if current is None or time.monotonic() - self.built_at > settings.SPAM_FILTER_REBUILD_SECONDS:
+            self.warm()
+        return current
+
+    def _up_to_date(self):
+        return time.monotonic() - self.checked_at <= settings.SPAM_FILTER_POLL_SECONDS
+
+    def might_contain(self, key):
+        """False only when `key` is certainly not a reported number; True when the database must decide."""
+        if not settings.SPAM_FILTER_ENABLED:
+            return True
+        current = self._current()
+        if current is None:
+            return True
+        self.lookups += 1
+        if key in current:
+            return True
+        if not self._up_to_date():
+            with replicas.primary():
+                changes = self._read_changes()
+            if not self._caught_up_miss(key, changes):
+                return True
+        self.definite_misses += 1
+        return False
+
+    async def amight_contain(self, key):
+        if not settings.SPAM_FILTER_ENABLED:
+            return True
+        current = self._current()
+        if current is None:
+            return True
+        self.lookups += 1
+        if key in current:
+            return True
+        if not self._up_to_date():
+            if not self._caught_up_miss(key, await self._aread_changes()):
+                return True
+        self.definite_misses += 1
+        return False
+
+    def _changes(self, version):
+        from .models import SpamListChange
+
+        return (
+            SpamListChange.objects.filter(pk__gt=version)
+            .order_by('pk')
+            .values_list('pk', 'phone_key')[:settings.SPAM_FILTER_MAX_CATCH_UP + 1]
+        )
+
+    def _read_changes(self):
+        from .models import GlobalCounter
+        from .stats import counter_value
+
+        checked_at, version = time.monotonic(), self.version
+        return checked_at, version, counter_value(GlobalCounter.SPAM_LIST_HORIZON), list(self._changes(version))
+
+    async def _aread_changes(self):
+        from .models import GlobalCounter
+        from .stats import acounter_value
+
+        checked_at, version = time.monotonic(), self.version
+        horizon = await acounter_value(GlobalCounter.SPAM_LIST_HORIZON)
+        return checked_at, version, horizon, [change async for change in self._changes(version)]
+
+    def _caught_up_miss(self, key, changes):
+        """Whether a miss still holds once `changes` from the log are in the filter."""
+        if not self._catch_up(changes):
+            return False
+        current = self.filter
+        return current is not None and key not in current
+
+    def _catch_up(self, changes):
+        """Add the numbers of the changes logged since the filter's version; False if it had to be dropped."""
+        checked_at, version, horizon, changes = changes
+        if (
+            version < horizon
+            or len(changes) > settings.SPAM_FILTER_MAX_CATCH_UP
+            or any(key is None for _, key in changes)
+        ):
+            with self._lock:
+                self.filter = None
+            self.warm()
+            return False
+        self.add_many([key for _, key in changes])
+        with self._lock:
+            if changes:
+                self.version = max(self.version, changes[-1][0])
+            self.checked_at = max(self.checked_at, checked_at)
+        return True
+
+    def record_false_positive(self):
+        self.false_positives += 1
+
+    def reset(self):
+        with self._lock:
+            self.filter = self.built_at = self.version = self.checked_at = None
+            self.lookups = self.definite_misses = self.false_positives = 0
+
+    def add_many(self, keys):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.extend(keys)
+            current = self.filter
+            if current is not None:
+                for key in keys:
+                    current.add(key)
+        if current is not None and current.count > current.capacity:
+            self.warm()
+
+    def build(self):
+        """Size a fresh filter from the current number of spam numbers and fill it in one pass."""
+        from .models import PhoneSpamStat, SpamListChange
+
+        with self._lock:
+            self._pending = []
+        try:
+            # Read first: changes logged while the stats are scanned get caught up again later.
+            checked_at = time.monotonic()
+            version = SpamListChange.objects.aggregate(version=Max('pk'))['version'] or 0
+            numbers = PhoneSpamStat.objects.filter(report_count__gt=0)
+            fresh = BloomFilter(
+                max(numbers.count() * settings.SPAM_FILTER_HEADROOM, settings.SPAM_FILTER_MIN_CAPACITY),
+                settings.SPAM_FILTER_ERROR_RATE,
+            )
+            for key in numbers.values_list('phone_key', flat=True).iterator(chunk_size=10000):
+                fresh.add(key)
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            for key in self._pending:
+                fresh.add(key)
+            self._pending = None
+            self.filter = fresh
+            self.built_at = time.monotonic()
+            self.version, self.checked_at = version, checked_at
+
+    def warm(self):
+        """Start a background (re)build unless one is already running."""
+        if not settings.SPAM_FILTER_ENABLED:
+            return
+        with self._lock:
+            if self._thread is not None:
+                return
+            self._thread = threading.Thread(target=self._warm, name='spam-filter-build', daemon=True)
+        self._thread.start()
+
+    def _warm(self):
+        try:
+            self.build()
+        except Exception:
+            logger.exception('Building the spam number filter failed')
+        finally:
+            with self._lock:
+                self._thread = None
+            close_old_connections()
+
+    def stats(self):
+        current = self.filter
+        passed = self.lookups - self.definite_misses
+        return {
+            'enabled': settings.SPAM_FILTER_ENABLED,
+            'ready': current is not None,
+            'numbers': current.count if current else 0,
+            'capacity': current.capacity if current else 0,
+            'memory_bytes': current.memory_bytes if current else 0,
+            'hash_count': current.hash_count if current else 0,
+            'target_error_rate': current.error_rate if current else settings.SPAM_FILTER_ERROR_RATE,
+            'age_seconds': round(time.monotonic() - self.built_at, 1) if current else None,
+            'lookups': self.lookups,
+            'definite_misses': self.definite_misses,
+            'passed_to_database': passed,
+            'false_positives': self.false_positives,
+            'miss_rate': self.definite_misses / self.lookups if self.lookups else 0.0,
+            'observed_false_positive_rate': self.false_positives / passed if passed else 0.0,
+        }
+
+
+spam_filter = SpamNumberFilter()
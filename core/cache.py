@@ -0,0 +1,24 @@
+from collections import defaultdict
+
+from django.core.cache.backends.locmem import LocMemCache
+
+# LocMemCache hands each thread its own backend object over shared storage, so eviction
+# counts are kept per LOCATION rather than on the instance.
+_evictions = defaultdict(int)
+
+
+class CountingLocMemCache(LocMemCache):
+    """Local-memory LRU cache that also counts the entries it evicts to stay under MAX_ENTRIES."""
+
+    def __init__(self, name, params):
+        super().__init__(name, params)
+        self._name = name
+
+    def _cull(self):
+        before = len(self._cache)
+        super()._cull()
+        _evictions[self._name] += before - len(self._cache)
+
+    @property
+    def evictions(self):
+        return _evictions[self._name]
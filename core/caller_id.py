@@ -0,0 +1,39 @@
+from . import stats
+from .models import PhoneDirectory
+from .phone import phone_key
+from .spam_cache import spam_cache
+
+
+def caller_ids(phone_numbers):
+    """
+    Caller ID for each of `phone_numbers`, in order: the best known name, spam report count
+    and spam likelihood.
+
+    A registered user's username wins over contact names; otherwise the name most contacts
+    save the number under is used, read from the phone directory. Every lookup is an `IN` query over all the
+    numbers at once, so a request costs the same handful of queries however many it carries.
+    """
+    keys = {phone_key(phone_number) for phone_number in phone_numbers}
+    keys.discard(None)
+    spam_counts = spam_cache.report_counts(keys)
+    total_reports = stats.total_reports()
+
+    names = {}
+    if keys:
+        for key, username, top_names in PhoneDirectory.objects.filter(phone_key__in=keys).values_list(
+            'phone_key', 'user__username', 'names',
+        ):
+            names[key] = username or (top_names[0][0] if top_names else None)
+
+    results = []
+    for phone_number in phone_numbers:
+        key = phone_key(phone_number)
+        report_count = spam_counts.get(key, 0)
+        results.append({
+            'phone_number': phone_number,
+            'name': names.get(key),
+            'is_spam': report_count > 0,
+            'report_count': report_count,
+            'spam_likelihood': stats.spam_likelihood(report_count, total_reports),
+        })
+    return results
@@ -0,0 +1,68 @@
+from django.db import transaction
+
+from . import directory, search_index, versions
+from .models import Contact, User
+from .phone import phone_key
+from .signals import contacts_synced
+
+BATCH_SIZE = 1000
+
+
+def sync_contacts(user, entries, delete_missing=True):
+    """
+    Make `user`'s contacts match `entries` (dicts with `name` and `phone_number`).
+
+    Contacts are matched on their canonical number, so "+91 98765 43210" in the payload updates
+    a contact saved as "098765-43210", taking the new spelling. The diff is computed in memory
+    against one read of the existing rows, then applied with `bulk_create`/`bulk_update`/one
+    DELETE per batch, all in a single transaction. Later entries win when the payload repeats
+    a number, so the (user, phone_key) constraint is never hit. Returns a summary of the changes.
+    """
+    incoming = {phone_key(entry['phone_number']): (entry['phone_number'], entry['name']) for entry in entries}
+
+    with transaction.atomic():
+        # Serialise concurrent syncs for the same user; the diff below assumes it sees every row.
+        User.objects.select_for_update().filter(pk=user.pk).values_list('pk', flat=True).first()
+        existing, keyless = {}, []
+        for pk, key, phone_number, name in Contact.objects.filter(user=user).values_list('pk', 'phone_key', 'phone_number', 'name'):
+            if key is None:
+                keyless.append(pk)
+            else:
+                existing[key] = (pk, phone_number, name)
+
+        created = [
+            Contact(user=user, name=incoming[key][1], phone_number=incoming[key][0], phone_key=key)
+            for key in incoming.keys() - existing.keys()
+        ]
+        updated = [
+            Contact(pk=existing[key][0], user=user, name=incoming[key][1], phone_number=incoming[key][0], phone_key=key)
+            for key in incoming.keys() & existing.keys()
+            if existing[key][1:] != incoming[key]
+        ]
+        deleted = []
+        if delete_missing:
+            deleted = [existing[key][0] for key in existing.keys() - incoming.keys()] + keyless
+
+        if created or updated or deleted:
+            with versions.batched(user.pk, versions.CONTACTS), directory.batched(), search_index.batched():
+                Contact.objects.bulk_create(created, batch_size=BATCH_SIZE)
+                Contact.objects.bulk_update(updated, ['name', 'phone_number'], batch_size=BATCH_SIZE)
+                for start in range(0, len(deleted), BATCH_SIZE):
+                    Contact.objects.filter(pk__in=deleted[start:start + BATCH_SIZE]).delete()
+                # The bulk writes send no save signals, so count them into the directory here.
+                directory.adjust(directory.contact_changes(
+                    [(contact.phone_key, contact.phone_number, contact.name) for contact in created + updated], 1,
+                ))
+                directory.adjust(directory.contact_changes(
+                    [(contact.phone_key, *existing[contact.phone_key][1:]) for contact in updated], -1,
+                ))
+
+        if created or updated:
+            contacts_synced.send(sender=Contact, user=user, created=created, updated=updated)
+
+    return {
+        'created': len(created),
+        'updated': len(updated),
+        'deleted': len(deleted),
+        'unchanged': len(incoming) - len(created) - len(updated),
+    }
@@ -0,0 +1,188 @@
+"""
+Bulk generator for sample users, contacts and spam reports (the `populate_data` command).
+
+Rows are written with bulk_create in batches, and the shared password is hashed once. Faker
+output is produced in fixed-size chunks on a process pool. Each chunk seeds its own Faker from
+(seed, chunk), so a given seed yields the same dataset however many workers run.
+
+Phone numbers come from an affine permutation of a 10-digit mobile number space: the i-th
+number is `(a * i + b) mod N`, with `a` coprime to N. Every index maps to a distinct number,
+so uniqueness never requires a retry. Numbers are unique within one run; running again with
+the same seed on a non-empty database skips rows that already exist.
+
+Model imports stay inside functions so pool workers can import this module without Django set up.
+"""
+import logging
+import math
+import multiprocessing
+import random
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 10000
+# Indian mobile numbers: ten digits starting with 6-9.
+PHONE_SPACE_START = 6_000_000_000
+PHONE_SPACE_SIZE = 4_000_000_000
+# Each generated spam number is reported by up to this many distinct users.
+MAX_REPORTS_PER_NUMBER = 20
+
+
+class PhoneNumbers:
+    """Distinct phone numbers for indexes 0 .. PHONE_SPACE_SIZE - 1, scattered by a seeded permutation."""
+
+    def __init__(self, rng):
+        self.multiplier = rng.randrange(1, PHONE_SPACE_SIZE)
+        while math.gcd(self.multiplier, PHONE_SPACE_SIZE) != 1:
+            self.multiplier += 1
+        self.offset = rng.randrange(PHONE_SPACE_SIZE)
+
+    def __getitem__(self, index):
+        return str(PHONE_SPACE_START + (self.multiplier * index + self.offset) % PHONE_SPACE_SIZE)
+
+def _faker(seed, chunk):
+    from faker import Faker
+
+    fake = Faker('en_IN')
+    fake.seed_instance(seed * 1_000_003 + chunk)
+    return fake
+
+def fake_users(seed, chunk, count):
+    """(username, email) pairs for one chunk, deterministic for (seed, chunk)."""
+    fake = _faker(seed, chunk)
+    return [(fake.user_name(), fake.email()) for _ in range(count)]
+
+def fake_names(seed, chunk, count):
+    fake = _faker(seed, chunk)
+    return [fake.name() for _ in range(count)]
+
+def generate_chunks(function, seed, total, workers):
+    """Yield `function(seed, chunk, size)` for consecutive CHUNK_SIZE chunks covering `total` rows, in order."""
+    chunks = [(chunk, min(CHUNK_SIZE, total - start)) for chunk, start in enumerate(range(0, total, CHUNK_SIZE))]
+    if workers <= 1 or len(chunks) <= 1:
+        for chunk, size in chunks:
+            yield function(seed, chunk, size)
+        return
+    # 'spawn' keeps the pool safe to start from a thread of a running web server.
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        yield from pool.map(function, [seed] * len(chunks), *zip(*chunks))
+
+def populate(users=50, contacts_per_user=20, spam_reports=100, batch_size=5000, workers=1, seed=None,
+             password='password123', log=logger.info):
+    """Generate the dataset and refresh the maintained statistics. Returns the rows written."""
+    from django.conf import settings
+    from django.contrib.auth.hashers import make_password
+
+    from . import directory, search_index, stats, versions
+    from .bloom import spam_filter
+    from .models import Contact, SpamReport, User
+    from .phone import phone_key
+    from .search_index import name_index
+    from .spam_cache import spam_cache
+
+    if seed is None:
+        seed = random.randrange(2 ** 32)
+    rng = random.Random(seed)
+    numbers = PhoneNumbers(rng)
+    if users * (contacts_per_user + 1) + spam_reports > PHONE_SPACE_SIZE:
+        raise ValueError('Not enough distinct phone numbers for this many rows.')
+    hashed_password = make_password(password)
+    counts_before = {model: model.objects.count() for model in (User, Contact, SpamReport)}
+
+    log(f'Creating {users} users (seed {seed})...')
+    user_ids = []
+    index = 0
+    for people in generate_chunks(fake_users, seed, users, workers):
+        for start in range(0, len(people), batch_size):
+            batch = [
+                User(
+                    username=f'{username}{index + offset}',
+                    email=email,
+                    phone_number=numbers[index + offset],
+                    phone_key=phone_key(numbers[index + offset]),
+                    password=hashed_password,
+                )
+                for offset, (username, email) in enumerate(people[start:start + batch_size])
+            ]
+            User.objects.bulk_create(batch, ignore_conflicts=True)
+            # Conflicting rows come back without a pk, so look the batch up by number instead.
+            ids = dict(User.objects.filter(phone_key__in=[user.phone_key for user in batch]).values_list('phone_key', 'pk'))
+            user_ids.extend(ids[user.phone_key] for user in batch if user.phone_key in ids)
+            versions.start_many(ids.values())
+            index += len(batch)
+
+    log(f'Creating {contacts_per_user} contacts for each user...')
+    index = users
+    if user_ids and contacts_per_user:
+        batch = []
+        for names in generate_chunks(fake_names, seed + 1, len(user_ids) * contacts_per_user, workers):
+            for name in names:
+                number = numbers[index]
+                batch.append(Contact(
+                    user_id=user_ids[(index - users) // contacts_per_user],
+                    name=name,
+                    phone_number=number,
+                    phone_key=phone_key(number),
+                ))
+                index += 1
+                if len(batch) >= batch_size:
+                    Contact.objects.bulk_create(batch, ignore_conflicts=True)
+                    batch = []
+        if batch:
+            Contact.objects.bulk_create(batch, ignore_conflicts=True)
+
+    log(f'Creating {spam_reports} spam reports...')
+    if user_ids and spam_reports:
+        # Report r targets spam number r % spammers, filed by a reporter distinct from the other
+        # reporters of that number, so (number, reporter) pairs never repeat.
+        spammers = math.ceil(spam_reports / min(len(user_ids), MAX_REPORTS_PER_NUMBER))
+        created_contacts = index - users
+        if spammers <= created_contacts:
+            spam_numbers = [numbers[users + i] for i in rng.sample(range(created_contacts), spammers)]
+        else:
+            spam_numbers = [numbers[index + i] for i in range(spammers)]
+        for start in range(0, spam_reports, batch_size):
+            batch = []
+            for r in range(start, min(start + batch_size, spam_reports)):
+                number = spam_numbers[r % spammers]
+                reporter = user_ids[(r // spammers + (r % spammers) * 7919) % len(user_ids)]
+                batch.append(SpamReport(phone_number=number, phone_key=phone_key(number), reported_by_id=reporter))
+            SpamReport.objects.bulk_create(batch, ignore_conflicts=True)
+
+    # bulk_create skips the signals that keep these up to date, so refresh them in one pass.
+    log('Rebuilding spam statistics...')
+    stats.rebuild(batch_size=batch_size)
+    log('Rebuilding the phone directory...')
+    directory.rebuild(batch_size=batch_size)
+    spam_cache.clear()
+    if settings.NAME_SEARCH_INDEX_ENABLED:
+        search_index.log_bulk_load()
+        name_index.build()
+    if settings.SPAM_FILTER_ENABLED:
+        spam_filter.build()
+    return {model._meta.verbose_name_plural: model.objects.count() - before for model, before in counts_before.items()}
+
+_population = None
+_population_lock = threading.Lock()
+
+def start_population(**options):
+    """Run `populate(**options)` in a background thread. Returns False if a run is already going."""
+    global _population
+    with _population_lock:
+        if _population is not None and _population.is_alive():
+            return False
+        _population = threading.Thread(target=_populate, kwargs=options, name='populate-data', daemon=True)
+        _population.start()
+    return True
+
+def _populate(**options):
+    try:
+        written = populate(**options)
+        logger.info('Sample data population complete: %s', written)
+    except Exception:
+        logger.exception('Sample data population failed')
+    finally:
+        close_old_connections()
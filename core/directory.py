@@ -0,0 +1,212 @@
+"""
+The phone directory: one PhoneDirectory row per number that belongs to a registered user or is
+in anybody's contacts, so a phone search reads a single row however many people saved it.
+
+PhoneDirectoryName counts the contacts that save a number under each name, and the number's
+directory row keeps the PHONE_DIRECTORY_NAMES most common of them. Both are adjusted in the
+transaction that writes the contacts. A writer locks the directory rows of its numbers before
+anything else, so writers to the same number queue on that row, and each one reads the counts
+and top names the one before it committed. `rebuild()` recomputes everything, for after bulk
+loads that skip the signals.
+"""
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from itertools import groupby
+from operator import itemgetter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Min, Window
+from django.db.models.functions import RowNumber
+
+from .models import Contact, PhoneDirectory, PhoneDirectoryName, User
+from .stats import UPDATE_BATCH_SIZE
+
+_local = threading.local()
+
+
+def top_names(counts, limit=None):
+    """The `limit` most common of (name, count) pairs as [name, count] lists, ties by name."""
+    limit = settings.PHONE_DIRECTORY_NAMES if limit is None else limit
+    return [[name, count] for name, count in sorted(counts, key=lambda pair: (-pair[1], pair[0]))[:limit]]
+
+def register(users):
+    """Point the directory rows of (user id, phone_key, phone_number) triples at their users."""
+    PhoneDirectory.objects.bulk_create(
+        [PhoneDirectory(phone_key=key, phone_number=phone_number, user_id=pk) for pk, key, phone_number in users if key is not None],
+        update_conflicts=True,
+        unique_fields=['phone_key'],
+        update_fields=['user'],
+    )
+
+def adjust(changes):
+    """
+    Count contacts in or out of the directory. `changes` are (phone_key, phone_number, name,
+    delta) tuples; inside `batched()` they are applied when the block ends.
+    """
+    pending = getattr(_local, 'pending', None)
+    if pending is not None:
+        pending.extend(changes)
+    else:
+        _apply(list(changes))
+
+@contextmanager
+def batched():
+    """Apply the adjustments of a block of contact writes together, in one pass at the end."""
+    if getattr(_local, 'pending', None) is not None:
+        yield
+        return
+    _local.pending = []
+    try:
+        yield
+        changes = _local.pending
+    finally:
+        _local.pending = None
+    _apply(changes)
+
+def _apply(changes):
+    deltas = defaultdict(int)
+    totals = defaultdict(int)
+    numbers = {}
+    for key, phone_number, name, delta in changes:
+        if key is not None:
+            deltas[key, name] += delta
+            totals[key] += delta
+            numbers.setdefault(key, phone_number)
+    deltas = {pair: delta for pair, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    with transaction.atomic(savepoint=False):
+        _write(deltas, totals, numbers)
+
+def _batches(items):
+    for start in range(0, len(items), UPDATE_BATCH_SIZE):
+        yield items[start:start + UPDATE_BATCH_SIZE]
+
+def _by_delta(deltas):
+    """Group the keys of `deltas` by value, so each group is one UPDATE without a CASE."""
+    groups = defaultdict(list)
+    for item, delta in deltas.items():
+        groups[delta].append(item)
+    return groups
+
+def _write(deltas, totals, numbers):
+    keys = sorted({key for key, _ in deltas})
+    limit = settings.PHONE_DIRECTORY_NAMES
+
+    PhoneDirectory.objects.bulk_create(
+        [PhoneDirectory(phone_key=key, phone_number=numbers[key]) for key in sorted({key for (key, _), delta in deltas.items() if delta > 0})],
+        ignore_conflicts=True,
+    )
+    # Lock the directory rows before touching their names; the lock is held to the end of the transaction.
+    entries, existing = {}, {}
+    for batch in _batches(keys):
+        rows = (
+            PhoneDirectory.objects.select_for_update().filter(phone_key__in=batch).order_by('phone_key')
+            .values_list('phone_key', 'contact_count', 'user_id', 'names')
+        )
+        entries.update((key, (count, user_id, names)) for key, count, user_id, names in rows)
+        rows = PhoneDirectoryName.objects.filter(
+            phone_key__in=batch, name__in={name for key, name in deltas if key in entries},
+        ).values_list('phone_key', 'name', 'pk', 'count')
+        existing.update(((key, name), (pk, count)) for key, name, pk, count in rows if (key, name) in deltas)
+
+    created, changed, emptied = [], {}, []
+    counts = defaultdict(dict)
+    for (key, name), delta in deltas.items():
+        pk, count = existing.get((key, name), (None, 0))
+        counts[key][name] = max(count + delta, 0)
+        if pk is None:
+            if delta > 0:
+                created.append(PhoneDirectoryName(phone_key=key, name=name, count=delta))
+        elif count + delta > 0:
+            changed[pk] = delta
+        else:
+            emptied.append(pk)
+    PhoneDirectoryName.objects.bulk_create(created)
+    for delta, pks in _by_delta(changed).items():
+        for batch in _batches(pks):
+            PhoneDirectoryName.objects.filter(pk__in=batch).update(count=F('count') + delta)
+    for batch in _batches(emptied):
+        PhoneDirectoryName.objects.filter(pk__in=batch).delete()
+
+    # The new top names follow from the old ones and the changed counts, unless a name in a full
+    # list lost contacts and one outside it may now outrank it; those are read back.
+    names, stale = {}, []
+    for key in entries:
+        current = entries[key][2]
+        if len(current) >= limit and any(counts[key].get(name, count) < count for name, count in current):
+            stale.append(key)
+        else:
+            merged = {name: count for name, count in current}
+            merged.update(counts[key])
+            names[key] = top_names((name, count) for name, count in merged.items() if count > 0)
+    for batch in _batches(stale):
+        ranked = defaultdict(list)
+        rows = (
+            PhoneDirectoryName.objects.filter(phone_key__in=batch)
+            .annotate(rank=Window(RowNumber(), partition_by=F('phone_key'), order_by=[F('count').desc(), F('name').asc()]))
+            .filter(rank__lte=limit)
+            .values_list('phone_key', 'name', 'count')
+        )
+        for key, name, count in rows:
+            ranked[key].append((name, count))
+        names.update((key, top_names(ranked[key])) for key in batch)
+
+    empty = {key for key, (count, user_id, _) in entries.items() if count + totals[key] <= 0 and user_id is None}
+    for batch in _batches(sorted(empty)):
+        PhoneDirectory.objects.filter(phone_key__in=batch).delete()
+    changed = {key: totals[key] for key in entries if key not in empty and totals[key]}
+    for delta, group in _by_delta(changed).items():
+        for batch in _batches(group):
+            PhoneDirectory.objects.filter(phone_key__in=batch).update(contact_count=F('contact_count') + delta)
+    PhoneDirectory.objects.bulk_update(
+        [PhoneDirectory(phone_key=key, names=names[key]) for key, (_, _, current) in entries.items() if key not in empty and names[key] != current],
+        ['names'],
+        batch_size=UPDATE_BATCH_SIZE,
+    )
+
+def contact_changes(contacts, delta):
+    """`adjust()` changes for (phone_key, phone_number, name) rows."""
+    return [(key, phone_number, name, delta) for key, phone_number, name in contacts]
+
+def rebuild(batch_size=1000):
+    """Recompute the directory from the contacts and users tables."""
+    with transaction.atomic():
+        PhoneDirectoryName.objects.all().delete()
+        PhoneDirectory.objects.all().delete()
+        rows = (
+            Contact.objects.exclude(phone_key=None)
+            .values('phone_key', 'name')
+            .annotate(count=Count('pk'), number=Min('phone_number'))
+            .order_by('phone_key', 'name')
+        )
+        entries, names = [], []
+        for key, group in groupby(rows.iterator(chunk_size=batch_size), key=itemgetter('phone_key')):
+            group = list(group)
+            names += [PhoneDirectoryName(phone_key=key, name=row['name'], count=row['count']) for row in group]
+            entries.append(PhoneDirectory(
+                phone_key=key,
+                phone_number=min(row['number'] for row in group),
+                contact_count=sum(row['count'] for row in group),
+                names=top_names((row['name'], row['count']) for row in group),
+            ))
+            if len(entries) >= batch_size:
+                PhoneDirectory.objects.bulk_create(entries)
+                entries = []
+            if len(names) >= batch_size:
+                PhoneDirectoryName.objects.bulk_create(names)
+                names = []
+        PhoneDirectory.objects.bulk_create(entries)
+        PhoneDirectoryName.objects.bulk_create(names)
+
+        users = User.objects.exclude(phone_key=None).order_by('pk').values_list('pk', 'phone_key', 'phone_number')
+        batch = []
+        for user in users.iterator(chunk_size=batch_size):
+            batch.append(user)
+            if len(batch) >= batch_size:
+                register(batch)
+                batch = []
+        register(batch)
+    return {'phone_numbers': PhoneDirectory.objects.count(), 'names': PhoneDirectoryName.objects.count()}
@@ -0,0 +1,62 @@
+"""
+Read-only serializers for the large list responses, without DRF's per-row field machinery.
+
+A RowSerializer takes plain rows, either dicts (from `.values()`, or built by the view) or
+tuples in `fields` order (from `.values_list(*fields)`), and returns the dicts its DRF
+counterpart `drf_serializer` would. The field accessor (one itemgetter over all the fields) is
+built once per class, so a row costs one C-level lookup and one dict build instead of a
+to_representation() call per field. Only fields whose rows may hold another type than the
+output one have a conversion. The tests check every RowSerializer against its DRF serializer.
+"""
+from operator import itemgetter
+
+from rest_framework.utils.serializer_helpers import ReturnDict, ReturnList
+
+from .serializers import ContactSerializer, SearchResultSerializer, SpamReportSerializer
+
+
+class RowSerializer:
+    fields = ()
+    # Field name -> function matching the DRF field's to_representation(), for fields the rows
+    # may hold in another type.
+    conversions = {}
+    drf_serializer = None
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        getter = itemgetter(*cls.fields)
+        # itemgetter() of a single key returns the value rather than a 1-tuple.
+        cls._values = getter if len(cls.fields) > 1 else staticmethod(lambda row: (getter(row),))
+        cls._conversions = tuple(cls.conversions.items())
+
+    def __init__(self, instance=None, many=False, **kwargs):
+        self.instance = instance
+        self.many = many
+
+    @classmethod
+    def represent(cls, row):
+        data = dict(zip(cls.fields, cls._values(row) if isinstance(row, dict) else row))
+        for name, convert in cls._conversions:
+            if data[name] is not None:
+                data[name] = convert(data[name])
+        return data
+
+    @property
+    def data(self):
+        if self.many:
+            represent = self.represent
+            return ReturnList([represent(row) for row in self.instance], serializer=self)
+        return ReturnDict(self.represent(self.instance), serializer=self)
+
+class ContactRowSerializer(RowSerializer):
+    fields = ('id', 'name', 'phone_number')
+    drf_serializer = ContactSerializer
+
+class SearchResultRowSerializer(RowSerializer):
+    fields = ('name', 'phone_number', 'spam_likelihood')
+    conversions = {'spam_likelihood': float}
+    drf_serializer = SearchResultSerializer
+
+class SpamNumberRowSerializer(RowSerializer):
+    fields = ('phone_number',)
+    drf_serializer = SpamReportSerializer
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core import stats
+
+
+class Command(BaseCommand):
+    help = 'Rolls expired buckets off the rolling spam report windows; run it every few minutes'
+
+    def handle(self, *args, **options):
+        result = stats.compact_windows()
+        rolled_out = ', '.join(f'{count} from {column}' for column, count in result['rolled_out'].items())
+        self.stdout.write(self.style.SUCCESS(
+            f"Rolled out {rolled_out}; deleted {result['pruned_buckets']} expired buckets."
+        ))
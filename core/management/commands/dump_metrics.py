@@ -0,0 +1,25 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core import metrics
+
+
+class Command(BaseCommand):
+    help = 'Prints the request metrics snapshot merged across every process writing to METRICS_SNAPSHOT_DIR'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=('json', 'prometheus'), default='json', help='Output format')
+        parser.add_argument('--dir', default=None, help='Snapshot directory (default: METRICS_SNAPSHOT_DIR)')
+        parser.add_argument('--max-age', type=float, default=None, help='Ignore snapshots older than this many seconds')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or settings.METRICS_SNAPSHOT_DIR
+        if not directory:
+            raise CommandError('No snapshot directory: set METRICS_SNAPSHOT_DIR or pass --dir.')
+        merged = metrics.merge_snapshots(metrics.read_snapshots(directory, options['max_age']))
+        if options['format'] == 'prometheus':
+            self.stdout.write(metrics.render_prometheus(merged), ending='')
+        else:
+            self.stdout.write(json.dumps(merged, indent=2))
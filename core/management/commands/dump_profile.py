@@ -0,0 +1,31 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core import profiling
+
+
+class Command(BaseCommand):
+    help = (
+        'Prints the current profiling session merged across every process writing to PROFILER_DIR, '
+        'as collapsed stacks for flame graphs or as a JSON summary by route'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=('collapsed', 'json'), default='collapsed', help='Output format')
+        parser.add_argument('--route', default=None, help='Only this route\'s stacks (collapsed format)')
+        parser.add_argument('--dir', default=None, help='Profile directory (default: PROFILER_DIR)')
+
+    def handle(self, *args, **options):
+        directory = options['dir'] or settings.PROFILER_DIR
+        if not directory:
+            raise CommandError('No profile directory: set PROFILER_DIR or pass --dir.')
+        session = profiling.read_session(directory)
+        if session is None:
+            raise CommandError(f'No profiling session in {directory}; start one with POST /api/profiler/.')
+        merged = profiling.merge_snapshots(session, profiling.read_snapshots(session, directory))
+        if options['format'] == 'json':
+            self.stdout.write(json.dumps(profiling.summary(merged), indent=2))
+        else:
+            self.stdout.write(profiling.render_collapsed(merged, options['route']), ending='')
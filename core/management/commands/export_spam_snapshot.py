@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core import snapshot
+
+
+class Command(BaseCommand):
+    help = 'Writes the spam list as a binary snapshot for /api/spam/snapshot/ and prunes old snapshots'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dir', default=None, help='Snapshot directory (default: SPAM_SNAPSHOT_DIR)')
+        parser.add_argument('--keep', type=int, default=None, help='Snapshots to keep (default: SPAM_SNAPSHOT_KEEP)')
+
+    def handle(self, *args, **options):
+        result = snapshot.export_snapshot(options['dir'], options['keep'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Wrote spam list version {result['version']} ({result['numbers']} numbers) to {result['path']}."
+        ))
@@ -1,11 +1,10 @@
-from django.core.management.base import BaseCommand
-from django.contrib.auth import get_user_model
-from core.models import Contact, SpamReport
-from faker import Faker
-import random
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.datagen import populate
 
-User = get_user_model()
-fake = Faker('en_IN')
 
 class Command(BaseCommand):
     help = 'Populates the database with sample data'
@@ -14,75 +13,27 @@ class Command(BaseCommand):
         parser.add_argument('--users', type=int, default=50, help='Number of users to create')
         parser.add_argument('--contacts-per-user', type=int, default=20, help='Number of contacts per user')
         parser.add_argument('--spam-reports', type=int, default=100, help='Number of spam reports to create')
+        parser.add_argument('--batch-size', type=int, default=5000, help='Number of rows to insert per query')
+        parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Processes generating fake names')
+        parser.add_argument('--seed', type=int, default=None, help='Random seed, for a reproducible dataset')
+        parser.add_argument('--password', default='password123', help='Password shared by every generated user')
 
     def handle(self, *args, **options):
-        num_users = options['users']
-        contacts_per_user = options['contacts_per_user']
-        num_spam_reports = options['spam_reports']
-
-        self.stdout.write(self.style.SUCCESS(f'Creating {num_users} users...'))
-        users = []
-        all_phone_numbers = set()
-
-        for i in range(num_users):
-            username = fake.user_name() + str(i)
-            phone_number = fake.phone_number()
-            email = fake.email()
-            password = 'password123'
-            try:
-                user = User.objects.create_user(username=username, phone_number=phone_number, email=email, password=password)
-                users.append(user)
-                all_phone_numbers.add(phone_number)  
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f'Error creating user {username}: {e}'))
-
-        self.stdout.write(self.style.SUCCESS(f'Creating contacts for each user...'))
-        
-        for user in users:
-            for _ in range(contacts_per_user):
-                name = fake.name()
-                contact_phone = fake.phone_number()
-                while contact_phone in all_phone_numbers: 
-                    contact_phone = fake.phone_number()
-                all_phone_numbers.add(contact_phone)  
-                try:
-                    Contact.objects.create(user=user, name=name, phone_number=contact_phone)
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f'Error creating contact for {user.username}: {e}'))
-
-        self.stdout.write(self.style.SUCCESS('Sample data population complete.'))
-        num_users = options['users']
-        contacts_per_user = options['contacts_per_user']
-        num_spam_reports = options['spam_reports']
-
-        self.stdout.write(self.style.SUCCESS(f'Creating {num_users} users...'))
-        users = []
-        all_phone_numbers = set() 
-
-        for i in range(num_users):
-            username = fake.user_name() + str(i)
-            phone_number = fake.phone_number()
-            email = fake.email()
-            password = 'password123'
-            try:
-                user = User.objects.create_user(username=username, phone_number=phone_number, email=email, password=password)
-                users.append(user)
-                all_phone_numbers.add(phone_number)  
-            except Exception as e:
-                self.stdout.write(self.style.ERROR(f'Error creating user {username}: {e}'))
-
-        self.stdout.write(self.style.SUCCESS(f'Creating contacts for each user...'))
-                
-        for user in users:
-            for _ in range(contacts_per_user):
-                name = fake.name()
-                contact_phone = fake.phone_number()
-                while contact_phone in all_phone_numbers:  
-                    contact_phone = fake.phone_number()
-                all_phone_numbers.add(contact_phone)  
-                try:
-                    Contact.objects.create(user=user, name=name, phone_number=contact_phone)
-                except Exception as e:
-                    self.stdout.write(self.style.ERROR(f'Error creating contact for {user.username}: {e}'))
-
-        self.stdout.write(self.style.SUCCESS('Sample data population complete.'))
+        start = time.perf_counter()
+        try:
+            written = populate(
+                users=options['users'],
+                contacts_per_user=options['contacts_per_user'],
+                spam_reports=options['spam_reports'],
+                batch_size=options['batch_size'],
+                workers=options['workers'],
+                seed=options['seed'],
+                password=options['password'],
+                log=lambda message: self.stdout.write(self.style.SUCCESS(message)),
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        summary = ', '.join(f'{count} {name}' for name, count in written.items())
+        self.stdout.write(self.style.SUCCESS(
+            f'Sample data population complete in {time.perf_counter() - start:.1f}s: {summary}.'
+        ))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from core import directory
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the phone directory (registered user and most common contact names per number) from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows to insert per query')
+
+    def handle(self, *args, **options):
+        result = directory.rebuild(batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt the phone directory: {result['phone_numbers']} phone numbers, {result['names']} contact names."
+        ))
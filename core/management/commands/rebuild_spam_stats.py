@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+
+from core import stats
+from core.spam_cache import spam_cache
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the maintained spam statistics (per-number report counts and global totals) from scratch'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of rows to insert per query')
+
+    def handle(self, *args, **options):
+        result = stats.rebuild(batch_size=options['batch_size'])
+        spam_cache.clear()
+        self.stdout.write(self.style.SUCCESS(
+            f"Rebuilt spam statistics: {result['phone_numbers']} phone numbers, "
+            f"{result['spam_reports']} spam reports, {result['users']} users."
+        ))
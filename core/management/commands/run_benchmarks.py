@@ -0,0 +1,69 @@
+import json
+from datetime import datetime, timezone
+
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+from core import benchmark
+
+
+class Command(BaseCommand):
+    help = (
+        'Seeds throwaway test databases at the given scales, benchmarks every API endpoint and '
+        'fails if any exceeds its query or latency budget'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', default='1k', help="Comma-separated contact counts, e.g. '1k,100k,1m' or '5000'")
+        parser.add_argument('--iterations', type=int, default=20, help='Requests per endpoint')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed for the generated dataset')
+        parser.add_argument('--budgets', default=str(benchmark.BUDGETS_PATH), help='Budget file to check against')
+        parser.add_argument('--output', default='-', help="Where to write the JSON results ('-' for stdout)")
+        parser.add_argument('--no-latency-budgets', action='store_true', help='Only enforce query budgets')
+
+    def handle(self, *args, **options):
+        try:
+            scales = {name: benchmark.parse_scale(name) for name in options['scales'].split(',')}
+        except ValueError:
+            raise CommandError(f"Invalid --scales value: {options['scales']}")
+        budgets = benchmark.load_budgets(options['budgets'])
+
+        report = {
+            'generated_at': datetime.now(timezone.utc).isoformat(),
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'seed': options['seed'],
+            'scales': {},
+            'violations': [],
+        }
+        old_name = connection.settings_dict['NAME']
+        setup_test_environment()
+        connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            for name, contacts in scales.items():
+                self.stderr.write(f'Benchmarking {name} ({contacts} contacts)...')
+                call_command('flush', interactive=False, verbosity=0)
+                result = benchmark.run_scale(contacts, options['iterations'], options['seed'])
+                report['scales'][name] = result
+                report['violations'] += benchmark.check_budgets(
+                    name, result['endpoints'], budgets, latency=not options['no_latency_budgets'],
+                )
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+        report['serialization'] = benchmark.measure_serialization()
+
+        output = json.dumps(report, indent=2)
+        if options['output'] == '-':
+            self.stdout.write(output)
+        else:
+            with open(options['output'], 'w') as f:
+                f.write(output + '\n')
+
+        if report['violations']:
+            for violation in report['violations']:
+                self.stderr.write(self.style.ERROR(violation))
+            raise CommandError(f"{len(report['violations'])} benchmark budget(s) exceeded")
+        self.stderr.write(self.style.SUCCESS('All endpoints within budget.'))
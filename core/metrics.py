@@ -0,0 +1,280 @@
+"""
+Per-route request metrics: request counts by status, a latency histogram, SQL queries and SQL
+time, and response bytes, keyed by (URL name, method).
+
+Recording takes no lock. Each thread writes to its own shard, and readers merge the shards
+when they build a snapshot. Counters are plain ints updated under the GIL, so a snapshot
+taken mid-request is at worst one request behind. The shards of threads that have exited are
+folded into one process total, so servers that replace their threads don't accumulate them.
+
+Queries are counted by an execute wrapper installed once on every database connection. It
+reports to the current request's QueryTimer through a context variable, which also reaches
+the threads that run the async ORM.
+
+Each process also writes its snapshot to METRICS_SNAPSHOT_DIR every METRICS_SNAPSHOT_SECONDS
+from a background thread, and once more at exit. The Prometheus endpoint and the dump_metrics
+command merge those files, so they cover every worker process and not just the one answering.
+"""
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from pathlib import Path
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds, in seconds, of the latency histogram buckets; the last bucket is +Inf.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+UNMATCHED_ROUTE = 'unmatched'
+
+
+class RouteStats:
+    __slots__ = ('statuses', 'buckets', 'duration', 'queries', 'query_seconds', 'response_bytes')
+
+    def __init__(self):
+        self.statuses = {}
+        self.buckets = [0] * (len(DURATION_BUCKETS) + 1)
+        self.duration = 0.0
+        self.queries = 0
+        self.query_seconds = 0.0
+        self.response_bytes = 0
+
+    def as_dict(self):
+        return {
+            'statuses': {str(code): count for code, count in self.statuses.items()},
+            'buckets': list(self.buckets),
+            'duration': self.duration,
+            'queries': self.queries,
+            'query_seconds': self.query_seconds,
+            'response_bytes': self.response_bytes,
+        }
+
+    def add(self, other):
+        for status, count in other.statuses.items():
+            self.statuses[status] = self.statuses.get(status, 0) + count
+        self.buckets = [a + b for a, b in zip(self.buckets, other.buckets)]
+        self.duration += other.duration
+        self.queries += other.queries
+        self.query_seconds += other.query_seconds
+        self.response_bytes += other.response_bytes
+
+class QueryTimer:
+    """The number of queries one request issued and the time they took."""
+
+    def __init__(self):
+        self.queries = 0
+        self.seconds = 0.0
+
+current_query_timer = ContextVar('current_query_timer', default=None)
+
+def count_queries(execute, sql, params, many, context):
+    timer = current_query_timer.get()
+    if timer is None:
+        return execute(sql, params, many, context)
+    start = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        timer.seconds += time.perf_counter() - start
+        timer.queries += 1
+
+def instrument_connection(connection):
+    if count_queries not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_queries)
+
+class Metrics:
+    def __init__(self):
+        self._local = threading.local()
+        # Thread -> its shard, and the totals of the threads that have exited.
+        self._shards = {}
+        self._retired = {}
+        self._lock = threading.Lock()
+        self._writer = None
+
+    def _shard(self):
+        shard = getattr(self._local, 'routes', None)
+        if shard is None:
+            shard = self._local.routes = {}
+            with self._lock:
+                self._retire_exited()
+                self._shards[threading.current_thread()] = shard
+        return shard
+
+    def _retire_exited(self):
+        """Fold the shards of exited threads into the process total. Call with the lock held."""
+        for thread in [thread for thread in self._shards if not thread.is_alive()]:
+            for key, stats in self._shards.pop(thread).items():
+                retired = self._retired.get(key)
+                if retired is None:
+                    retired = self._retired[key] = RouteStats()
+                retired.add(stats)
+
+    def record(self, route, method, status, duration, queries, query_seconds, response_bytes):
+        shard = self._shard()
+        stats = shard.get((route, method))
+        if stats is None:
+            stats = shard[(route, method)] = RouteStats()
+        stats.statuses[status] = stats.statuses.get(status, 0) + 1
+        stats.buckets[bisect_left(DURATION_BUCKETS, duration)] += 1
+        stats.duration += duration
+        stats.queries += queries
+        stats.query_seconds += query_seconds
+        stats.response_bytes += response_bytes
+
+    def snapshot(self):
+        """This process's totals as a JSON-serialisable dict."""
+        routes = {}
+        with self._lock:
+            self._retire_exited()
+            for (route, method), stats in self._retired.items():
+                routes[f'{route} {method}'] = [stats.as_dict()]
+            shards = list(self._shards.values())
+        for shard in shards:
+            for (route, method), stats in list(shard.items()):
+                routes.setdefault(f'{route} {method}', []).append(stats.as_dict())
+        return {
+            'pid': os.getpid(),
+            'written_at': time.time(),
+            'duration_buckets': list(DURATION_BUCKETS),
+            'routes': {key: merge_route_stats(parts) for key, parts in routes.items()},
+        }
+
+    def reset(self):
+        with self._lock:
+            self._retired.clear()
+            for shard in self._shards.values():
+                shard.clear()
+
+    def start_snapshots(self):
+        """Start writing this process's snapshot to METRICS_SNAPSHOT_DIR, once per process."""
+        if not settings.METRICS_SNAPSHOT_DIR:
+            return
+        with self._lock:
+            if self._writer is not None and self._writer[0] == os.getpid():
+                return
+            thread = threading.Thread(target=self._write_snapshots, name='metrics-snapshots', daemon=True)
+            self._writer = (os.getpid(), thread)
+        atexit.register(self.write_snapshot)
+        thread.start()
+
+    def _write_snapshots(self):
+        while True:
+            time.sleep(settings.METRICS_SNAPSHOT_SECONDS)
+            try:
+                self.write_snapshot()
+            except Exception:
+                logger.exception('Writing the metrics snapshot failed')
+
+    def write_snapshot(self):
+        directory = Path(settings.METRICS_SNAPSHOT_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f'metrics-{os.getpid()}.json'
+        temporary = path.with_suffix('.tmp')
+        temporary.write_text(json.dumps(self.snapshot()))
+        os.replace(temporary, path)
+
+def merge_route_stats(parts):
+    merged = {'statuses': {}, 'buckets': [0] * (len(DURATION_BUCKETS) + 1), 'duration': 0.0,
+              'queries': 0, 'query_seconds': 0.0, 'response_bytes': 0}
+    for part in parts:
+        for code, count in part['statuses'].items():
+            merged['statuses'][code] = merged['statuses'].get(code, 0) + count
+        merged['buckets'] = [a + b for a, b in zip(merged['buckets'], part['buckets'])]
+        for field in ('duration', 'queries', 'query_seconds', 'response_bytes'):
+            merged[field] += part[field]
+    return merged
+
+def read_snapshots(directory=None, max_age=None, exclude_pid=None):
+    """
+    Snapshots written by (other) processes within the last `max_age` seconds. Files older than
+    METRICS_SNAPSHOT_MAX_AGE belong to processes that have exited, and are deleted.
+    """
+    directory = Path(directory or settings.METRICS_SNAPSHOT_DIR or '')
+    max_age = settings.METRICS_SNAPSHOT_MAX_AGE if max_age is None else max_age
+    expire_after = max(max_age, settings.METRICS_SNAPSHOT_MAX_AGE)
+    if not directory.is_dir():
+        return []
+    snapshots = []
+    for path in sorted(directory.glob('metrics-*')):
+        try:
+            age = time.time() - path.stat().st_mtime
+            if age > expire_after:
+                path.unlink(missing_ok=True)
+                continue
+            if age > max_age or path.suffix != '.json':
+                continue
+            snapshot = json.loads(path.read_text())
+        except (OSError, ValueError):
+            continue
+        if snapshot.get('pid') == exclude_pid or time.time() - snapshot.get('written_at', 0) > max_age:
+            continue
+        if snapshot.get('duration_buckets') != list(DURATION_BUCKETS):
+            continue
+        snapshots.append(snapshot)
+    return snapshots
+
+def merge_snapshots(snapshots):
+    routes = {}
+    for snapshot in snapshots:
+        for key, stats in snapshot['routes'].items():
+            routes.setdefault(key, []).append(stats)
+    return {
+        'processes': len(snapshots),
+        'duration_buckets': list(DURATION_BUCKETS),
+        'routes': {key: merge_route_stats(parts) for key, parts in sorted(routes.items())},
+    }
+
+def service_snapshot():
+    """Live totals of this process merged with the latest snapshots of the other processes."""
+    return merge_snapshots([metrics.snapshot()] + read_snapshots(exclude_pid=os.getpid()))
+
+def _labels(**labels):
+    escaped = (
+        name + '="' + str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+        for name, value in labels.items()
+    )
+    return '{' + ','.join(escaped) + '}'
+
+def render_prometheus(merged):
+    """Prometheus text exposition (format 0.0.4) of a merged snapshot."""
+    lines = [
+        '# HELP phonebook_http_requests_total Requests served, by route, method and status.',
+        '# TYPE phonebook_http_requests_total counter',
+    ]
+    routes = [(key.rsplit(' ', 1), stats) for key, stats in merged['routes'].items()]
+    for (route, method), stats in routes:
+        for code, count in sorted(stats['statuses'].items()):
+            lines.append(f'phonebook_http_requests_total{_labels(route=route, method=method, status=code)} {count}')
+
+    lines += [
+        '# HELP phonebook_http_request_duration_seconds Request latency, by route and method.',
+        '# TYPE phonebook_http_request_duration_seconds histogram',
+    ]
+    for (route, method), stats in routes:
+        cumulative = 0
+        for bound, count in zip(list(DURATION_BUCKETS) + ['+Inf'], stats['buckets']):
+            cumulative += count
+            labels = _labels(route=route, method=method, le=bound)
+            lines.append(f'phonebook_http_request_duration_seconds_bucket{labels} {cumulative}')
+        labels = _labels(route=route, method=method)
+        lines.append(f'phonebook_http_request_duration_seconds_sum{labels} {stats["duration"]}')
+        lines.append(f'phonebook_http_request_duration_seconds_count{labels} {cumulative}')
+
+    for name, field, help_text in (
+        ('phonebook_db_queries_total', 'queries', 'SQL queries issued while serving requests.'),
+        ('phonebook_db_query_seconds_total', 'query_seconds', 'Time spent executing SQL while serving requests.'),
+        ('phonebook_http_response_bytes_total', 'response_bytes', 'Response body bytes sent.'),
+    ):
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for (route, method), stats in routes:
+            lines.append(f'{name}{_labels(route=route, method=method)} {stats[field]}')
+    return '\n'.join(lines) + '\n'
+
+
+metrics = Metrics()
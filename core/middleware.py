@@ -0,0 +1,187 @@
+import sys
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from django.conf import settings
+
+from . import replicas
+from .metrics import UNMATCHED_ROUTE, QueryTimer, current_query_timer, metrics
+from .profiling import profiler
+
+
+class RequestMetricsMiddleware:
+    """
+    Records latency, SQL queries and SQL time, and response size of every request under its
+    resolved URL name (see core/metrics.py). Should be first in MIDDLEWARE so the timings
+    cover the other middleware too.
+
+    A streamed response is recorded once it has been sent, so the queries issued while
+    streaming are included. File responses, and streamed responses under ASGI, are recorded when
+    the view returns, with their Content-Length as the size when it is known.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+        metrics.start_snapshots()
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        start = time.perf_counter()
+        timer = QueryTimer()
+        current_query_timer.set(timer)
+        response = self.get_response(request)
+        # Wrapping a file response would stop the server sending it with sendfile.
+        if response.streaming and getattr(response, 'file_to_stream', None) is None:
+            response.streaming_content = self.stream(request, response, response.streaming_content, start, timer)
+            return response
+        current_query_timer.set(None)
+        self.record(request, response, start, timer, self.size(response))
+        return response
+
+    async def __acall__(self, request):
+        start = time.perf_counter()
+        timer = QueryTimer()
+        current_query_timer.set(timer)
+        response = await self.get_response(request)
+        current_query_timer.set(None)
+        self.record(request, response, start, timer, self.size(response))
+        return response
+
+    def size(self, response):
+        if response.streaming:
+            return int(response.get('Content-Length', 0))
+        return len(response.content)
+
+    def stream(self, request, response, content, start, timer):
+        size = 0
+        try:
+            for chunk in content:
+                size += len(chunk)
+                yield chunk
+        finally:
+            current_query_timer.set(None)
+            self.record(request, response, start, timer, size)
+
+    def record(self, request, response, start, timer, size):
+        match = request.resolver_match
+        metrics.record(
+            match.view_name if match is not None else UNMATCHED_ROUTE,
+            request.method,
+            response.status_code,
+            time.perf_counter() - start,
+            timer.queries,
+            timer.seconds,
+            size,
+        )
+
+class ReplicaPinningMiddleware:
+    """
+    Tracks which database the request reads from (see core/replicas.py). A request that wrote
+    pins its user to the primary for a while, so their next reads see the write.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        state = replicas.begin_request()
+        response = self.get_response(request)
+        self.pin(request, state)
+        return response
+
+    async def __acall__(self, request):
+        state = replicas.begin_request()
+        response = await self.get_response(request)
+        if state.wrote:
+            # Resolving request.user may query the session.
+            await sync_to_async(self.pin)(request, state)
+        return response
+
+    def pin(self, request, state):
+        user = getattr(request, 'user', None)
+        if state.wrote and settings.DATABASE_REPLICAS and user is not None and user.is_authenticated:
+            replicas.pin(user.pk)
+
+class ThrottleHeadersMiddleware:
+    """
+    Adds the caller's token budget (see core/throttling.py) to throttled responses:
+    X-RateLimit-Limit and X-RateLimit-Remaining, plus Retry-After when the request was refused.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.add_headers(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.add_headers(request, await self.get_response(request))
+
+    def add_headers(self, request, response):
+        budget = getattr(request, 'throttle_budget', None)
+        if budget is not None:
+            response['X-RateLimit-Limit'] = str(settings.THROTTLE_BURST)
+            response['X-RateLimit-Remaining'] = str(budget.remaining)
+            if not budget.allowed:
+                response.setdefault('Retry-After', str(budget.retry_after))
+        return response
+
+class ProfilerMiddleware:
+    """
+    Samples the stacks of the requests the current profiling session picks (see
+    core/profiling.py), from here down, until the response, or a streamed response's last
+    chunk, is sent. Requests on the async path are passed through unsampled.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        profile = profiler.begin(request, sys._getframe())
+        if profile is None:
+            return self.get_response(request)
+        response = self.get_response(request)
+        if response.streaming and getattr(response, 'file_to_stream', None) is None:
+            # Until the server iterates the content, the thread is not running the request's code.
+            profile.root = None
+            response.streaming_content = self.stream(request, profile, response.streaming_content)
+            return response
+        profiler.end(profile, self.route(request))
+        return response
+
+    async def __acall__(self, request):
+        return await self.get_response(request)
+
+    def stream(self, request, profile, content):
+        profile.root = sys._getframe()
+        try:
+            yield from content
+        finally:
+            profiler.end(profile, self.route(request))
+
+    def route(self, request):
+        match = request.resolver_match
+        return match.view_name if match is not None else UNMATCHED_ROUTE
@@ -0,0 +1,66 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:09
+
+from django.db import migrations, models
+
+
+def backfill_spam_statistics(apps, schema_editor):
+    SpamReport = apps.get_model("core", "SpamReport")
+    User = apps.get_model("core", "User")
+    PhoneSpamStat = apps.get_model("core", "PhoneSpamStat")
+    GlobalCounter = apps.get_model("core", "GlobalCounter")
+
+    rows = (
+        SpamReport.objects.values("phone_number")
+        .annotate(report_count=models.Count("id"))
+        .order_by()
+        .values_list("phone_number", "report_count")
+    )
+    batch = []
+    for phone_number, report_count in rows.iterator(chunk_size=1000):
+        batch.append(
+            PhoneSpamStat(phone_number=phone_number, report_count=report_count)
+        )
+        if len(batch) >= 1000:
+            PhoneSpamStat.objects.bulk_create(batch)
+            batch = []
+    PhoneSpamStat.objects.bulk_create(batch)
+
+    GlobalCounter.objects.create(name="spam_reports", value=SpamReport.objects.count())
+    GlobalCounter.objects.create(name="users", value=User.objects.count())
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="GlobalCounter",
+            fields=[
+                (
+                    "name",
+                    models.CharField(max_length=50, primary_key=True, serialize=False),
+                ),
+                ("value", models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name="PhoneSpamStat",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("phone_number", models.CharField(max_length=20, unique=True)),
+                ("report_count", models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_spam_statistics, migrations.RunPython.noop),
+    ]
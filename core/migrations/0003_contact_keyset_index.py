@@ -0,0 +1,17 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0002_spam_statistics"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="contact",
+            index=models.Index(fields=["user", "id"], name="contact_user_id_idx"),
+        ),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:15
+
+import core.phone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0003_contact_keyset_index"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="user",
+            name="phone_key",
+            field=models.BigIntegerField(
+                blank=True, db_index=True, editable=False, null=True
+            ),
+        ),
+        migrations.AddField(
+            model_name="contact",
+            name="phone_key",
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="spamreport",
+            name="phone_key",
+            field=models.BigIntegerField(blank=True, editable=False, null=True),
+        ),
+        migrations.AddField(
+            model_name="phonespamstat",
+            name="phone_key",
+            field=models.BigIntegerField(null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name="phonespamstat",
+            name="phone_number",
+            field=models.CharField(max_length=20),
+        ),
+        migrations.AlterField(
+            model_name="user",
+            name="phone_number",
+            field=models.CharField(
+                max_length=20,
+                unique=True,
+                validators=[core.phone.validate_phone_number],
+            ),
+        ),
+        migrations.AlterField(
+            model_name="contact",
+            name="phone_number",
+            field=models.CharField(
+                max_length=20, validators=[core.phone.validate_phone_number]
+            ),
+        ),
+        migrations.AlterField(
+            model_name="spamreport",
+            name="phone_number",
+            field=models.CharField(
+                max_length=20, validators=[core.phone.validate_phone_number]
+            ),
+        ),
+    ]
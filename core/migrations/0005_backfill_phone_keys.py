@@ -0,0 +1,109 @@
+import re
+
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 2000
+NON_DIGITS = re.compile(r"\D")
+
+
+def phone_key(raw):
+    """Frozen copy of core.phone.phone_key as of this migration."""
+    if raw is None:
+        return None
+    raw = str(raw).strip()
+    digits = NON_DIGITS.sub("", raw)
+    if not digits:
+        return None
+    country_code = settings.PHONE_DEFAULT_COUNTRY_CODE
+    if raw.startswith("+"):
+        e164 = digits
+    elif digits.startswith("00"):
+        e164 = digits[2:]
+    elif digits.startswith("0"):
+        e164 = country_code + digits.lstrip("0")
+    elif len(digits) <= settings.PHONE_NATIONAL_NUMBER_LENGTH:
+        e164 = country_code + digits
+    else:
+        e164 = digits
+    e164 = e164.lstrip("0")
+    if not e164 or len(e164) > 15:
+        return None
+    return int(e164)
+
+
+def backfill_keys(model):
+    last_pk = 0
+    while True:
+        batch = list(
+            model.objects.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .only("pk", "phone_number")[:BATCH_SIZE]
+        )
+        if not batch:
+            return
+        for row in batch:
+            row.phone_key = phone_key(row.phone_number)
+        model.objects.bulk_update(batch, ["phone_key"])
+        last_pk = batch[-1].pk
+
+
+def backfill_phone_keys(apps, schema_editor):
+    User = apps.get_model("core", "User")
+    Contact = apps.get_model("core", "Contact")
+    SpamReport = apps.get_model("core", "SpamReport")
+    PhoneSpamStat = apps.get_model("core", "PhoneSpamStat")
+    GlobalCounter = apps.get_model("core", "GlobalCounter")
+
+    for model in (User, Contact, SpamReport):
+        backfill_keys(model)
+
+    # Variants of one number reported by the same user collapse into a single report.
+    duplicates = (
+        SpamReport.objects.exclude(phone_key=None)
+        .values("phone_key", "reported_by")
+        .annotate(reports=models.Count("id"), keep=models.Min("id"))
+        .filter(reports__gt=1)
+        .order_by()
+    )
+    for group in duplicates.iterator(chunk_size=BATCH_SIZE):
+        SpamReport.objects.filter(
+            phone_key=group["phone_key"], reported_by=group["reported_by"]
+        ).exclude(pk=group["keep"]).delete()
+
+    # Re-key the maintained statistics on the canonical number.
+    PhoneSpamStat.objects.all().delete()
+    rows = (
+        SpamReport.objects.exclude(phone_key=None)
+        .values("phone_key")
+        .annotate(
+            report_count=models.Count("id"), phone_number=models.Min("phone_number")
+        )
+        .order_by()
+        .values_list("phone_key", "phone_number", "report_count")
+    )
+    batch = []
+    for key, phone_number, report_count in rows.iterator(chunk_size=BATCH_SIZE):
+        batch.append(
+            PhoneSpamStat(
+                phone_key=key, phone_number=phone_number, report_count=report_count
+            )
+        )
+        if len(batch) >= BATCH_SIZE:
+            PhoneSpamStat.objects.bulk_create(batch)
+            batch = []
+    PhoneSpamStat.objects.bulk_create(batch)
+    GlobalCounter.objects.filter(name="spam_reports").update(
+        value=SpamReport.objects.count()
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0004_phone_keys"),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_phone_keys, migrations.RunPython.noop),
+    ]
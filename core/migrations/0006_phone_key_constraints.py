@@ -0,0 +1,33 @@
+import core.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0005_backfill_phone_keys"),
+    ]
+
+    operations = [
+        migrations.AlterModelManagers(
+            name="user",
+            managers=[
+                ("objects", core.models.PhoneUserManager()),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name="spamreport",
+            unique_together={("phone_key", "reported_by")},
+        ),
+        migrations.AlterField(
+            model_name="phonespamstat",
+            name="phone_key",
+            field=models.BigIntegerField(unique=True),
+        ),
+        migrations.AddIndex(
+            model_name="contact",
+            index=models.Index(
+                fields=["phone_key", "user"], name="contact_phone_key_user_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,137 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:43
+
+from collections import defaultdict
+from itertools import groupby
+
+from django.db import migrations, models
+from django.utils import timezone
+
+from core.stats import WINDOWS, bucket_of, decay, watermark_name, window_buckets
+
+BATCH_SIZE = 2000
+
+
+def backfill_spam_windows(apps, schema_editor):
+    SpamReport = apps.get_model("core", "SpamReport")
+    PhoneSpamStat = apps.get_model("core", "PhoneSpamStat")
+    PhoneSpamBucket = apps.get_model("core", "PhoneSpamBucket")
+    GlobalCounter = apps.get_model("core", "GlobalCounter")
+
+    now = timezone.now()
+    horizons = {
+        column: bucket_of(now) - window_buckets(window)
+        for column, window in WINDOWS.items()
+    }
+    rows = (
+        SpamReport.objects.exclude(phone_key=None)
+        .order_by("phone_key")
+        .values_list("phone_key", "timestamp")
+    )
+    stats, buckets = [], []
+    for key, reports in groupby(
+        rows.iterator(chunk_size=BATCH_SIZE), lambda row: row[0]
+    ):
+        figures = defaultdict(int, decayed_score=0.0)
+        counts = defaultdict(int)
+        for _, timestamp in reports:
+            bucket = bucket_of(timestamp)
+            for column, horizon in horizons.items():
+                figures[column] += bucket > horizon
+            figures["decayed_score"] += decay(1.0, (now - timestamp).total_seconds())
+            if bucket > min(horizons.values()):
+                counts[bucket] += 1
+        stats.append((key, figures))
+        buckets += [
+            PhoneSpamBucket(phone_key=key, bucket=bucket, report_count=count)
+            for bucket, count in counts.items()
+        ]
+        if len(stats) >= BATCH_SIZE:
+            save_figures(PhoneSpamStat, stats, now)
+            stats = []
+        if len(buckets) >= BATCH_SIZE:
+            PhoneSpamBucket.objects.bulk_create(buckets)
+            buckets = []
+    save_figures(PhoneSpamStat, stats, now)
+    PhoneSpamBucket.objects.bulk_create(buckets)
+    for column, horizon in horizons.items():
+        GlobalCounter.objects.update_or_create(
+            name=watermark_name(column), defaults={"value": horizon}
+        )
+
+
+def save_figures(PhoneSpamStat, stats, now):
+    rows = PhoneSpamStat.objects.in_bulk(
+        [key for key, _ in stats], field_name="phone_key"
+    )
+    for key, figures in stats:
+        if key in rows:
+            for field, value in figures.items():
+                setattr(rows[key], field, value)
+            rows[key].score_updated_at = now.timestamp()
+    PhoneSpamStat.objects.bulk_update(
+        rows.values(), [*WINDOWS, "decayed_score", "score_updated_at"]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0006_phone_key_constraints"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="phonespamstat",
+            name="decayed_score",
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name="phonespamstat",
+            name="reports_1h",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="phonespamstat",
+            name="reports_24h",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="phonespamstat",
+            name="reports_30d",
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="phonespamstat",
+            name="score_updated_at",
+            field=models.FloatField(default=0),
+        ),
+        migrations.CreateModel(
+            name="PhoneSpamBucket",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("phone_key", models.BigIntegerField()),
+                (
+                    "bucket",
+                    models.BigIntegerField(
+                        help_text="Unix time divided by SPAM_WINDOW_BUCKET_SECONDS"
+                    ),
+                ),
+                ("report_count", models.IntegerField(default=0)),
+            ],
+            options={
+                "indexes": [
+                    models.Index(fields=["bucket"], name="spambucket_bucket_idx")
+                ],
+                "unique_together": {("phone_key", "bucket")},
+            },
+        ),
+        migrations.RunPython(backfill_spam_windows, migrations.RunPython.noop),
+    ]
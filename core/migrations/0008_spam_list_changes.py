@@ -0,0 +1,20 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:48
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0007_spam_windows"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SpamListChange",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("phone_key", models.BigIntegerField(null=True)),
+            ],
+        ),
+    ]
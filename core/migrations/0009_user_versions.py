@@ -0,0 +1,46 @@
+# Generated by Django 5.1.7 on 2026-10-18 13:50
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_user_versions(apps, schema_editor):
+    User = apps.get_model("core", "User")
+    UserVersion = apps.get_model("core", "UserVersion")
+
+    batch = []
+    for user_id in User.objects.values_list("pk", flat=True).iterator(chunk_size=1000):
+        batch.append(UserVersion(user_id=user_id, profile=1))
+        if len(batch) >= 1000:
+            UserVersion.objects.bulk_create(batch)
+            batch = []
+    UserVersion.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0008_spam_list_changes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="UserVersion",
+            fields=[
+                (
+                    "user",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="+",
+                        serialize=False,
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+                ("contacts", models.PositiveBigIntegerField(default=0)),
+                ("profile", models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(backfill_user_versions, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,127 @@
+# Generated by Django 5.1.7 on 2026-10-18 14:00
+
+from itertools import groupby
+from operator import itemgetter
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+from core.directory import top_names
+
+BATCH_SIZE = 2000
+
+
+def backfill_phone_directory(apps, schema_editor):
+    Contact = apps.get_model("core", "Contact")
+    User = apps.get_model("core", "User")
+    PhoneDirectory = apps.get_model("core", "PhoneDirectory")
+    PhoneDirectoryName = apps.get_model("core", "PhoneDirectoryName")
+
+    rows = (
+        Contact.objects.exclude(phone_key=None)
+        .values("phone_key", "name")
+        .annotate(count=models.Count("pk"), number=models.Min("phone_number"))
+        .order_by("phone_key", "name")
+    )
+    entries, names = [], []
+    for key, group in groupby(
+        rows.iterator(chunk_size=BATCH_SIZE), itemgetter("phone_key")
+    ):
+        group = list(group)
+        names += [
+            PhoneDirectoryName(phone_key=key, name=row["name"], count=row["count"])
+            for row in group
+        ]
+        entries.append(
+            PhoneDirectory(
+                phone_key=key,
+                phone_number=min(row["number"] for row in group),
+                contact_count=sum(row["count"] for row in group),
+                names=top_names((row["name"], row["count"]) for row in group),
+            )
+        )
+        if len(entries) >= BATCH_SIZE:
+            PhoneDirectory.objects.bulk_create(entries)
+            entries = []
+        if len(names) >= BATCH_SIZE:
+            PhoneDirectoryName.objects.bulk_create(names)
+            names = []
+    PhoneDirectory.objects.bulk_create(entries)
+    PhoneDirectoryName.objects.bulk_create(names)
+
+    users = User.objects.exclude(phone_key=None).values_list(
+        "pk", "phone_key", "phone_number"
+    )
+    batch = []
+    for pk, key, phone_number in users.iterator(chunk_size=BATCH_SIZE):
+        batch.append(
+            PhoneDirectory(phone_key=key, phone_number=phone_number, user_id=pk)
+        )
+        if len(batch) >= BATCH_SIZE:
+            PhoneDirectory.objects.bulk_create(
+                batch,
+                update_conflicts=True,
+                unique_fields=["phone_key"],
+                update_fields=["user"],
+            )
+            batch = []
+    PhoneDirectory.objects.bulk_create(
+        batch,
+        update_conflicts=True,
+        unique_fields=["phone_key"],
+        update_fields=["user"],
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0009_user_versions"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="PhoneDirectory",
+            fields=[
+                (
+                    "phone_key",
+                    models.BigIntegerField(primary_key=True, serialize=False),
+                ),
+                ("phone_number", models.CharField(max_length=20)),
+                ("contact_count", models.PositiveIntegerField(default=0)),
+                ("names", models.JSONField(default=list)),
+                (
+                    "user",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to=settings.AUTH_USER_MODEL,
+                    ),
+                ),
+            ],
+        ),
+        migrations.CreateModel(
+            name="PhoneDirectoryName",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("phone_key", models.BigIntegerField()),
+                ("name", models.CharField(max_length=255)),
+                ("count", models.PositiveIntegerField(default=0)),
+            ],
+            options={
+                "unique_together": {("phone_key", "name")},
+            },
+        ),
+        migrations.RunPython(backfill_phone_directory, migrations.RunPython.noop),
+    ]
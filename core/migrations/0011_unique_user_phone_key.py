@@ -0,0 +1,48 @@
+# Generated by Django 5.1.7 on 2026-10-18 16:00
+
+from django.db import migrations, models
+
+
+def resolve_colliding_users(apps, schema_editor):
+    """
+    Users registered under two spellings of one number ("+919876543210", "09876543210") share a
+    phone_key. Keep the one who logged in most recently (the lowest pk if neither has) and
+    deactivate the others, clearing their key so it can become unique; their data stays put.
+    """
+    User = apps.get_model("core", "User")
+    PhoneDirectory = apps.get_model("core", "PhoneDirectory")
+
+    keys = (
+        User.objects.exclude(phone_key=None)
+        .values("phone_key")
+        .annotate(users=models.Count("pk"))
+        .filter(users__gt=1)
+        .values_list("phone_key", flat=True)
+    )
+    for key in list(keys):
+        users = list(
+            User.objects.filter(phone_key=key)
+            .order_by(models.F("last_login").desc(nulls_last=True), "pk")
+            .values_list("pk", flat=True)
+        )
+        kept, others = users[0], users[1:]
+        User.objects.filter(pk__in=others).update(phone_key=None, is_active=False)
+        PhoneDirectory.objects.filter(phone_key=key).update(user_id=kept)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0010_phone_directory"),
+    ]
+
+    operations = [
+        migrations.RunPython(resolve_colliding_users, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name="user",
+            name="phone_key",
+            field=models.BigIntegerField(
+                blank=True, editable=False, null=True, unique=True
+            ),
+        ),
+    ]
@@ -0,0 +1,75 @@
+# Generated by Django 5.1.7 on 2026-10-18 14:51
+
+from django.conf import settings
+from django.db import migrations, models
+
+BATCH_SIZE = 500
+
+
+def top_names(counts):
+    """Frozen copy of core.directory.top_names as of this migration."""
+    ranked = sorted(counts, key=lambda pair: (-pair[1], pair[0]))
+    return [[name, count] for name, count in ranked[: settings.PHONE_DIRECTORY_NAMES]]
+
+
+def dedupe_contacts(apps, schema_editor):
+    """
+    Spellings of one number saved by the same user collapse into their newest contact, and the
+    directory counts of the affected numbers are recomputed.
+    """
+    Contact = apps.get_model("core", "Contact")
+    PhoneDirectory = apps.get_model("core", "PhoneDirectory")
+    PhoneDirectoryName = apps.get_model("core", "PhoneDirectoryName")
+
+    duplicates = (
+        Contact.objects.exclude(phone_key=None)
+        .values("user", "phone_key")
+        .annotate(contacts=models.Count("id"), keep=models.Max("id"))
+        .filter(contacts__gt=1)
+        .order_by()
+    )
+    keys = set()
+    for group in duplicates.iterator(chunk_size=BATCH_SIZE):
+        Contact.objects.filter(
+            user=group["user"], phone_key=group["phone_key"]
+        ).exclude(pk=group["keep"]).delete()
+        keys.add(group["phone_key"])
+
+    keys = sorted(keys)
+    for start in range(0, len(keys), BATCH_SIZE):
+        batch = keys[start : start + BATCH_SIZE]
+        counts = {key: {} for key in batch}
+        rows = (
+            Contact.objects.filter(phone_key__in=batch)
+            .values("phone_key", "name")
+            .annotate(count=models.Count("pk"))
+            .order_by()
+            .values_list("phone_key", "name", "count")
+        )
+        for key, name, count in rows:
+            counts[key][name] = count
+        PhoneDirectoryName.objects.filter(phone_key__in=batch).delete()
+        PhoneDirectoryName.objects.bulk_create(
+            PhoneDirectoryName(phone_key=key, name=name, count=count)
+            for key, names in counts.items()
+            for name, count in names.items()
+        )
+        for key, names in counts.items():
+            PhoneDirectory.objects.filter(phone_key=key).update(
+                contact_count=sum(names.values()), names=top_names(names.items())
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0011_unique_user_phone_key"),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_contacts, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name="contact",
+            unique_together={("user", "phone_key")},
+        ),
+    ]
@@ -0,0 +1,21 @@
+# Generated by Django 5.1.7 on 2026-10-18 15:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("core", "0012_unique_contact_phone_key"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="NameChange",
+            fields=[
+                ("id", models.BigAutoField(primary_key=True, serialize=False)),
+                ("kind", models.SmallIntegerField(null=True)),
+                ("entry", models.BigIntegerField(null=True)),
+            ],
+        ),
+    ]
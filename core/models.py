@@ -1,13 +1,47 @@
 from django.db import models
-from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import AbstractUser, UserManager
+from .phone import phone_key, validate_phone_number
 
-class User(AbstractUser):
-    phone_number = models.CharField(max_length=20, unique=True)
+
+class PhoneKeyMixin:
+    """Keeps `phone_key` derived from `phone_number` on every save()."""
+
+    def derive_phone_key(self):
+        return phone_key(self.phone_number)
+
+    def save(self, *args, **kwargs):
+        self.phone_key = self.derive_phone_key()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and 'phone_number' in update_fields:
+            kwargs['update_fields'] = {*update_fields, 'phone_key'}
+        super().save(*args, **kwargs)
+
+class PhoneUserManager(UserManager):
+    def get_by_natural_key(self, username):
+        """Log users in by any spelling of their number."""
+        key = phone_key(username)
+        if key is None:
+            # filter(phone_key=None) would match every user whose number has no key.
+            raise self.model.DoesNotExist
+        return self.get(phone_key=key)
+
+class User(PhoneKeyMixin, AbstractUser):
+    phone_number = models.CharField(max_length=20, unique=True, validators=[validate_phone_number])
+    phone_key = models.BigIntegerField(null=True, blank=True, editable=False, unique=True)
     email = models.EmailField(blank=True, null=True)
 
     USERNAME_FIELD = 'phone_number'
     REQUIRED_FIELDS = ['username']  
 
+    objects = PhoneUserManager()
+
+    def derive_phone_key(self):
+        # Users deactivated as duplicates of another user's number (migration 0011) keep no key
+        # until they are reactivated, which needs a number of their own.
+        if self.pk is not None and not self.is_active and self.phone_key is None:
+            return None
+        return super().derive_phone_key()
+
     groups = models.ManyToManyField(
         'auth.Group',
         verbose_name=('groups'),
@@ -31,24 +65,137 @@ class User(AbstractUser):
     def __str__(self):
         return self.username
 
-class Contact(models.Model):
+class Contact(PhoneKeyMixin, models.Model):
     user = models.ForeignKey(User, related_name='contacts', on_delete=models.CASCADE)
     name = models.CharField(max_length=255)
-    phone_number = models.CharField(max_length=20)
+    phone_number = models.CharField(max_length=20, validators=[validate_phone_number])
+    phone_key = models.BigIntegerField(null=True, blank=True, editable=False)
 
     class Meta:
-        unique_together = ('user', 'phone_number')
+        unique_together = ('user', 'phone_key')
+        indexes = [
+            models.Index(fields=['user', 'id'], name='contact_user_id_idx'),
+            models.Index(fields=['phone_key', 'user'], name='contact_phone_key_user_idx'),
+        ]
 
     def __str__(self):
         return f"{self.name} ({self.phone_number})"
 
-class SpamReport(models.Model):
-    phone_number = models.CharField(max_length=20, db_index=True)
+class SpamReport(PhoneKeyMixin, models.Model):
+    phone_number = models.CharField(max_length=20, validators=[validate_phone_number])
+    phone_key = models.BigIntegerField(null=True, blank=True, editable=False)
     reported_by = models.ForeignKey(User, on_delete=models.CASCADE)
     timestamp = models.DateTimeField(auto_now_add=True)
 
     class Meta:
-        unique_together = ('phone_number', 'reported_by')
+        unique_together = ('phone_key', 'reported_by')
+
+    def __str__(self):
+        return self.phone_number
+
+class PhoneSpamStat(models.Model):
+    """Maintained spam report counts and decayed score for a single canonical phone number."""
+    phone_key = models.BigIntegerField(unique=True)
+    phone_number = models.CharField(max_length=20)
+    report_count = models.PositiveIntegerField(default=0)
+    # Reports filed within the last hour, day and 30 days, as of the latest compaction (see stats.WINDOWS).
+    reports_1h = models.PositiveIntegerField(default=0)
+    reports_24h = models.PositiveIntegerField(default=0)
+    reports_30d = models.PositiveIntegerField(default=0)
+    # Every report weighs 1 when filed and halves each SPAM_SCORE_HALF_LIFE seconds; the
+    # score is as of `score_updated_at` (Unix time) and decays from there when read.
+    decayed_score = models.FloatField(default=0)
+    score_updated_at = models.FloatField(default=0)
+
+    def __str__(self):
+        return f"{self.phone_number}: {self.report_count}"
+
+class PhoneSpamBucket(models.Model):
+    """Reports filed against a number during one SPAM_WINDOW_BUCKET_SECONDS slice of time."""
+    phone_key = models.BigIntegerField()
+    bucket = models.BigIntegerField(help_text='Unix time divided by SPAM_WINDOW_BUCKET_SECONDS')
+    report_count = models.IntegerField(default=0)
+
+    class Meta:
+        unique_together = ('phone_key', 'bucket')
+        indexes = [models.Index(fields=['bucket'], name='spambucket_bucket_idx')]
+
+    def __str__(self):
+        return f"{self.phone_key}@{self.bucket}: {self.report_count}"
+
+class PhoneDirectory(models.Model):
+    """
+    Everything a phone search shows for one canonical number: its registered user, if any, and
+    the names it is most often saved under in contacts (see core/directory.py).
+    """
+    phone_key = models.BigIntegerField(primary_key=True)
+    phone_number = models.CharField(max_length=20)
+    user = models.ForeignKey(User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+')
+    contact_count = models.PositiveIntegerField(default=0)
+    # [name, count] pairs of the PHONE_DIRECTORY_NAMES most common contact names, most common first.
+    names = models.JSONField(default=list)
+
+    def __str__(self):
+        return f"{self.phone_number}: {self.contact_count} contacts"
+
+class PhoneDirectoryName(models.Model):
+    """The number of contacts that save a number under one name."""
+    phone_key = models.BigIntegerField()
+    name = models.CharField(max_length=255)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ('phone_key', 'name')
+
+    def __str__(self):
+        return f"{self.phone_key} {self.name}: {self.count}"
+
+class GlobalCounter(models.Model):
+    """Named running totals so reads never need a full-table COUNT(*)."""
+    SPAM_REPORTS = 'spam_reports'
+    USERS = 'users'
+    # Oldest spam list version the change log can still bring up to date (see core/snapshot.py).
+    SPAM_LIST_HORIZON = 'spam_list_horizon'
+    # Oldest name change the log still holds everything after (see core/search_index.py).
+    NAME_CHANGE_HORIZON = 'name_change_horizon'
+
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.value}"
+
+class SpamListChange(models.Model):
+    """
+    A number whose report count changed; the id is the spam list version. Logged in commit
+    order by every report write. A row without a number marks a statistics rebuild.
+    """
+    id = models.BigAutoField(primary_key=True)
+    phone_key = models.BigIntegerField(null=True)
+
+    def __str__(self):
+        return f"{self.pk}: {self.phone_key}"
+
+class NameChange(models.Model):
+    """
+    A user or contact whose name or number was written, logged with the write so the name search
+    index of every process can catch up on it. A row without a kind marks a bulk load.
+    """
+    id = models.BigAutoField(primary_key=True)
+    kind = models.SmallIntegerField(null=True)
+    entry = models.BigIntegerField(null=True)
+
+    def __str__(self):
+        return f"{self.pk}: {self.kind} {self.entry}"
+
+class UserVersion(models.Model):
+    """
+    Per-user change counters behind the ETags of the contact list and profile. A user without
+    a row is at version 0 of both; the first change creates it.
+    """
+    user = models.OneToOneField(User, primary_key=True, on_delete=models.CASCADE, related_name='+')
+    contacts = models.PositiveBigIntegerField(default=0)
+    profile = models.PositiveBigIntegerField(default=0)
 
     def __str__(self):
-        return self.phone_number
\ No newline at end of file
+        return f"{self.user_id}: contacts {self.contacts}, profile {self.profile}"
@@ -0,0 +1,141 @@
+import json
+from base64 import b64decode, b64encode
+from binascii import Error as BinasciiError
+
+from django.conf import settings
+from django.db.models import CharField, Func, Q
+from django.http import StreamingHttpResponse
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, CursorPagination, _positive_int
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+from .renderers import dumps
+
+
+class SpamNumberCursorPagination(CursorPagination):
+    """Keyset pages over the unique, indexed `PhoneSpamStat.phone_key`."""
+    ordering = 'phone_key'
+    page_size = 500
+    page_size_query_param = 'page_size'
+    max_page_size = 5000
+
+class ContactCursorPagination(CursorPagination):
+    """Keyset pages over a user's contacts, served from the (user, id) index."""
+    ordering = 'id'
+    page_size = 500
+    page_size_query_param = 'page_size'
+    max_page_size = 5000
+
+class SearchCursorPagination(BasePagination):
+    """
+    Keyset pagination for the search endpoints.
+
+    Search results are ranked rather than read off one column, so the cursor carries the full
+    sort key of the last row served, (kind, rank, name, pk), and the view resumes strictly after
+    it. The view fetches one row more than the page size so the paginator can tell whether
+    another page exists without counting.
+    """
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        if self.page_size_query_param in request.query_params:
+            try:
+                return _positive_int(
+                    request.query_params[self.page_size_query_param],
+                    strict=True,
+                    cutoff=settings.SEARCH_RESULT_LIMIT,
+                )
+            except (KeyError, ValueError):
+                pass
+        return settings.SEARCH_RESULT_LIMIT
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if encoded is None:
+            return None
+        try:
+            kind, rank, name, pk = json.loads(b64decode(encoded.encode('ascii')))
+            return (int(kind), int(rank), str(name), int(pk))
+        except (TypeError, ValueError, UnicodeError, BinasciiError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, key):
+        encoded = b64encode(json.dumps(list(key), separators=(',', ':')).encode('utf-8')).decode('ascii')
+        return replace_query_param(self.base_url, self.cursor_query_param, encoded)
+
+    def get_fetch_size(self, request):
+        return self.get_page_size(request) + 1
+
+    def paginate_queryset(self, rows, request, view=None):
+        """`rows` are (key, result) pairs in key order, at most `get_fetch_size()` of them."""
+        self.base_url = request.build_absolute_uri()
+        self.page_size = self.get_page_size(request)
+        page = rows[:self.page_size]
+        self.next_key = page[-1][0] if len(rows) > self.page_size else None
+        return [result for _, result in page]
+
+    def get_next_link(self):
+        return self.encode_cursor(self.next_key) if self.next_key is not None else None
+
+    def get_paginated_response(self, data):
+        return Response({'next': self.get_next_link(), 'results': data})
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+class SortName(Func):
+    """
+    A name lower-cased and compared by code point: the order the name search index sorts in
+    (core/search_index.py's `order_key`). Postgres would otherwise compare under the database
+    collation, which ignores case and punctuation differently from Python.
+    """
+    function = 'LOWER'
+    output_field = CharField()
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        sql, params = self.as_sql(compiler, connection, **extra_context)
+        return f'{sql} COLLATE "C"', params
+
+def keyset_after(key, name_field, rank_field=None):
+    """
+    Filter selecting the rows ordered strictly after `key`'s (rank, name, pk) position, where
+    `name_field` holds the `SortName` of the name.
+    """
+    _, rank, name, pk = key
+    name = name.lower()
+    after = Q(**{f'{name_field}__gt': name}) | Q(**{name_field: name, 'pk__gt': pk})
+    if rank_field is None:
+        return after
+    return Q(**{f'{rank_field}__gt': rank}) | (Q(**{rank_field: rank}) & after)
+
+def stream_json_array(rows, chunk_size=500):
+    """Yield a JSON array of `rows` (dicts) piece by piece, `chunk_size` items per chunk."""
+    yield b'['
+    chunk = []
+    first = True
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            # Encode the chunk as one array and drop its brackets; one call per chunk, not per row.
+            yield (b'' if first else b',') + dumps(chunk)[1:-1]
+            first = False
+            chunk = []
+    if chunk:
+        yield (b'' if first else b',') + dumps(chunk)[1:-1]
+    yield b']'
+
+def streaming_json_response(rows, chunk_size=500):
+    return StreamingHttpResponse(stream_json_array(rows, chunk_size), content_type='application/json')
+
+def wants_stream(request):
+    return request.query_params.get('stream', '').lower() in ('1', 'true', 'yes')
@@ -0,0 +1,69 @@
+"""
+Canonical phone number keys.
+
+Users type the same number many ways ("+91 98765 43210", "098765-43210", "9876543210").
+Every stored number therefore also carries `phone_key`: its E.164 digits as an integer,
+which is what all lookups, uniqueness checks and spam counts are keyed on. The raw
+string is kept for display only.
+"""
+import re
+
+from django.conf import settings
+from django.core.exceptions import ValidationError
+
+NON_DIGITS = re.compile(r'\D')
+MAX_E164_DIGITS = 15
+
+
+def phone_key(raw):
+    """Return the canonical E.164 number for `raw` as an int, or None if it cannot be one."""
+    if raw is None:
+        return None
+    raw = str(raw).strip()
+    digits = NON_DIGITS.sub('', raw)
+    if not digits:
+        return None
+    country_code = settings.PHONE_DEFAULT_COUNTRY_CODE
+    if raw.startswith('+'):
+        e164 = digits
+    elif digits.startswith('00'):
+        e164 = digits[2:]
+    elif digits.startswith('0'):
+        # National trunk prefix, e.g. 098765 43210.
+        e164 = country_code + digits.lstrip('0')
+    elif len(digits) <= settings.PHONE_NATIONAL_NUMBER_LENGTH:
+        e164 = country_code + digits
+    else:
+        e164 = digits
+    e164 = e164.lstrip('0')
+    if not e164 or len(e164) > MAX_E164_DIGITS:
+        return None
+    return int(e164)
+
+def format_e164(key):
+    return f'+{key}'
+
+def validate_phone_number(value):
+    if phone_key(value) is None:
+        raise ValidationError('Enter a valid phone number.', code='invalid_phone_number')
+
+class PhoneNumber(str):
+    """A phone number string as received, with its canonical key resolved once."""
+
+    def __new__(cls, value):
+        number = super().__new__(cls, value)
+        number.key = phone_key(value)
+        return number
+
+class PhoneNumberConverter:
+    """URL converter that only matches numbers which normalise, yielding a `PhoneNumber`."""
+    regex = r'[0-9+()\-. ]{1,32}'
+
+    def to_python(self, value):
+        number = PhoneNumber(value)
+        if number.key is None:
+            raise ValueError(value)
+        return number
+
+    def to_url(self, value):
+        return str(value)
@@ -0,0 +1,342 @@
+"""
+Sampling request profiler, switched on at runtime for a fraction of requests, optionally only on
+some routes.
+
+POST /api/profiler/ (admins only) starts a profiling session, e.g. {"rate": 0.05, "routes":
+["search-name"], "seconds": 600}, and DELETE ends it early. The session is written to
+PROFILER_DIR, where every process picks it up within PROFILER_CONFIG_SECONDS, so nothing needs
+restarting; starting a new session discards the samples of the previous one.
+
+ProfilerMiddleware registers the thread of each request the session picks with a sampler
+thread. Every PROFILER_INTERVAL seconds the sampler reads the stacks of the registered threads
+(sys._current_frames()) from the middleware down, so the samples cover the view and the
+middleware after ProfilerMiddleware, not the server. Each sample is charged to one category:
+"orm" when any frame is in django.db, else "serialization" when one is in a serializer, a
+renderer or the JSON encoder, else "view" when one is in this app, else "framework" (Django's
+and DRF's request handling). The category counts are exact. Stacks are kept up to
+PROFILER_MAX_DEPTH frames deep and PROFILER_MAX_STACKS distinct ones per process; samples of
+further stacks are counted under one "[other]" stack per route.
+
+Like the request metrics, each process writes its profile to PROFILER_DIR every
+PROFILER_SNAPSHOT_SECONDS, and GET /api/profiler/stacks/ and `manage.py dump_profile` merge
+them into collapsed stacks, one "route;frame;...;frame samples" line per stack: the input of
+flamegraph.pl, speedscope and similar tools.
+
+Requests on the async path are not sampled: under ASGI one thread runs many requests at once,
+so its stack can't be charged to any one of them.
+"""
+import atexit
+import json
+import logging
+import os
+import random
+import sys
+import threading
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.urls import Resolver404, resolve
+
+logger = logging.getLogger(__name__)
+
+# In order of precedence: a sample with a frame in the ORM is charged to the ORM, and so on.
+CATEGORIES = ('orm', 'serialization', 'view', 'framework')
+ORM_MODULES = ('django.db',)
+SERIALIZATION_MODULES = (
+    'json',
+    'rest_framework.fields',
+    'rest_framework.relations',
+    'rest_framework.renderers',
+    'rest_framework.serializers',
+    'rest_framework.utils.encoders',
+    'rest_framework.utils.serializer_helpers',
+    'core.fast_serializers',
+    'core.renderers',
+    'core.serializers',
+)
+APP_MODULES = ('core',)
+OTHER_STACK = ('[other]',)
+TRUNCATED = '[truncated]'
+SESSION_FILE = 'profiler.json'
+
+
+def _in(module, packages):
+    return any(module == package or module.startswith(package + '.') for package in packages)
+
+def _category(module):
+    if _in(module, ORM_MODULES):
+        return 0
+    if _in(module, SERIALIZATION_MODULES):
+        return 1
+    if _in(module, APP_MODULES):
+        return 2
+    return 3
+
+class RequestProfile:
+    """The samples of one request: (category, stack) -> count. Only the sampler thread writes them."""
+    __slots__ = ('root', 'samples')
+
+    def __init__(self, root):
+        # The frame the stacks are read down from; samples of a stack without it are dropped.
+        self.root = root
+        self.samples = {}
+
+class Profiler:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._threads = {}
+        self._wake = threading.Event()
+        self._sampler = None
+        self._frames = {}
+        self._session = None
+        self._session_checked = None
+        self._session_mtime = None
+        self._reset(None)
+
+    def _reset(self, session_id):
+        self._session_id = session_id
+        self._routes = {}
+        self._stacks = {}
+        self._dirty = False
+
+    def reset(self):
+        with self._lock:
+            self._session = self._session_checked = self._session_mtime = None
+            self._reset(None)
+
+    def session(self):
+        """The current session, re-read from PROFILER_DIR at most every PROFILER_CONFIG_SECONDS."""
+        now = time.monotonic()
+        if self._session_checked is not None and now - self._session_checked < settings.PROFILER_CONFIG_SECONDS:
+            return self._session
+        self._session_checked = now
+        if settings.PROFILER_DIR:
+            path = Path(settings.PROFILER_DIR) / SESSION_FILE
+            try:
+                mtime = path.stat().st_mtime_ns
+                if mtime != self._session_mtime:
+                    self._use_session(json.loads(path.read_text()))
+                    self._session_mtime = mtime
+            except (OSError, ValueError):
+                pass
+        return self._session
+
+    def _use_session(self, session):
+        self._session = session
+        if session is not None and session['started_at'] != self._session_id:
+            with self._lock:
+                self._reset(session['started_at'])
+
+    def start_session(self, rate, routes=(), seconds=300):
+        now = time.time()
+        return self._write_session({'rate': rate, 'routes': list(routes), 'started_at': now, 'until': now + seconds})
+
+    def stop_session(self):
+        session = self.session()
+        if session is None:
+            return None
+        return self._write_session(dict(session, until=min(session['until'], time.time())))
+
+    def _write_session(self, session):
+        if settings.PROFILER_DIR:
+            directory = Path(settings.PROFILER_DIR)
+            directory.mkdir(parents=True, exist_ok=True)
+            path = directory / SESSION_FILE
+            temporary = path.with_suffix('.tmp')
+            temporary.write_text(json.dumps(session))
+            os.replace(temporary, path)
+            self._session_mtime = path.stat().st_mtime_ns
+        self._use_session(session)
+        return session
+
+    def begin(self, request, root):
+        """Start sampling the current thread if the session picks `request`; return its RequestProfile or None."""
+        session = self.session()
+        if session is None or time.time() >= session['until'] or random.random() >= session['rate']:
+            return None
+        if session['routes']:
+            try:
+                match = resolve(request.path_info)
+            except Resolver404:
+                return None
+            if match.view_name not in session['routes']:
+                return None
+        self._start_sampler()
+        profile = RequestProfile(root)
+        with self._lock:
+            self._threads[threading.get_ident()] = profile
+        self._wake.set()
+        return profile
+
+    def end(self, profile, route):
+        """Stop sampling the current thread and add the samples of `profile` to `route`'s."""
+        with self._lock:
+            self._threads.pop(threading.get_ident(), None)
+            stats = self._routes.get(route)
+            if stats is None:
+                stats = self._routes[route] = {'requests': 0, 'samples': dict.fromkeys(CATEGORIES, 0)}
+            stats['requests'] += 1
+            for (category, stack), count in profile.samples.items():
+                stats['samples'][category] += count
+                key = (route, stack)
+                if key not in self._stacks and len(self._stacks) >= settings.PROFILER_MAX_STACKS:
+                    key = (route, OTHER_STACK)
+                self._stacks[key] = self._stacks.get(key, 0) + count
+            self._dirty = True
+
+    def take_sample(self):
+        """Record the current stack of every thread being profiled."""
+        frames = sys._current_frames()
+        with self._lock:
+            for ident, profile in self._threads.items():
+                frame = frames.get(ident)
+                if frame is None or profile.root is None:
+                    continue
+                sample = self._sample(frame, profile.root)
+                if sample is not None:
+                    profile.samples[sample] = profile.samples.get(sample, 0) + 1
+
+    def _sample(self, frame, root):
+        labels = []
+        category = len(CATEGORIES) - 1
+        while frame is not root:
+            if frame is None:
+                # The thread is outside the request's code, e.g. the server sending a streamed chunk.
+                return None
+            label, frame_category = self._describe(frame.f_code, frame.f_globals)
+            labels.append(label)
+            category = min(category, frame_category)
+            frame = frame.f_back
+        labels.reverse()
+        if len(labels) > settings.PROFILER_MAX_DEPTH:
+            labels = labels[:settings.PROFILER_MAX_DEPTH] + [TRUNCATED]
+        return CATEGORIES[category], tuple(labels)
+
+    def _describe(self, code, module_globals):
+        described = self._frames.get(code)
+        if described is None:
+            module = module_globals.get('__name__') or '?'
+            described = self._frames[code] = (f'{module}.{code.co_qualname}', _category(module))
+        return described
+
+    def _start_sampler(self):
+        if self._sampler == os.getpid():
+            return
+        with self._lock:
+            if self._sampler == os.getpid():
+                return
+            # A forked worker inherits its parent's registrations, but not the threads behind them.
+            self._threads.clear()
+            self._sampler = os.getpid()
+            thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+        atexit.register(self.write_snapshot)
+        thread.start()
+
+    def _run(self):
+        written = time.monotonic()
+        while True:
+            if self._threads:
+                time.sleep(settings.PROFILER_INTERVAL)
+                self.take_sample()
+            else:
+                self._wake.wait(settings.PROFILER_SNAPSHOT_SECONDS)
+                self._wake.clear()
+            if self._dirty and time.monotonic() - written >= settings.PROFILER_SNAPSHOT_SECONDS:
+                written = time.monotonic()
+                try:
+                    self.write_snapshot()
+                except Exception:
+                    logger.exception('Writing the profile snapshot failed')
+
+    def snapshot(self):
+        """This process's samples for the current session as a JSON-serialisable dict."""
+        with self._lock:
+            return {
+                'pid': os.getpid(),
+                'written_at': time.time(),
+                'session': self._session_id,
+                'sample_interval': settings.PROFILER_INTERVAL,
+                'routes': {route: {'requests': stats['requests'], 'samples': dict(stats['samples'])} for route, stats in self._routes.items()},
+                'stacks': {';'.join((route,) + stack): count for (route, stack), count in self._stacks.items()},
+            }
+
+    def write_snapshot(self):
+        if not settings.PROFILER_DIR or not self._dirty:
+            return
+        self._dirty = False
+        directory = Path(settings.PROFILER_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f'profile-{os.getpid()}.json'
+        temporary = path.with_suffix('.tmp')
+        temporary.write_text(json.dumps(self.snapshot()))
+        os.replace(temporary, path)
+
+def read_session(directory=None):
+    try:
+        return json.loads((Path(directory or settings.PROFILER_DIR or '') / SESSION_FILE).read_text())
+    except (OSError, ValueError):
+        return None
+
+def read_snapshots(session, directory=None, exclude_pid=None):
+    """
+    Snapshots of `session` written by (other) processes. Those of earlier sessions are deleted:
+    a process writes its next one under the new session, and one that has exited never will.
+    """
+    directory = Path(directory or settings.PROFILER_DIR or '')
+    if session is None or not directory.is_dir():
+        return []
+    snapshots = []
+    for path in sorted(directory.glob('profile-*.json')):
+        try:
+            snapshot = json.loads(path.read_text())
+            if (snapshot.get('session') or 0) < session['started_at']:
+                path.unlink(missing_ok=True)
+                continue
+        except (OSError, ValueError):
+            continue
+        if snapshot.get('pid') != exclude_pid and snapshot.get('session') == session['started_at']:
+            snapshots.append(snapshot)
+    return snapshots
+
+def merge_snapshots(session, snapshots):
+    routes, stacks = {}, {}
+    for snapshot in snapshots:
+        for route, stats in snapshot['routes'].items():
+            merged = routes.setdefault(route, {'requests': 0, 'samples': dict.fromkeys(CATEGORIES, 0)})
+            merged['requests'] += stats['requests']
+            for category, count in stats['samples'].items():
+                merged['samples'][category] += count
+        for stack, count in snapshot['stacks'].items():
+            stacks[stack] = stacks.get(stack, 0) + count
+    return {
+        'session': session,
+        'processes': len(snapshots),
+        'sample_interval': settings.PROFILER_INTERVAL,
+        'routes': dict(sorted(routes.items())),
+        'stacks': stacks,
+    }
+
+def service_profile():
+    """This process's live samples merged with the latest snapshots of the other processes."""
+    session = profiler.session()
+    if session is None:
+        return merge_snapshots(None, [])
+    live = profiler.snapshot()
+    snapshots = [live] if live['session'] == session['started_at'] else []
+    return merge_snapshots(session, snapshots + read_snapshots(session, exclude_pid=os.getpid()))
+
+def summary(merged):
+    """A merged profile without its stacks: per route, the requests profiled and samples by category."""
+    return {key: value for key, value in merged.items() if key != 'stacks'}
+
+def render_collapsed(merged, route=None):
+    """Collapsed stacks, one "route;frame;...;frame samples" line per stack, optionally of one route."""
+    prefix = None if route is None else route + ';'
+    return ''.join(
+        f'{stack} {count}\n' for stack, count in sorted(merged['stacks'].items())
+        if prefix is None or stack.startswith(prefix)
+    )
+
+
+profiler = Profiler()
@@ -0,0 +1,48 @@
+"""
+JSON encoding for API responses, through orjson (see requirements.txt).
+
+orjson encodes the plain dicts, lists, strings and numbers the API returns several times faster
+than the standard library. The output is DRF's JSONRenderer's: compact, UTF-8, with U+2028 and
+U+2029 escaped, though orjson spells some floats differently (0.00001 rather than 1e-05).
+Anything else (datetimes, which DRF writes its own way, Decimals, lazy translations, non-string
+keys, huge integers) falls back to DRF's encoder, as does everything in an environment
+without orjson.
+"""
+import json
+
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+else:
+    # Make orjson refuse what it would encode differently from DRF, so it goes to the fallback.
+    ORJSON_OPTIONS = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+
+def dumps(data):
+    """`data` as compact UTF-8 JSON bytes, as DRF's JSONRenderer would produce them."""
+    if orjson is not None:
+        try:
+            encoded = orjson.dumps(data, option=ORJSON_OPTIONS)
+        except TypeError:
+            pass
+        else:
+            # Both separators start with these bytes; DRF escapes them for JavaScript's sake.
+            if b'\xe2\x80' in encoded:
+                encoded = encoded.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+            return encoded
+    encoded = json.dumps(data, cls=JSONEncoder, ensure_ascii=False, allow_nan=False, separators=(',', ':'))
+    return encoded.replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode('utf-8')
+
+class FastJSONRenderer(JSONRenderer):
+    """JSONRenderer that encodes with `dumps()`; indented output still goes through DRF."""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if self.get_indent(accepted_media_type or '', renderer_context or {}):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
@@ -0,0 +1,103 @@
+"""
+Read replicas for the search and lookup endpoints.
+
+Requests to views with ReplicaReadMixin read from one of the aliases in DATABASE_REPLICAS, each
+request taking the next one in turn, so one response never mixes rows from two replicas. Every
+other view, every write, and every query inside a transaction use the primary ('default'), so
+nothing that reads in order to write ever sees replication lag.
+
+Read-your-writes: ReplicaPinningMiddleware notes when a request writes, and then pins its user
+to the primary for REPLICA_PIN_SECONDS, recorded in the REPLICA_PIN_CACHE cache. Set that long
+enough to cover replication lag, and point the cache at a shared backend when several processes
+serve the API.
+"""
+from contextlib import contextmanager
+from contextvars import ContextVar
+from itertools import count
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import DEFAULT_DB_ALIAS, connections
+
+PIN_KEY = 'replica-pin:{}'
+
+
+class RequestState:
+    """The replica the current request reads from, if any, and whether it has written."""
+    __slots__ = ('replica', 'wrote')
+
+    def __init__(self):
+        self.replica = None
+        self.wrote = False
+
+current_request = ContextVar('replica_request', default=None)
+_next_replica = count()
+
+def begin_request():
+    state = RequestState()
+    current_request.set(state)
+    return state
+
+def pin_cache():
+    return caches[settings.REPLICA_PIN_CACHE]
+
+def pin(user_id):
+    pin_cache().set(PIN_KEY.format(user_id), True, settings.REPLICA_PIN_SECONDS)
+
+def is_pinned(user_id):
+    return pin_cache().get(PIN_KEY.format(user_id), False)
+
+def read_from_replicas(user):
+    """Send the current request's reads to the next replica, unless `user` has written recently."""
+    state = current_request.get()
+    replicas = settings.DATABASE_REPLICAS
+    if state is None or not replicas or (user.is_authenticated and is_pinned(user.pk)):
+        return
+    state.replica = replicas[next(_next_replica) % len(replicas)]
+
+@contextmanager
+def primary():
+    """Read from the primary inside this block, e.g. to fill a cache that outlives replication lag."""
+    state = current_request.get()
+    replica = state.replica if state is not None else None
+    if replica is not None:
+        state.replica = None
+    try:
+        yield
+    finally:
+        if replica is not None:
+            state.replica = replica
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        state = current_request.get()
+        if state is None or state.replica is None or state.wrote:
+            return None
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return state.replica
+
+    def db_for_write(self, model, **hints):
+        state = current_request.get()
+        if state is not None:
+            state.wrote = True
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replicas hold the same rows as the primary.
+        aliases = {DEFAULT_DB_ALIAS, *settings.DATABASE_REPLICAS}
+        if obj1._state.db in aliases and obj2._state.db in aliases:
+            return True
+        return None
+
+    def allow_migrate(self, db, app_label, model_name=None, **hints):
+        if db in settings.DATABASE_REPLICAS:
+            return False
+        return None
+
+class ReplicaReadMixin:
+    """For read-only views that can tolerate replication lag: reads go to a replica after authentication."""
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        read_from_replicas(request.user)
@@ -0,0 +1,186 @@
+"""
+Write-behind ingestion of spam reports, used when SPAM_REPORT_QUEUE_ENABLED is set.
+
+A report is acknowledged as soon as it is queued in this process. A flusher thread writes the
+queue with `file_report_batch()`, one transaction per batch, whenever SPAM_REPORT_QUEUE_BATCH_SIZE
+reports are waiting or the oldest has waited SPAM_REPORT_QUEUE_FLUSH_SECONDS. During a wave
+against one number, that number's counters then move once per batch instead of once per report.
+A (number, reporter) pair repeated while still queued is kept once.
+
+Once SPAM_REPORT_QUEUE_MAX reports are waiting, `put()` raises QueueFull (the view answers 503)
+until the flusher catches up. The queue is flushed when the interpreter exits. Reports still
+queued when a process is killed outright are lost; that is the price of the early acknowledgement.
+"""
+import atexit
+import logging
+import os
+import threading
+import time
+from itertools import islice
+
+from django.conf import settings
+from django.db import close_old_connections, connection
+
+from .phone import phone_key
+
+logger = logging.getLogger(__name__)
+
+
+class QueueFull(Exception):
+    pass
+
+class ReportQueue:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._wakeup = threading.Condition(self._lock)
+        # (phone_key, reporter id) -> (phone number as reported, monotonic time queued), oldest first.
+        self._pending = {}
+        self._thread = None
+        self._stopping = False
+        self._exit_hook = False
+        self.enqueued = 0
+        self.deduplicated = 0
+        self.rejected = 0
+        self.batches = 0
+        self.written = 0
+        self.created = 0
+        self.failures = 0
+        self.last_batch_size = 0
+        self.max_batch_size = 0
+        self.latency_total = 0.0
+        self.max_latency = 0.0
+
+    def put(self, reporter, phone_number):
+        """Queue a validated report by user id `reporter`. Raises QueueFull when the queue is at capacity."""
+        self.start()
+        item = (phone_key(phone_number), reporter)
+        with self._lock:
+            if item in self._pending:
+                self.deduplicated += 1
+                return
+            if len(self._pending) >= settings.SPAM_REPORT_QUEUE_MAX:
+                self.rejected += 1
+                raise QueueFull
+            self._pending[item] = (phone_number, time.monotonic())
+            self.enqueued += 1
+            if len(self._pending) in (1, settings.SPAM_REPORT_QUEUE_BATCH_SIZE):
+                self._wakeup.notify()
+
+    def retry_after(self):
+        """Seconds a rejected client should wait, in whole seconds as Retry-After requires."""
+        return max(1, round(settings.SPAM_REPORT_QUEUE_FLUSH_SECONDS))
+
+    def start(self):
+        """Start this process's flusher thread if it is not running yet."""
+        with self._lock:
+            if self._thread is not None and self._thread[0] == os.getpid():
+                return
+            thread = threading.Thread(target=self._run, name='spam-report-flusher', daemon=True)
+            self._thread = (os.getpid(), thread)
+            self._stopping = False
+            register = not self._exit_hook
+            self._exit_hook = True
+        if register:
+            atexit.register(self.close)
+        thread.start()
+
+    def _wait(self):
+        """Seconds until the oldest queued report is due, 0 if a batch is due now, None if the queue is empty."""
+        if not self._pending:
+            return None
+        if len(self._pending) >= settings.SPAM_REPORT_QUEUE_BATCH_SIZE:
+            return 0
+        _, queued = next(iter(self._pending.values()))
+        return max(settings.SPAM_REPORT_QUEUE_FLUSH_SECONDS - (time.monotonic() - queued), 0)
+
+    def _take(self):
+        batch = list(islice(self._pending.items(), settings.SPAM_REPORT_QUEUE_BATCH_SIZE))
+        for item, _ in batch:
+            del self._pending[item]
+        return batch
+
+    def _run(self):
+        while True:
+            with self._lock:
+                while not self._stopping and self._wait() != 0:
+                    self._wakeup.wait(self._wait())
+                if self._stopping:
+                    return
+                batch = self._take()
+            if not self._write(batch):
+                time.sleep(settings.SPAM_REPORT_QUEUE_FLUSH_SECONDS)
+            close_old_connections()
+
+    def _write(self, batch):
+        """Write one batch; on failure put it back in the queue and return False."""
+        from .models import User
+        from .reports import file_report_batch
+
+        try:
+            # Reports by users deleted since they were queued are dropped rather than fail the batch.
+            reporters = set(User.objects.filter(pk__in={reporter for (_, reporter), _ in batch}).values_list('pk', flat=True))
+            created = file_report_batch(
+                [(reporter, phone_number) for (_, reporter), (phone_number, _) in batch if reporter in reporters]
+            )
+        except Exception:
+            logger.exception('Writing %d queued spam reports failed; they stay queued', len(batch))
+            connection.close()
+            with self._lock:
+                self.failures += 1
+                for item, value in batch:
+                    self._pending.setdefault(item, value)
+            return False
+        now = time.monotonic()
+        latencies = [now - queued for _, (_, queued) in batch]
+        with self._lock:
+            self.batches += 1
+            self.written += len(batch)
+            self.created += len(created)
+            self.last_batch_size = len(batch)
+            self.max_batch_size = max(self.max_batch_size, len(batch))
+            self.latency_total += sum(latencies)
+            self.max_latency = max(self.max_latency, *latencies)
+        return True
+
+    def flush(self):
+        """Write everything queued so far from the calling thread. Returns False if a batch failed."""
+        while True:
+            with self._lock:
+                batch = self._take()
+            if not batch:
+                return True
+            if not self._write(batch):
+                return False
+
+    def close(self):
+        """Stop the flusher thread and write what is left; registered to run at exit."""
+        with self._lock:
+            self._stopping = True
+            self._wakeup.notify()
+            thread = self._thread[1] if self._thread is not None and self._thread[0] == os.getpid() else None
+        if thread is not None:
+            thread.join(timeout=10)
+        self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'enabled': settings.SPAM_REPORT_QUEUE_ENABLED,
+                'depth': len(self._pending),
+                'capacity': settings.SPAM_REPORT_QUEUE_MAX,
+                'enqueued': self.enqueued,
+                'deduplicated': self.deduplicated,
+                'rejected': self.rejected,
+                'batches': self.batches,
+                'written': self.written,
+                'created': self.created,
+                'failures': self.failures,
+                'last_batch_size': self.last_batch_size,
+                'max_batch_size': self.max_batch_size,
+                'mean_batch_size': self.written / self.batches if self.batches else 0.0,
+                'mean_flush_latency_seconds': self.latency_total / self.written if self.written else 0.0,
+                'max_flush_latency_seconds': self.max_latency,
+            }
+
+
+report_queue = ReportQueue()
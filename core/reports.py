@@ -0,0 +1,90 @@
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import stats
+from .bloom import spam_filter
+from .spam_cache import spam_cache
+from .models import SpamReport
+from .phone import phone_key
+
+BATCH_SIZE = 500
+
+
+def _insert_ignoring_conflicts(rows, timestamp):
+    """
+    INSERT ... ON CONFLICT DO NOTHING RETURNING, so duplicates cost neither an exception
+    nor a failed statement, and we learn exactly which rows were new. PostgreSQL and
+    SQLite (3.35+) both support this form. `rows` are (phone_key, phone_number, reporter id)
+    triples; returns the (phone_key, reporter id) pairs that were inserted.
+    """
+    qn = connection.ops.quote_name
+    meta = SpamReport._meta
+    phone_column = qn(meta.get_field('phone_number').column)
+    key_column = qn(meta.get_field('phone_key').column)
+    reporter_column = qn(meta.get_field('reported_by').column)
+    timestamp_column = qn(meta.get_field('timestamp').column)
+    timestamp = connection.ops.adapt_datetimefield_value(timestamp)
+
+    created = []
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), BATCH_SIZE):
+            batch = rows[start:start + BATCH_SIZE]
+            cursor.execute(
+                f'INSERT INTO {qn(meta.db_table)} ({key_column}, {phone_column}, {reporter_column}, {timestamp_column}) '
+                f'VALUES {", ".join(["(%s, %s, %s, %s)"] * len(batch))} '
+                f'ON CONFLICT ({key_column}, {reporter_column}) DO NOTHING '
+                f'RETURNING {key_column}, {reporter_column}',
+                [value for key, phone_number, reporter in batch for value in (key, phone_number, reporter, timestamp)],
+            )
+            created.extend(cursor.fetchall())
+    return created
+
+def _file(rows, phone_numbers):
+    timestamp = timezone.now()
+    created = _insert_ignoring_conflicts(rows, timestamp)
+    keys = [key for key, _ in created]
+    stats.record_reports([(key, timestamp) for key in keys], phone_numbers)
+    if keys:
+        transaction.on_commit(lambda: spam_filter.add_many(keys))
+        spam_cache.invalidate_on_commit(set(keys))
+    return created
+
+def file_reports(user, phone_numbers):
+    """
+    Report each of `phone_numbers` as spam on behalf of `user`.
+
+    Idempotent: numbers the user already reported, in any spelling, are skipped without error,
+    and only rows that were actually inserted move the maintained counters. Numbers must
+    already be validated. Returns the set of canonical keys that produced a new report.
+    """
+    numbers = {}
+    for phone_number in phone_numbers:
+        numbers.setdefault(phone_key(phone_number), phone_number)
+    numbers.pop(None, None)
+    with transaction.atomic():
+        created = _file([(key, phone_number, user.pk) for key, phone_number in numbers.items()], numbers)
+    return {key for key, _ in created}
+
+def file_report_batch(reports):
+    """
+    File (reporter id, phone number) pairs from any number of reporters in one transaction,
+    with the same idempotence as `file_reports()`. Each number's counters move once however
+    many of the reports hit it. Returns the (phone_key, reporter id) pairs that were new.
+    """
+    rows = {}
+    for reporter, phone_number in reports:
+        key = phone_key(phone_number)
+        if key is not None:
+            rows.setdefault((key, reporter), phone_number)
+    with transaction.atomic():
+        created = _file(
+            [(key, phone_number, reporter) for (key, reporter), phone_number in rows.items()],
+            {key: phone_number for (key, _), phone_number in rows.items()},
+        )
+    return set(created)
+
+def withdraw_report(report):
+    with transaction.atomic():
+        report.delete()
+        stats.release_reports([(report.phone_key, report.timestamp)])
+        spam_cache.invalidate_on_commit([report.phone_key])
@@ -0,0 +1,371 @@
+"""
+In-process n-gram index for the name search endpoint.
+
+Every registered username and contact name is split into its 1-, 2- and 3-character
+grams. Each gram maps to a posting list of entry slots held in a compact `array`, so a
+lookup intersects a handful of posting lists and only verifies the survivors instead of
+scanning `core_user` and `core_contact` with ILIKE.
+
+The index is optional (`NAME_SEARCH_INDEX_ENABLED`). Each process builds its own copy in a
+background thread at startup; until that finishes `search()` returns None and the view falls
+back to the ORM. Writes made by this process reach the index from model signals once they
+commit. Every write also logs a NameChange row, and the same thread reads the rows logged
+after the index's version every `NAME_SEARCH_INDEX_POLL_SECONDS` and re-reads just those
+users and contacts, so writes made by other processes show up within a poll. The index is
+only loaded in full again when the log can't bring it up to date (too many changes, pruned,
+or a bulk load), and once every `NAME_SEARCH_INDEX_REBUILD_SECONDS` as a safety net.
+
+Matches are ordered by kind, rank, lower-cased name and pk, compared by code point. The ORM
+fallback orders by the same key (see core/pagination.py's `SortName`), so a cursor taken from
+either path resumes correctly on the other.
+"""
+import logging
+import os
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Max, Q
+
+from . import replicas
+
+logger = logging.getLogger(__name__)
+
+USER = 0
+CONTACT = 1
+GRAM_SIZES = (1, 2, 3)
+
+_local = threading.local()
+
+
+def grams(text, sizes=GRAM_SIZES):
+    return {text[i:i + n] for n in sizes for i in range(len(text) - n + 1)}
+
+def order_key(kind, rank, name, pk):
+    """The position of a match in search results; `name` is compared lower-cased."""
+    return (kind, rank, name.lower(), pk)
+
+def log_changes(kind, pks):
+    """
+    Log that the entries `pks` of `kind` were written, for the indexes of other processes to
+    catch up on; nothing is logged while the index is disabled. Inside `batched()` the rows
+    are written when the block ends.
+    """
+    if not settings.NAME_SEARCH_INDEX_ENABLED:
+        return
+    pending = getattr(_local, 'pending', None)
+    changes = [(kind, pk) for pk in pks]
+    if pending is not None:
+        pending.extend(changes)
+    else:
+        _write(changes)
+
+def log_bulk_load():
+    """Log a load that bypassed the signals; every index that reads it rebuilds in full."""
+    from .models import NameChange
+
+    if settings.NAME_SEARCH_INDEX_ENABLED:
+        NameChange.objects.create()
+
+@contextmanager
+def batched():
+    """Log the changes of a block of writes together, in one insert at the end."""
+    if getattr(_local, 'pending', None) is not None:
+        yield
+        return
+    _local.pending = []
+    try:
+        yield
+        changes = _local.pending
+    finally:
+        _local.pending = None
+    _write(changes)
+
+def _write(changes):
+    from .models import NameChange
+
+    if len(changes) == 1:
+        # bulk_create would wrap the one insert in a transaction of its own.
+        (kind, pk), = changes
+        NameChange.objects.create(kind=kind, entry=pk)
+    else:
+        NameChange.objects.bulk_create([NameChange(kind=kind, entry=pk) for kind, pk in changes], batch_size=1000)
+
+def prune_changes(keep=None):
+    """Delete all but the newest `keep` logged changes; indexes older than that rebuild in full."""
+    from .models import GlobalCounter, NameChange
+    from .stats import counter_value, set_counter
+
+    keep = settings.NAME_SEARCH_INDEX_LOG_KEEP if keep is None else keep
+    latest = NameChange.objects.aggregate(latest=Max('pk'))['latest'] or 0
+    horizon = latest - keep
+    if horizon <= counter_value(GlobalCounter.NAME_CHANGE_HORIZON):
+        return 0
+    with transaction.atomic():
+        set_counter(GlobalCounter.NAME_CHANGE_HORIZON, horizon)
+        deleted, _ = NameChange.objects.filter(pk__lte=horizon).delete()
+    return deleted
+
+class NameIndex:
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._pending = None
+        # The process maintaining this copy, and the one that last built it (see search()).
+        self._maintainer = None
+        self._built_by = None
+        self.ready = False
+        self.built_at = None
+        # Every logged change up to `version` is in the index; `_gaps` are the ids below it not
+        # seen yet, with when they were first missed, and `horizon` the log's oldest change.
+        self.version = 0
+        self._gaps = {}
+        self.horizon = 0
+        self._clear()
+
+    def _clear(self):
+        self._kinds = array('b')
+        self._pks = array('q')
+        self._names = []
+        self._lowered = []
+        self._phones = []
+        self._keys = array('q')
+        self._slots = {}
+        self._postings = {}
+        self._dead = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+    # Maintenance
+
+    def _add(self, kind, pk, name, phone_number, phone_key):
+        self._remove(kind, pk)
+        slot = len(self._names)
+        lowered = name.lower()
+        self._kinds.append(kind)
+        self._pks.append(pk)
+        self._names.append(name)
+        self._lowered.append(lowered)
+        self._phones.append(phone_number)
+        self._keys.append(phone_key or 0)
+        self._slots[(kind, pk)] = slot
+        for gram in grams(lowered):
+            postings = self._postings.get(gram)
+            if postings is None:
+                postings = self._postings[gram] = array('I')
+            postings.append(slot)
+
+    def _remove(self, kind, pk):
+        slot = self._slots.pop((kind, pk), None)
+        if slot is None:
+            return
+        # Posting lists keep the dead slot; it is skipped on lookup and dropped on compaction.
+        self._lowered[slot] = None
+        self._dead += 1
+        if self._dead > len(self._slots):
+            self._compact()
+
+    def _compact(self):
+        live = [
+            (self._kinds[slot], self._pks[slot], self._names[slot], self._phones[slot], self._keys[slot] or None)
+            for slot in sorted(self._slots.values())
+        ]
+        self._clear()
+        for entry in live:
+            self._add(*entry)
+
+    def _apply(self, op, *args):
+        with self._lock:
+            # During a rebuild the write goes to the live copy and is replayed onto the new one.
+            if self._pending is not None:
+                self._pending.append((op, args))
+            if self.ready:
+                op(*args)
+
+    def add(self, kind, pk, name, phone_number, phone_key):
+        self._apply(self._add, kind, pk, name, phone_number, phone_key)
+
+    def remove(self, kind, pk):
+        self._apply(self._remove, kind, pk)
+
+    def build(self):
+        """Load every user and contact, then swap the result in and replay writes seen meanwhile."""
+        from .models import Contact, NameChange, User
+
+        with self._lock:
+            self._pending = []
+        try:
+            # Read before the rows, so changes committed during the load are caught up on again.
+            version = NameChange.objects.aggregate(version=Max('pk'))['version'] or 0
+            fresh = NameIndex()
+            users = User.objects.values_list('pk', 'username', 'phone_number', 'phone_key')
+            for row in users.iterator(chunk_size=5000):
+                fresh._add(USER, *row)
+            contacts = Contact.objects.values_list('pk', 'name', 'phone_number', 'phone_key')
+            for row in contacts.iterator(chunk_size=5000):
+                fresh._add(CONTACT, *row)
+        except Exception:
+            with self._lock:
+                self._pending = None
+            raise
+        with self._lock:
+            pending, self._pending = self._pending, None
+            self.__dict__.update({
+                key: value for key, value in fresh.__dict__.items()
+                if key in ('_kinds', '_pks', '_names', '_lowered', '_phones', '_keys', '_slots', '_postings', '_dead')
+            })
+            for op, args in pending:
+                op(*args)
+            self.version = version
+            self._gaps = {}
+            self.ready = True
+            self.built_at = time.monotonic()
+            self._built_by = os.getpid()
+
+    def catch_up(self):
+        """
+        Re-read the users and contacts logged as changed since the index's version. Returns
+        False, leaving the index as it was, when the log can't bring it up to date.
+        """
+        from .models import Contact, GlobalCounter, NameChange, User
+        from .stats import counter_value
+
+        version, gaps = self.version, dict(self._gaps)
+        limit = settings.NAME_SEARCH_INDEX_MAX_CATCH_UP
+        with replicas.primary():
+            horizon = counter_value(GlobalCounter.NAME_CHANGE_HORIZON)
+            changes = list(
+                NameChange.objects.filter(Q(pk__gt=version) | Q(pk__in=list(gaps)))
+                .order_by('pk')
+                .values_list('pk', 'kind', 'entry')[:limit + 1]
+            )
+            if version < horizon or len(changes) > limit or any(kind is None for _, kind, _ in changes):
+                return False
+            entries = {USER: set(), CONTACT: set()}
+            for _, kind, pk in changes:
+                entries[kind].add(pk)
+            users = {
+                pk: row for pk, *row in
+                User.objects.filter(pk__in=entries[USER]).values_list('pk', 'username', 'phone_number', 'phone_key')
+            }
+            contacts = {
+                pk: row for pk, *row in
+                Contact.objects.filter(pk__in=entries[CONTACT]).values_list('pk', 'name', 'phone_number', 'phone_key')
+            }
+
+        for kind, rows in ((USER, users), (CONTACT, contacts)):
+            for pk in entries[kind]:
+                if pk in rows:
+                    self.add(kind, pk, *rows[pk])
+                else:
+                    self.remove(kind, pk)
+
+        # Ids are handed out before their transactions commit, so one that committed later than a
+        # higher id (or rolled back) is missing now. Look for it again until it is this old.
+        now = time.monotonic()
+        seen = {pk for pk, _, _ in changes}
+        top = max(seen, default=version)
+        gaps = {pk: since for pk, since in gaps.items() if pk not in seen and now - since < settings.NAME_SEARCH_INDEX_GAP_SECONDS}
+        if top - version - len(seen) <= limit:
+            gaps.update((pk, now) for pk in range(version + 1, top) if pk not in seen)
+        with self._lock:
+            if self.version == version:
+                self.version, self._gaps, self.horizon = top, gaps, horizon
+        return True
+
+    def reset(self):
+        with self._lock:
+            self.ready = False
+            self.built_at = None
+            self.version = 0
+            self._gaps = {}
+            self._clear()
+
+    def warm(self):
+        """Start building and maintaining the index in the background, once per process, if enabled."""
+        if not settings.NAME_SEARCH_INDEX_ENABLED or self._maintainer == os.getpid():
+            return
+        with self._lock:
+            if self._maintainer == os.getpid():
+                return
+            self._maintainer = os.getpid()
+            thread = threading.Thread(target=self._maintain, name='name-index', daemon=True)
+        thread.start()
+
+    def _maintain(self):
+        while True:
+            try:
+                stale = not self.ready or time.monotonic() - self.built_at > settings.NAME_SEARCH_INDEX_REBUILD_SECONDS
+                if stale or not self.catch_up():
+                    self.build()
+                elif self.version - self.horizon > 2 * settings.NAME_SEARCH_INDEX_LOG_KEEP:
+                    prune_changes()
+            except Exception:
+                logger.exception('Maintaining the name search index failed')
+            finally:
+                close_old_connections()
+            time.sleep(settings.NAME_SEARCH_INDEX_POLL_SECONDS)
+
+    # Lookup
+
+    def _candidates(self, query):
+        size = min(len(query), GRAM_SIZES[-1])
+        postings = []
+        for gram in grams(query, (size,)):
+            posting = self._postings.get(gram)
+            if posting is None:
+                return ()
+            postings.append(posting)
+        postings.sort(key=len)
+        candidates = set(postings[0])
+        for posting in postings[1:]:
+            candidates.intersection_update(posting)
+            if not candidates:
+                break
+        return candidates
+
+    def search(self, query, limit, after=None):
+        """
+        Return up to `limit` (kind, rank, name, pk, phone_number, phone_key) matches for `query`,
+        ordered the way the ORM search orders them: users before contacts, prefix matches before
+        substring matches, then by lower-cased name (`order_key`). Contacts sharing a number with a
+        matched user are dropped. `after` is a (kind, rank, name, pk) keyset position; only matches
+        ordered after it are returned. Returns None when the index is disabled or not built yet.
+        """
+        if not settings.NAME_SEARCH_INDEX_ENABLED:
+            return None
+        if not self.ready:
+            self.warm()
+            return None
+        if self._built_by != os.getpid():
+            # A copy inherited from the parent of a forked worker; keep it up to date from here.
+            self.warm()
+
+        query = query.lower()
+        with self._lock:
+            users = []
+            contacts = []
+            for slot in self._candidates(query):
+                lowered = self._lowered[slot]
+                if lowered is None or query not in lowered:
+                    continue
+                kind = self._kinds[slot]
+                rank = 0 if lowered.startswith(query) else 1
+                match = (kind, rank, self._names[slot], self._pks[slot], self._phones[slot], self._keys[slot] or None)
+                (users if kind == USER else contacts).append(match)
+
+        matched_keys = {match[5] for match in users if match[5] is not None}
+        def key(match):
+            return order_key(*match[:4])
+
+        matches = sorted(users, key=key) + sorted((match for match in contacts if match[5] not in matched_keys), key=key)
+        if after is not None:
+            matches = matches[bisect_right(matches, order_key(*after), key=key):]
+        return matches[:limit]
+
+
+name_index = NameIndex()
@@ -1,7 +1,10 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import get_user_model, password_validation
 from django.core import exceptions as django_exceptions
+from django.db import IntegrityError, transaction
 from .models import Contact, SpamReport
+from .phone import phone_key, validate_phone_number
 
 User = get_user_model()
 
@@ -14,20 +17,32 @@ class RegistrationSerializer(serializers.ModelSerializer):
         fields = ('username', 'phone_number', 'email', 'password', 'password2')
         extra_kwargs = {'username': {'required': True}}
 
+    def validate_phone_number(self, value):
+        if User.objects.filter(phone_key=phone_key(value)).exists():
+            raise serializers.ValidationError('A user with this phone number already exists.')
+        return value
+
     def validate(self, data):
         if data['password'] != data['password2']:
             raise serializers.ValidationError({"password": "Password fields didn't match."})
         return data
 
     def create(self, validated_data):
-        user = User.objects.create_user(
-            username=validated_data['username'],
-            phone_number=validated_data['phone_number'],
-            email=validated_data.get('email', '')
-        )
-        user.set_password(validated_data['password'])
-        user.save()
-        return user
+        # validate_phone_number can't see a concurrent signup; the unique phone_key can.
+        try:
+            with transaction.atomic():
+                return User.objects.create_user(
+                    username=validated_data['username'],
+                    phone_number=validated_data['phone_number'],
+                    email=validated_data.get('email', ''),
+                    password=validated_data['password'],
+                )
+        except IntegrityError:
+            if User.objects.filter(phone_key=phone_key(validated_data['phone_number'])).exists():
+                raise serializers.ValidationError({'phone_number': ['A user with this phone number already exists.']})
+            if User.objects.filter(username=validated_data['username']).exists():
+                raise serializers.ValidationError({'username': ['A user with that username already exists.']})
+            raise
 
 class LoginSerializer(serializers.Serializer):
     phone_number = serializers.CharField()
@@ -47,11 +62,40 @@ class ContactSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         return Contact.objects.create(**validated_data)
 
+class ContactSyncEntrySerializer(serializers.Serializer):
+    name = serializers.CharField(max_length=255)
+    phone_number = serializers.CharField(max_length=20, validators=[validate_phone_number])
+
+class ContactSyncSerializer(serializers.Serializer):
+    contacts = ContactSyncEntrySerializer(many=True, max_length=settings.CONTACT_SYNC_MAX_CONTACTS)
+    delete_missing = serializers.BooleanField(default=True)
+
 class SpamReportSerializer(serializers.ModelSerializer):
     class Meta:
         model = SpamReport
         fields = ('phone_number',)
 
+class SpamBatchReportSerializer(serializers.Serializer):
+    phone_numbers = serializers.ListField(
+        child=serializers.CharField(max_length=20, validators=[validate_phone_number]),
+        allow_empty=False,
+        max_length=settings.SPAM_REPORT_BATCH_MAX,
+    )
+
+class PhoneLookupBatchSerializer(serializers.Serializer):
+    phone_numbers = serializers.ListField(
+        child=serializers.CharField(max_length=20, validators=[validate_phone_number]),
+        allow_empty=False,
+        max_length=settings.PHONE_LOOKUP_BATCH_MAX,
+    )
+
+class UserDetailBatchSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=settings.USER_DETAIL_BATCH_MAX,
+    )
+
 class SearchResultSerializer(serializers.Serializer):
     name = serializers.CharField()
     phone_number = serializers.CharField()
@@ -64,4 +108,15 @@ class UserDetailSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
         fields = ('id', 'username', 'phone_number', 'email', 'spam_likelihood')
-        read_only_fields = ('phone_number',)
\ No newline at end of file
+        read_only_fields = ('phone_number',)
+
+class PopulateTestDataSerializer(serializers.Serializer):
+    users = serializers.IntegerField(min_value=0, max_value=100000, default=50)
+    contacts_per_user = serializers.IntegerField(min_value=0, max_value=1000, default=20)
+    spam_reports = serializers.IntegerField(min_value=0, max_value=1000000, default=100)
+    seed = serializers.IntegerField(min_value=0, required=False)
+
+class ProfilerSessionSerializer(serializers.Serializer):
+    rate = serializers.FloatField(min_value=0, max_value=1)
+    routes = serializers.ListField(child=serializers.CharField(), default=list)
+    seconds = serializers.IntegerField(min_value=1, max_value=settings.PROFILER_MAX_SECONDS, default=300)
@@ -0,0 +1,152 @@
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
+from django.dispatch import Signal, receiver
+from rest_framework.authtoken.models import Token
+
+from . import directory, search_index, stats, versions
+from .metrics import instrument_connection
+from .authentication import forget_token, forget_user
+from .models import Contact, GlobalCounter, PhoneDirectory, SpamReport, User
+from .search_index import CONTACT, USER, name_index
+from .spam_cache import spam_cache
+
+# Sent by bulk contact writes that bypass post_save: `created` and `updated` are Contact
+# instances with their primary keys set. Bulk deletes still send post_delete per row.
+contacts_synced = Signal()
+
+
+@receiver(post_save, sender=User)
+def count_new_user(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        stats.adjust_counter(GlobalCounter.USERS, 1)
+
+@receiver(post_delete, sender=User)
+def count_deleted_user(sender, instance, **kwargs):
+    stats.adjust_counter(GlobalCounter.USERS, -1)
+
+@receiver(pre_delete, sender=User)
+def release_user_spam_reports(sender, instance, **kwargs):
+    """Reports cascade away with their reporter; take them out of the maintained counts first."""
+    reports = list(SpamReport.objects.filter(reported_by=instance).values_list('phone_key', 'timestamp'))
+    stats.release_reports(reports)
+    spam_cache.invalidate_on_commit({key for key, _ in reports})
+
+@receiver(post_save, sender=User)
+def index_user(sender, instance, raw=False, update_fields=None, **kwargs):
+    # Logins save only last_login, which the index doesn't hold.
+    if raw or (update_fields is not None and not {'username', 'phone_number'} & set(update_fields)):
+        return
+    search_index.log_changes(USER, [instance.pk])
+    transaction.on_commit(lambda: name_index.add(USER, instance.pk, instance.username, instance.phone_number, instance.phone_key))
+
+@receiver(post_delete, sender=User)
+def unindex_user(sender, instance, **kwargs):
+    pk = instance.pk
+    search_index.log_changes(USER, [pk])
+    transaction.on_commit(lambda: name_index.remove(USER, pk))
+
+@receiver(pre_delete, sender=User)
+def log_user_contacts_removal(sender, instance, **kwargs):
+    """Contacts cascade away with their user; log them all in one insert rather than one per row."""
+    search_index.log_changes(CONTACT, Contact.objects.filter(user=instance).values_list('pk', flat=True))
+
+@receiver(post_save, sender=Contact)
+def index_contact(sender, instance, raw=False, **kwargs):
+    if not raw:
+        search_index.log_changes(CONTACT, [instance.pk])
+        transaction.on_commit(lambda: name_index.add(CONTACT, instance.pk, instance.name, instance.phone_number, instance.phone_key))
+
+@receiver(post_delete, sender=Contact)
+def unindex_contact(sender, instance, origin=None, **kwargs):
+    pk = instance.pk
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model is not User:
+        search_index.log_changes(CONTACT, [pk])
+    transaction.on_commit(lambda: name_index.remove(CONTACT, pk))
+
+@receiver(contacts_synced)
+def index_synced_contacts(sender, user, created, updated, **kwargs):
+    search_index.log_changes(CONTACT, [contact.pk for contact in created + updated])
+
+    def apply():
+        for contact in created + updated:
+            name_index.add(CONTACT, contact.pk, contact.name, contact.phone_number, contact.phone_key)
+    transaction.on_commit(apply)
+
+@receiver(post_save, sender=Contact)
+def bump_contacts_version(sender, instance, raw=False, **kwargs):
+    if not raw:
+        versions.bump(instance.user_id, versions.CONTACTS)
+
+@receiver(post_delete, sender=Contact)
+def bump_contacts_version_on_delete(sender, instance, origin=None, **kwargs):
+    # Contacts deleted along with their user need no new version; its row is going too.
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model is not User:
+        versions.bump(instance.user_id, versions.CONTACTS)
+
+@receiver(post_save, sender=User)
+def bump_profile_version(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        versions.start(instance.pk)
+    elif not raw:
+        versions.bump(instance.pk, versions.PROFILE)
+
+@receiver(post_save, sender=User)
+def list_user_in_directory(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        directory.register([(instance.pk, instance.phone_key, instance.phone_number)])
+
+@receiver(pre_delete, sender=User)
+def release_user_contacts(sender, instance, **kwargs):
+    """Contacts cascade away with their user; count them out of the directory in one pass."""
+    contacts = Contact.objects.filter(user=instance).values_list('phone_key', 'phone_number', 'name')
+    directory.adjust(directory.contact_changes(contacts, -1))
+
+@receiver(post_delete, sender=User)
+def unlist_user_from_directory(sender, instance, **kwargs):
+    # The user's row has had its user cleared; drop it if no contacts hold the number either.
+    PhoneDirectory.objects.filter(phone_key=instance.phone_key, user=None, contact_count=0).delete()
+
+@receiver(pre_save, sender=Contact)
+def remember_directory_entry(sender, instance, raw=False, **kwargs):
+    """An edited contact is counted out of the directory under the number and name it had."""
+    if not raw and not instance._state.adding:
+        instance._directory_entry = (
+            Contact.objects.filter(pk=instance.pk).values_list('phone_key', 'phone_number', 'name').first()
+        )
+
+@receiver(post_save, sender=Contact)
+def list_contact_in_directory(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    changes = directory.contact_changes([(instance.phone_key, instance.phone_number, instance.name)], 1)
+    previous = instance.__dict__.pop('_directory_entry', None)
+    if created:
+        directory.adjust(changes)
+    elif previous is not None:
+        directory.adjust(changes + directory.contact_changes([previous], -1))
+
+@receiver(post_delete, sender=Contact)
+def unlist_contact_from_directory(sender, instance, origin=None, **kwargs):
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin_model is not User:
+        directory.adjust(directory.contact_changes([(instance.phone_key, instance.phone_number, instance.name)], -1))
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def forget_cached_credentials(sender, instance, **kwargs):
+    """A deactivated or edited user must not keep authenticating from a stale cached copy."""
+    forget_user(instance.pk)
+    transaction.on_commit(lambda: forget_user(instance.pk))
+
+@receiver(post_delete, sender=Token)
+def forget_deleted_token(sender, instance, **kwargs):
+    forget_token(instance.key)
+    transaction.on_commit(lambda: forget_token(instance.key))
+
+@receiver(connection_created)
+def count_request_queries(sender, connection, **kwargs):
+    instrument_connection(connection)
@@ -0,0 +1,168 @@
+"""
+Binary snapshots of the spam list, plus the delta feed that brings a snapshot up to date.
+
+Snapshot file format, little-endian:
+
+    header  8s magic b'PBSPAM01', Q version, Q record count      (24 bytes)
+    records Q phone_key, I report count, sorted by phone_key      (12 bytes each)
+
+Records are fixed-width and sorted, so a reader can mmap the file and binary-search it in place
+(see SpamSnapshot), and the web server can send it with sendfile.
+
+The version is the id of the latest SpamListChange the snapshot reflects. Every report write
+logs the numbers it touched while holding the global report counter lock, so change ids follow
+commit order. A client holding version V asks `changes_since(V)` for every number touched after
+V, with its current count. A number whose count fell to zero is listed as removed. Changes at or
+before the horizon have been pruned, or were invalidated by a rebuild; a client that far behind
+downloads a new snapshot.
+"""
+import mmap
+import os
+import struct
+from pathlib import Path
+
+from django.conf import settings
+from django.db.models import Max
+
+from . import stats
+from .models import GlobalCounter, PhoneSpamStat, SpamListChange
+
+MAGIC = b'PBSPAM01'
+HEADER = struct.Struct('<8sQQ')
+RECORD = struct.Struct('<QI')
+WRITE_CHUNK = 10000
+
+
+class SnapshotExpired(Exception):
+    """The requested version is older than the change log reaches back."""
+
+class SpamSnapshot:
+    """A snapshot file mapped into memory. Indexing yields (phone_key, report count) records."""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.version, self.count = HEADER.unpack_from(self._map)
+        if magic != MAGIC or len(self._map) != HEADER.size + self.count * RECORD.size:
+            self._map.close()
+            raise ValueError(f'{path} is not a spam list snapshot')
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not 0 <= index < self.count:
+            raise IndexError(index)
+        return RECORD.unpack_from(self._map, HEADER.size + index * RECORD.size)
+
+    def report_count(self, key):
+        """Report count of the canonical number `key`, 0 if it is not on the list."""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            found, count = self[middle]
+            if found == key:
+                return count
+            if found < key:
+                low = middle + 1
+            else:
+                high = middle
+        return 0
+
+    def close(self):
+        self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+def current_version(floor=None):
+    latest = SpamListChange.objects.aggregate(version=Max('pk'))['version']
+    return max(latest or 0, horizon() if floor is None else floor)
+
+def horizon():
+    return stats.counter_value(GlobalCounter.SPAM_LIST_HORIZON)
+
+def snapshot_dir(directory=None):
+    return Path(directory or settings.SPAM_SNAPSHOT_DIR)
+
+def snapshot_paths(directory=None):
+    """(version, path) of every snapshot in `directory`, oldest first."""
+    paths = []
+    for path in snapshot_dir(directory).glob('spam-*.bin'):
+        try:
+            paths.append((int(path.stem.split('-', 1)[1]), path))
+        except ValueError:
+            continue
+    return sorted(paths)
+
+def latest_snapshot(directory=None):
+    """(version, path) of the newest snapshot that deltas can still bring up to date, or None."""
+    paths = snapshot_paths(directory)
+    if not paths or paths[-1][0] < horizon():
+        return None
+    return paths[-1]
+
+def export_snapshot(directory=None, keep=None):
+    """
+    Write the current spam list as a new snapshot, then delete all but the newest `keep`
+    snapshots and the changes only they needed. Returns the snapshot's version, size and path.
+    """
+    directory = snapshot_dir(directory)
+    directory.mkdir(parents=True, exist_ok=True)
+    # Rows read after the version may already include later changes; replaying those is harmless.
+    version = current_version()
+    rows = PhoneSpamStat.objects.filter(report_count__gt=0).order_by('phone_key').values_list('phone_key', 'report_count')
+    path = directory / f'spam-{version:012d}.bin'
+    temporary = path.with_suffix('.tmp')
+    count = 0
+    with open(temporary, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, version, 0))
+        chunk = bytearray()
+        for key, report_count in rows.iterator(chunk_size=WRITE_CHUNK):
+            chunk += RECORD.pack(key, report_count)
+            count += 1
+            if count % WRITE_CHUNK == 0:
+                f.write(chunk)
+                chunk = bytearray()
+        f.write(chunk)
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, version, count))
+    os.replace(temporary, path)
+    prune(directory, settings.SPAM_SNAPSHOT_KEEP if keep is None else keep)
+    return {'version': version, 'numbers': count, 'path': str(path)}
+
+def prune(directory=None, keep=1):
+    """Delete all but the newest `keep` snapshots, and the changes none of the kept ones need."""
+    paths = snapshot_paths(directory)
+    for _, path in paths[:-keep]:
+        path.unlink(missing_ok=True)
+    kept = paths[-keep:]
+    if kept and kept[0][0] > horizon():
+        stats.set_counter(GlobalCounter.SPAM_LIST_HORIZON, kept[0][0])
+        SpamListChange.objects.filter(pk__lte=kept[0][0]).delete()
+
+def changes_since(since):
+    """
+    Numbers whose report count changed after version `since`: `added` holds [phone_key, count]
+    for numbers now on the list, `removed` the keys of numbers no longer on it.
+    """
+    floor = horizon()
+    if since < floor:
+        raise SnapshotExpired(since)
+    version = current_version(floor)
+    changed = (
+        stats.with_report_count(SpamListChange.objects.filter(pk__gt=since, pk__lte=version).exclude(phone_key=None))
+        .values_list('phone_key', 'spam_count')
+        .order_by('phone_key')
+        .distinct()
+    )
+    added, removed = [], []
+    for key, count in changed:
+        if count > 0:
+            added.append([key, count])
+        else:
+            removed.append(key)
+    return {'version': version, 'added': added, 'removed': removed}
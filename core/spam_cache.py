@@ -0,0 +1,153 @@
+"""
+Cache of per-number spam report counts for the hot lookup endpoints.
+
+Goes through Django's cache framework (the `SPAM_LOOKUP_CACHE` alias), so tests and single
+hosts use the bounded LRU local-memory backend while production can point the alias at a
+shared backend. Entries expire after the alias's TIMEOUT and are deleted as soon as a
+report for the number is filed or withdrawn. Misses are read from the primary even during a
+request served from a read replica, since an entry filled from a lagging replica would stay
+stale until it expires.
+
+`manage.py rebuild_spam_stats` clears the cache, but a local-memory cache only in its own
+process. So each serving process (see wsgi.py and asgi.py) also checks the SPAM_LIST_HORIZON
+counter, which moves on every rebuild, from a background thread every
+SPAM_LOOKUP_CACHE_GENERATION_SECONDS, and clears its cache when the counter has moved.
+"""
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import close_old_connections, transaction
+
+from . import replicas, stats
+from .models import GlobalCounter
+
+logger = logging.getLogger(__name__)
+
+
+class SpamLookupCache:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+        # The SPAM_LIST_HORIZON value the cached counts were read under, and the watching process.
+        self.generation = None
+        self._watcher = None
+
+    @property
+    def cache(self):
+        return caches[settings.SPAM_LOOKUP_CACHE]
+
+    def check_generation(self):
+        """Clear this process's entries if the statistics were rebuilt since the last check."""
+        with replicas.primary():
+            generation = stats.counter_value(GlobalCounter.SPAM_LIST_HORIZON)
+        if self.generation is not None and generation != self.generation:
+            self.clear()
+        self.generation = generation
+
+    def watch(self):
+        """Start checking the generation in the background, once per process (see wsgi.py/asgi.py)."""
+        if self._watcher == os.getpid():
+            return
+        with self._lock:
+            if self._watcher == os.getpid():
+                return
+            self._watcher = os.getpid()
+            thread = threading.Thread(target=self._watch, name='spam-cache-generation', daemon=True)
+        thread.start()
+
+    def _watch(self):
+        while True:
+            try:
+                self.check_generation()
+            except Exception:
+                logger.exception('Checking the spam statistics generation failed')
+            finally:
+                close_old_connections()
+            time.sleep(settings.SPAM_LOOKUP_CACHE_GENERATION_SECONDS)
+
+    def make_key(self, key):
+        return f'spam-count:{key}'
+
+    def report_count(self, key):
+        """Maintained report count for the canonical number `key`, from cache when possible."""
+        if key is None:
+            return 0
+        count = self.cache.get(self.make_key(key))
+        if count is not None:
+            with self._lock:
+                self.hits += 1
+            return count
+        with self._lock:
+            self.misses += 1
+        with replicas.primary():
+            count = stats.report_count(key)
+        self.cache.set(self.make_key(key), count)
+        return count
+
+    async def areport_count(self, key):
+        if key is None:
+            return 0
+        count = await self.cache.aget(self.make_key(key))
+        if count is not None:
+            with self._lock:
+                self.hits += 1
+            return count
+        with self._lock:
+            self.misses += 1
+        count = await stats.areport_count(key)
+        await self.cache.aset(self.make_key(key), count)
+        return count
+
+    def report_counts(self, keys):
+        """Map each of `keys` to its report count, reading every cache miss in one query."""
+        keys = [key for key in set(keys) if key is not None]
+        cached = self.cache.get_many([self.make_key(key) for key in keys])
+        counts = {key: cached[self.make_key(key)] for key in keys if self.make_key(key) in cached}
+        missing = [key for key in keys if key not in counts]
+        with self._lock:
+            self.hits += len(counts)
+            self.misses += len(missing)
+        if missing:
+            with replicas.primary():
+                fetched = stats.report_counts(missing)
+            self.cache.set_many({self.make_key(key): count for key, count in fetched.items()})
+            counts.update(fetched)
+        return counts
+
+    def invalidate(self, keys):
+        keys = [self.make_key(key) for key in keys if key is not None]
+        if keys:
+            self.cache.delete_many(keys)
+            with self._lock:
+                self.invalidations += len(keys)
+
+    def invalidate_on_commit(self, keys):
+        """
+        Drop `keys` now and again once the surrounding transaction commits, so a reader that
+        refilled an entry from pre-commit data in between cannot leave it stale.
+        """
+        keys = list(keys)
+        self.invalidate(keys)
+        transaction.on_commit(lambda: self.invalidate(keys))
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else 0.0,
+            'invalidations': self.invalidations,
+            'evictions': getattr(self.cache, 'evictions', None),
+        }
+
+
+spam_cache = SpamLookupCache()
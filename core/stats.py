@@ -0,0 +1,303 @@
+"""
+Maintained spam statistics, so lookups read a row instead of aggregating over every report.
+
+Each PhoneSpamStat row carries a number's lifetime report count, its reports within each of
+WINDOWS and an exponentially decayed score. All of them are adjusted in the transaction that
+files or withdraws a report. Window counts are backed by PhoneSpamBucket rows:
+`compact_windows()` subtracts buckets that have aged out of a window and remembers how far it
+got in a per-window watermark, so a withdrawn report only leaves the windows it still counts in.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from itertools import groupby
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, FloatField, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Greatest, Power
+from django.utils import timezone
+
+from .models import GlobalCounter, PhoneSpamBucket, PhoneSpamStat, SpamListChange, SpamReport, User
+from .phone import format_e164
+
+# PhoneSpamStat column -> the rolling window it counts reports over.
+WINDOWS = {
+    'reports_1h': timedelta(hours=1),
+    'reports_24h': timedelta(days=1),
+    'reports_30d': timedelta(days=30),
+}
+UPDATE_BATCH_SIZE = 500
+
+
+def spam_likelihood(report_count, total):
+    """Percentage of `total` made up by `report_count`, 0 when there is nothing to compare against."""
+    return (report_count / total) * 100 if total > 0 else 0
+
+def report_count(key):
+    """Maintained number of spam reports filed against the canonical number `key`."""
+    if key is None:
+        return 0
+    count = PhoneSpamStat.objects.filter(phone_key=key).values_list('report_count', flat=True).first()
+    return count or 0
+
+async def areport_count(key):
+    if key is None:
+        return 0
+    count = await PhoneSpamStat.objects.filter(phone_key=key).values_list('report_count', flat=True).afirst()
+    return count or 0
+
+def report_counts(keys):
+    """Map each of the canonical numbers `keys` to its maintained report count in a single query."""
+    counts = dict.fromkeys(keys, 0)
+    counts.update(
+        PhoneSpamStat.objects.filter(phone_key__in=[key for key in counts if key is not None])
+        .values_list('phone_key', 'report_count')
+    )
+    return counts
+
+async def areport_counts(keys):
+    counts = dict.fromkeys(keys, 0)
+    rows = PhoneSpamStat.objects.filter(phone_key__in=[key for key in counts if key is not None])
+    async for key, count in rows.values_list('phone_key', 'report_count'):
+        counts[key] = count
+    return counts
+
+def with_report_count(queryset, field='phone_key'):
+    """Annotate `spam_count` onto `queryset` from the maintained stats, as a correlated subquery."""
+    report_count = PhoneSpamStat.objects.filter(phone_key=OuterRef(field)).values('report_count')[:1]
+    return queryset.annotate(spam_count=Coalesce(Subquery(report_count), Value(0)))
+
+def counter_value(name):
+    value = GlobalCounter.objects.filter(name=name).values_list('value', flat=True).first()
+    return value or 0
+
+async def acounter_value(name):
+    value = await GlobalCounter.objects.filter(name=name).values_list('value', flat=True).afirst()
+    return value or 0
+
+def total_reports():
+    return counter_value(GlobalCounter.SPAM_REPORTS)
+
+async def atotal_reports():
+    return await acounter_value(GlobalCounter.SPAM_REPORTS)
+
+def total_users():
+    return counter_value(GlobalCounter.USERS)
+
+def set_counter(name, value):
+    GlobalCounter.objects.update_or_create(name=name, defaults={'value': value})
+
+def adjust_counter(name, delta):
+    if not delta:
+        return
+    updated = GlobalCounter.objects.filter(name=name).update(value=F('value') + delta)
+    if not updated:
+        GlobalCounter.objects.bulk_create([GlobalCounter(name=name)], ignore_conflicts=True)
+        GlobalCounter.objects.filter(name=name).update(value=F('value') + delta)
+
+def bucket_of(moment):
+    return int(moment.timestamp()) // settings.SPAM_WINDOW_BUCKET_SECONDS
+
+def window_buckets(window):
+    return int(window.total_seconds()) // settings.SPAM_WINDOW_BUCKET_SECONDS
+
+def watermark_name(column):
+    return f'{column}_rolled'
+
+def window_watermarks():
+    """The last bucket already rolled off each window, per column (-1 before any compaction)."""
+    names = {watermark_name(column): column for column in WINDOWS}
+    rolled = dict.fromkeys(WINDOWS, -1)
+    for name, value in GlobalCounter.objects.filter(name__in=names).values_list('name', 'value'):
+        rolled[names[name]] = value
+    return rolled
+
+def decay(score, elapsed):
+    """`score` after `elapsed` seconds of exponential decay."""
+    return score * 0.5 ** (max(elapsed, 0) / settings.SPAM_SCORE_HALF_LIFE)
+
+def decayed_score(score, updated_at, now=None):
+    now = now or timezone.now()
+    return max(decay(score, now.timestamp() - updated_at), 0.0)
+
+def spam_scores(key, now=None):
+    """Lifetime, per-window and decayed report figures for the canonical number `key`, from its one row."""
+    fields = ('report_count', *WINDOWS, 'decayed_score', 'score_updated_at')
+    row = PhoneSpamStat.objects.filter(phone_key=key).values_list(*fields).first() if key is not None else None
+    scores = dict(zip(fields, row or (0,) * len(fields)))
+    scores['decayed_score'] = decayed_score(scores['decayed_score'], scores.pop('score_updated_at'), now)
+    return scores
+
+def _per_key(values, keys, output_field=None):
+    """An expression worth `values[phone_key]` on each of the rows for `keys`."""
+    output_field = output_field or IntegerField()
+    distinct = {values.get(key, 0) for key in keys}
+    if len(distinct) == 1:
+        return Value(distinct.pop(), output_field=output_field)
+    return Case(
+        *[When(phone_key=key, then=Value(values.get(key, 0))) for key in keys],
+        default=Value(0),
+        output_field=output_field,
+    )
+
+def _adjust_reports(reports, sign, phone_numbers=None):
+    reports = [(key, timestamp) for key, timestamp in reports if key is not None]
+    if not reports:
+        return
+    phone_numbers = phone_numbers or {}
+    now = timezone.now()
+    adjust_counter(GlobalCounter.SPAM_REPORTS, sign * len(reports))
+    # A new report lands in the current bucket, which no window has rolled past yet.
+    rolled = window_watermarks() if sign < 0 else dict.fromkeys(WINDOWS, -1)
+
+    counts = defaultdict(int)
+    windows = {column: defaultdict(int) for column in WINDOWS}
+    weights = defaultdict(float)
+    buckets = defaultdict(lambda: defaultdict(int))
+    for key, timestamp in reports:
+        bucket = bucket_of(timestamp)
+        counts[key] += sign
+        for column in WINDOWS:
+            if bucket > rolled[column]:
+                windows[column][key] += sign
+        weights[key] += sign * decay(1.0, now.timestamp() - timestamp.timestamp())
+        buckets[bucket][key] += sign
+
+    if sign > 0:
+        PhoneSpamStat.objects.bulk_create(
+            [PhoneSpamStat(phone_key=key, phone_number=phone_numbers.get(key) or format_e164(key)) for key in counts],
+            ignore_conflicts=True,
+        )
+        PhoneSpamBucket.objects.bulk_create(
+            [PhoneSpamBucket(phone_key=key, bucket=bucket) for bucket, keys in buckets.items() for key in keys],
+            ignore_conflicts=True,
+        )
+    # Bring the stored score up to now, then add (or take away) each report's decayed weight.
+    score = F('decayed_score') * Power(
+        Value(0.5), (Value(now.timestamp()) - F('score_updated_at')) / Value(float(settings.SPAM_SCORE_HALF_LIFE)),
+    )
+    keys = list(counts)
+    for start in range(0, len(keys), UPDATE_BATCH_SIZE):
+        batch = keys[start:start + UPDATE_BATCH_SIZE]
+        PhoneSpamStat.objects.filter(phone_key__in=batch).update(
+            report_count=F('report_count') + _per_key(counts, batch),
+            **{column: F(column) + _per_key(windows[column], batch) for column in WINDOWS},
+            decayed_score=Greatest(score + _per_key(weights, batch, FloatField()), Value(0.0)),
+            score_updated_at=Value(now.timestamp()),
+        )
+    SpamListChange.objects.bulk_create([SpamListChange(phone_key=key) for key in counts])
+    for bucket, deltas in buckets.items():
+        keys = list(deltas)
+        for start in range(0, len(keys), UPDATE_BATCH_SIZE):
+            batch = keys[start:start + UPDATE_BATCH_SIZE]
+            PhoneSpamBucket.objects.filter(bucket=bucket, phone_key__in=batch).update(
+                report_count=F('report_count') + _per_key(deltas, batch),
+            )
+
+def record_reports(reports, phone_numbers=None):
+    """
+    Count newly inserted reports, given as (phone_key, timestamp) pairs, in the per-number
+    stats, their buckets and the global report total.
+
+    `phone_numbers` optionally maps keys to the number as reported, used as the display form
+    of numbers seen for the first time. Must run inside the transaction that inserted the
+    reports. The global row is touched first so every writer takes its locks in the same
+    order as `rebuild()` and `compact_windows()`.
+    """
+    _adjust_reports(reports, 1, phone_numbers)
+
+def release_reports(reports):
+    """Take deleted reports, given as (phone_key, timestamp) pairs, back out of the statistics."""
+    _adjust_reports(reports, -1)
+
+def compact_windows(now=None):
+    """
+    Roll buckets that have aged out of each window off its counts, then delete buckets older
+    than every window. Between runs a window count may still include reports up to one
+    compaction interval older than the window, so run it every few minutes.
+    """
+    now = now or timezone.now()
+    current = bucket_of(now)
+    rolled_out = {}
+    with transaction.atomic():
+        # Report writers update this row first, so holding it keeps them out until we commit.
+        list(GlobalCounter.objects.select_for_update().filter(name=GlobalCounter.SPAM_REPORTS))
+        rolled = window_watermarks()
+        for column, window in WINDOWS.items():
+            horizon = current - window_buckets(window)
+            rolled_out[column] = 0
+            if horizon <= rolled[column]:
+                continue
+            expired = dict(
+                PhoneSpamBucket.objects.filter(bucket__gt=rolled[column], bucket__lte=horizon)
+                .values('phone_key')
+                .annotate(reports=Sum('report_count'))
+                .order_by()
+                .values_list('phone_key', 'reports')
+            )
+            keys = [key for key, reports in expired.items() if reports]
+            for start in range(0, len(keys), UPDATE_BATCH_SIZE):
+                batch = keys[start:start + UPDATE_BATCH_SIZE]
+                PhoneSpamStat.objects.filter(phone_key__in=batch).update(**{column: F(column) - _per_key(expired, batch)})
+            set_counter(watermark_name(column), horizon)
+            rolled[column] = horizon
+            rolled_out[column] = sum(expired.values())
+        pruned, _ = PhoneSpamBucket.objects.filter(bucket__lte=min(rolled.values())).delete()
+    return {'rolled_out': rolled_out, 'pruned_buckets': pruned}
+
+def rebuild(batch_size=1000):
+    """Recompute every maintained statistic from the source tables."""
+    with transaction.atomic():
+        for name in (GlobalCounter.SPAM_REPORTS, GlobalCounter.USERS):
+            GlobalCounter.objects.get_or_create(name=name)
+        # Locking the global rows blocks concurrent report writers until the rebuild commits.
+        list(GlobalCounter.objects.select_for_update().all())
+
+        PhoneSpamStat.objects.all().delete()
+        PhoneSpamBucket.objects.all().delete()
+        now = timezone.now()
+        current = bucket_of(now)
+        horizons = {column: current - window_buckets(window) for column, window in WINDOWS.items()}
+        oldest = min(horizons.values())
+        rows = (
+            SpamReport.objects.exclude(phone_key=None)
+            .order_by('phone_key')
+            .values_list('phone_key', 'phone_number', 'timestamp')
+        )
+        stats, buckets = [], []
+        numbers = 0
+        for key, reports in groupby(rows.iterator(chunk_size=batch_size), key=lambda row: row[0]):
+            stat = PhoneSpamStat(phone_key=key, score_updated_at=now.timestamp())
+            counts = defaultdict(int)
+            for _, phone_number, timestamp in reports:
+                stat.report_count += 1
+                stat.phone_number = min(stat.phone_number or phone_number, phone_number)
+                stat.decayed_score += decay(1.0, now.timestamp() - timestamp.timestamp())
+                bucket = bucket_of(timestamp)
+                for column, horizon in horizons.items():
+                    if bucket > horizon:
+                        setattr(stat, column, getattr(stat, column) + 1)
+                if bucket > oldest:
+                    counts[bucket] += 1
+            stats.append(stat)
+            buckets += [PhoneSpamBucket(phone_key=key, bucket=bucket, report_count=n) for bucket, n in counts.items()]
+            if len(stats) >= batch_size:
+                PhoneSpamStat.objects.bulk_create(stats)
+                numbers += len(stats)
+                stats = []
+            if len(buckets) >= batch_size:
+                PhoneSpamBucket.objects.bulk_create(buckets)
+                buckets = []
+        PhoneSpamStat.objects.bulk_create(stats)
+        PhoneSpamBucket.objects.bulk_create(buckets)
+        numbers += len(stats)
+        for column, horizon in horizons.items():
+            set_counter(watermark_name(column), horizon)
+        # Counts may have changed without a logged change, so no older spam list version is valid.
+        set_counter(GlobalCounter.SPAM_LIST_HORIZON, SpamListChange.objects.create().pk)
+
+        reports = SpamReport.objects.count()
+        users = User.objects.count()
+        GlobalCounter.objects.filter(name=GlobalCounter.SPAM_REPORTS).update(value=reports)
+        GlobalCounter.objects.filter(name=GlobalCounter.USERS).update(value=users)
+    return {'phone_numbers': numbers, 'spam_reports': reports, 'users': users}
@@ -1,3 +1,1284 @@
-from django.test import TestCase
+import importlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from io import StringIO
+from pathlib import Path
+from unittest import SkipTest, mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connection, connections, transaction
+from django.db.models import Count
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.exceptions import ValidationError
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from . import async_urls, benchmark, directory, renderers, stats, urls
+from .authentication import CachedTokenAuthentication
+from .bloom import BloomFilter, spam_filter
+from .datagen import populate
+from .fast_serializers import ContactRowSerializer, SearchResultRowSerializer, SpamNumberRowSerializer
+from .metrics import metrics, read_snapshots as read_metric_snapshots
+from .models import (
+    Contact,
+    GlobalCounter,
+    PhoneDirectory,
+    PhoneDirectoryName,
+    PhoneSpamBucket,
+    PhoneSpamStat,
+    SpamReport,
+    User,
+    UserVersion,
+)
+from .phone import phone_key
+from .profiling import profiler
+from .report_queue import report_queue
+from .search_index import log_bulk_load, name_index
+from .renderers import FastJSONRenderer
+from .reports import file_report_batch, file_reports, withdraw_report
+from .serializers import ContactSerializer, RegistrationSerializer
+from .snapshot import SpamSnapshot, export_snapshot
+from .spam_cache import spam_cache
+
+
+class PhoneKeyTests(TestCase):
+    def test_spellings_of_one_number_register_once(self):
+        User.objects.create_user(username='first', phone_number='+919876543210', password='pw')
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            User.objects.create_user(username='second', phone_number='09876543210', password='pw')
+        response = APIClient().post('/api/login/', {'phone_number': '98765 43210', 'password': 'pw'})
+        self.assertEqual(response.status_code, 200)
+
+    def test_deactivated_duplicates_keep_their_cleared_key(self):
+        User.objects.create_user(username='kept', phone_number='+919876543210', password='pw')
+        duplicate = User.objects.create_user(username='duplicate', phone_number='9000000000', password='pw')
+        # As left by migration 0011.
+        User.objects.filter(pk=duplicate.pk).update(phone_number='09876543210', phone_key=None, is_active=False)
+        duplicate.refresh_from_db()
+        duplicate.set_password('reset')
+        duplicate.save()
+        duplicate.refresh_from_db()
+        self.assertIsNone(duplicate.phone_key)
+
+        duplicate.phone_number = '9000000001'
+        duplicate.is_active = True
+        duplicate.save()
+        self.assertEqual(duplicate.phone_key, 919000000001)
+
+    def test_unparsable_natural_key_matches_no_user(self):
+        User.objects.create_user(username='keyless', phone_number='+919876543210', password='pw')
+        User.objects.filter(username='keyless').update(phone_key=None)
+        with self.assertRaises(User.DoesNotExist):
+            User.objects.get_by_natural_key('not a number')
+        response = APIClient().post('/api/login/', {'phone_number': 'not a number', 'password': 'pw'})
+        self.assertEqual(response.status_code, 401)
+
+    def test_concurrent_registration_is_a_validation_error(self):
+        data = {'username': 'late', 'phone_number': '09876543210', 'email': '', 'password': 'x7!kQp2#vW', 'password2': 'x7!kQp2#vW'}
+        serializer = RegistrationSerializer(data=data)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        # Another request registers the number between validation and save.
+        User.objects.create_user(username='early', phone_number='+919876543210', password='pw')
+        with self.assertRaises(ValidationError) as raised:
+            serializer.save()
+        self.assertIn('phone_number', raised.exception.detail)
+
+    def test_backfill_normaliser_matches_phone_key(self):
+        backfill = importlib.import_module('core.migrations.0005_backfill_phone_keys')
+        for raw in ('+91 98765 43210', '098765-43210', '9876543210', '0091 9876543210', '+1 (415) 555-0100', '', 'x', '0' * 20):
+            self.assertEqual(backfill.phone_key(raw), phone_key(raw), raw)
+
+class SpamCounterTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'counter{i}', phone_number=f'900000000{i}') for i in range(4)]
+        self.client = APIClient()
+
+    def assertCountersMatchRecount(self):
+        self.assertEqual(stats.total_users(), User.objects.count())
+        self.assertEqual(stats.total_reports(), SpamReport.objects.count())
+        recount = dict(SpamReport.objects.values('phone_key').annotate(n=Count('pk')).values_list('phone_key', 'n'))
+        maintained = dict(PhoneSpamStat.objects.exclude(report_count=0).values_list('phone_key', 'report_count'))
+        self.assertEqual(maintained, recount)
+
+    def test_counters_follow_creates_and_deletes(self):
+        self.assertCountersMatchRecount()
+        self.client.force_authenticate(self.users[0])
+        self.assertEqual(self.client.post('/api/spam/create/', {'phone_number': '8000000001'}).status_code, 201)
+        self.assertEqual(self.client.post('/api/spam/create/', {'phone_number': '+91 80000 00001'}).status_code, 200)
+        for user in self.users[1:]:
+            file_reports(user, ['8000000001', '8000000002'])
+        self.assertCountersMatchRecount()
+        self.assertEqual(stats.report_count(phone_key('8000000001')), 4)
+
+        self.assertEqual(self.client.delete('/api/spam/8000000001/delete/').status_code, 200)
+        self.assertCountersMatchRecount()
+        # Deleting a user cascades to their reports.
+        self.users[1].delete()
+        self.assertCountersMatchRecount()
+        self.assertEqual(stats.report_count(phone_key('8000000002')), 2)
+        User.objects.filter(pk=self.users[2].pk).delete()
+        self.assertCountersMatchRecount()
+
+    def test_rebuild_command_repairs_drift(self):
+        for user in self.users:
+            file_reports(user, ['8000000001'])
+        stats.set_counter(GlobalCounter.SPAM_REPORTS, 999)
+        stats.set_counter(GlobalCounter.USERS, 0)
+        PhoneSpamStat.objects.update(report_count=50)
+        PhoneSpamStat.objects.create(phone_key=phone_key('8000000009'), phone_number='+918000000009', report_count=3)
+        call_command('rebuild_spam_stats', stdout=StringIO())
+        self.assertCountersMatchRecount()
+        self.assertFalse(PhoneSpamStat.objects.filter(phone_key=phone_key('8000000009')).exists())
+
+
+class SearchQueryCountTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='searcher', phone_number='9000000000', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def grow(self, start, count):
+        for i in range(start, start + count):
+            user = User.objects.create_user(username=f'anna{i}', phone_number=f'91{i:08d}')
+            Contact.objects.create(user=user, name=f'Annabel {i}', phone_number=f'80{i:08d}')
+            Contact.objects.create(user=user, name='Hotline', phone_number='1800000000')
+            file_reports(user, [f'80{i:08d}'])
+
+    def count_queries(self, path, params):
+        spam_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(path, params)
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()['results']
+
+    def test_name_search_query_count_is_constant(self):
+        self.grow(0, 2)
+        small, small_results = self.count_queries('/api/search/name/', {'q': 'ann'})
+        self.grow(2, 30)
+        large, large_results = self.count_queries('/api/search/name/', {'q': 'ann'})
+        self.assertEqual(small, large)
+        self.assertEqual(len(small_results), 4)
+        self.assertEqual(len(large_results), 64)
+
+    def test_phone_search_query_count_is_constant(self):
+        self.grow(0, 2)
+        small, small_results = self.count_queries('/api/search/phone/', {'q': '1800000000'})
+        self.grow(2, 30)
+        large, large_results = self.count_queries('/api/search/phone/', {'q': '1800000000'})
+        self.assertEqual(small, large)
+        self.assertEqual(small_results, large_results)
+        self.assertEqual(large_results, [{'name': 'Hotline', 'phone_number': '1800000000', 'spam_likelihood': 0.0}])
+
+    def test_name_search_orders_users_before_contacts(self):
+        self.grow(0, 2)
+        User.objects.create_user(username='joanna', phone_number='9100009999')
+        results = self.client.get('/api/search/name/', {'q': 'anna'}).json()['results']
+        names = [result['name'] for result in results]
+        self.assertEqual(names, ['anna0', 'anna1', 'joanna', 'Annabel 0', 'Annabel 1'])
+        self.assertEqual(results[3]['spam_likelihood'], 50.0)
+
+    def test_name_search_is_capped(self):
+        self.grow(0, 3)
+        with self.settings(SEARCH_RESULT_LIMIT=4):
+            results = self.client.get('/api/search/name/', {'q': 'ann', 'page_size': 50}).json()['results']
+        self.assertEqual([result['name'] for result in results], ['anna0', 'anna1', 'anna2', 'Annabel 0'])
+
+
+class SpamBatchReportTests(TestCase):
+    def setUp(self):
+        self.users = [User.objects.create_user(username=f'batcher{i}', phone_number=f'900000000{i}') for i in range(2)]
+        self.client = APIClient()
+        self.client.force_authenticate(self.users[0])
+
+    def counts(self):
+        return (
+            stats.total_reports(),
+            dict(PhoneSpamStat.objects.values_list('phone_number', 'report_count')),
+            SpamReport.objects.count(),
+        )
+
+    def test_only_inserted_reports_move_the_counters(self):
+        batch = ['8000000001', '+91 80000 00001', '8000000002']
+        response = self.client.post('/api/spam/batch/', {'phone_numbers': batch}, format='json')
+        self.assertEqual(response.status_code, 200)
+        # Two spellings of one number are one report.
+        self.assertEqual(response.json(), {'created': 2, 'results': [
+            {'phone_number': '8000000001', 'status': 'created'},
+            {'phone_number': '8000000002', 'status': 'created'},
+        ]})
+        self.assertEqual(self.counts(), (2, {'8000000001': 1, '8000000002': 1}, 2))
+
+        # A retry, in other spellings, plus one new number.
+        response = self.client.post('/api/spam/batch/', {'phone_numbers': ['+918000000002', '08000000001', '8000000003']}, format='json')
+        self.assertEqual(response.json(), {'created': 1, 'results': [
+            {'phone_number': '+918000000002', 'status': 'already_reported'},
+            {'phone_number': '08000000001', 'status': 'already_reported'},
+            {'phone_number': '8000000003', 'status': 'created'},
+        ]})
+        self.assertEqual(self.counts(), (3, {'8000000001': 1, '8000000002': 1, '8000000003': 1}, 3))
+        self.assertEqual(stats.counter_value(GlobalCounter.SPAM_REPORTS), SpamReport.objects.count())
+
+    def test_batches_across_reporters(self):
+        file_reports(self.users[0], ['8000000001'])
+        created = file_report_batch([
+            (self.users[0].pk, '+918000000001'),
+            (self.users[1].pk, '8000000001'),
+            (self.users[1].pk, '08000000001'),
+            (self.users[1].pk, '8000000002'),
+        ])
+        self.assertEqual(created, {(phone_key('8000000001'), self.users[1].pk), (phone_key('8000000002'), self.users[1].pk)})
+        self.assertEqual(self.counts(), (3, {'8000000001': 2, '8000000002': 1}, 3))
+
+    def test_invalid_numbers_reject_the_batch(self):
+        response = self.client.post('/api/spam/batch/', {'phone_numbers': ['8000000001', 'not a number']}, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.counts(), (0, {}, 0))
+
+
+class ContactSyncTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='syncer', phone_number='9000000000')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def sync(self, contacts, **options):
+        response = self.client.post('/api/contacts/sync/', {'contacts': contacts, **options}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def contacts(self):
+        return dict(Contact.objects.filter(user=self.user).values_list('phone_number', 'name'))
+
+    def test_inserts_renames_and_deletes(self):
+        for name, phone_number in [('Old', '8000000000'), ('Keep', '8000000001'), ('Gone', '8000000002')]:
+            Contact.objects.create(user=self.user, name=name, phone_number=phone_number)
+        summary = self.sync([
+            {'name': 'New', 'phone_number': '8000000000'},
+            {'name': 'Keep', 'phone_number': '8000000001'},
+            {'name': 'First', 'phone_number': '8000000003'},
+            # A repeated number keeps its last entry.
+            {'name': 'Second', 'phone_number': '8000000003'},
+        ])
+        self.assertEqual(summary, {'created': 1, 'updated': 1, 'deleted': 1, 'unchanged': 1})
+        self.assertEqual(self.contacts(), {'8000000000': 'New', '8000000001': 'Keep', '8000000003': 'Second'})
+
+        summary = self.sync([{'name': 'Extra', 'phone_number': '8000000004'}], delete_missing=False)
+        self.assertEqual(summary, {'created': 1, 'updated': 0, 'deleted': 0, 'unchanged': 0})
+        self.assertEqual(len(self.contacts()), 4)
+        self.assertEqual(self.sync([])['deleted'], 4)
+        self.assertEqual(self.contacts(), {})
+
+    def test_spellings_of_one_number_are_one_contact(self):
+        Contact.objects.create(user=self.user, name='Kim', phone_number='+91 80000 00000')
+        response = self.client.post('/api/contacts/create/', {'name': 'Kim', 'phone_number': '08000000000'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('phone_number', response.json())
+
+        summary = self.sync([{'name': 'Kim', 'phone_number': '8000000000'}, {'name': 'Lee', 'phone_number': '+918000000001'}])
+        self.assertEqual(summary, {'created': 1, 'updated': 1, 'deleted': 0, 'unchanged': 0})
+        self.assertEqual(self.contacts(), {'8000000000': 'Kim', '+918000000001': 'Lee'})
+        self.assertEqual(self.sync([{'name': 'Lee', 'phone_number': '08000000001'}], delete_missing=False)['updated'], 1)
+        entry = PhoneDirectory.objects.get(phone_key=918000000001)
+        self.assertEqual((entry.contact_count, entry.names), (1, [['Lee', 1]]))
+
+    def test_large_address_books_take_a_few_queries_per_batch(self):
+        book = [{'name': f'Friend {i}', 'phone_number': f'80{i:08d}'} for i in range(5000)]
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.sync(book)['created'], 5000)
+        # Contacts and directory rows are written a few hundred at a time, never one by one.
+        self.assertLess(len(queries), 125)
+
+        book = [{'name': f'Pal {i}' if i % 2 else f'Friend {i}', 'phone_number': f'80{i:08d}'} for i in range(1000, 6000)]
+        with CaptureQueriesContext(connection) as queries:
+            summary = self.sync(book)
+        self.assertEqual(summary, {'created': 1000, 'updated': 2000, 'deleted': 1000, 'unchanged': 2000})
+        self.assertLess(len(queries), 125)
+        self.assertEqual(self.contacts(), {entry['phone_number']: entry['name'] for entry in book})
+        with self.assertNumQueries(4):
+            self.assertEqual(self.sync(book)['unchanged'], 5000)
+
+
+class NameIndexTests(TestCase):
+    def setUp(self):
+        name_index.reset()
+        self.addCleanup(name_index.reset)
+        self.user = User.objects.create_user(username='Searcher', phone_number='9000000000')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        for i, name in enumerate(['Anna', 'Joanna', 'Annabel', 'Hannah', 'Dan']):
+            User.objects.create_user(username=name, phone_number=f'91{i:08d}')
+        for i, name in enumerate(['Anna', 'Banana', 'Annie', 'Anna', 'Nan', 'Zoe']):
+            Contact.objects.create(user=self.user, name=name, phone_number=f'80{i:08d}')
+        # Shares its number with the user Anna, so it is left out whenever she matches.
+        Contact.objects.create(user=self.user, name='Anna at work', phone_number='9100000000')
+
+    def search(self, query):
+        """All results for `query`, checking that two-result pages add up to the unpaged answer."""
+        unpaged = self.client.get('/api/search/name/', {'q': query}).json()
+        results, url, params = [], '/api/search/name/', {'q': query, 'page_size': 2}
+        while url:
+            body = self.client.get(url, params).json()
+            results += body['results']
+            url, params = body['next'], None
+        self.assertEqual(results, unpaged['results'])
+        return results
+
+    def test_index_answers_like_the_orm(self):
+        queries = ['ann', 'an', 'a', 'NNA', 'zo', 'at w', 'x']
+        expected = {query: self.search(query) for query in queries}
+        self.assertEqual(
+            [result['name'] for result in expected['ann']],
+            ['Anna', 'Annabel', 'Hannah', 'Joanna', 'Anna', 'Anna', 'Annie'],
+        )
+        with override_settings(NAME_SEARCH_INDEX_ENABLED=True):
+            name_index.build()
+            self.assertIsNotNone(name_index.search('ann', 10))
+            for query in queries:
+                self.assertEqual(self.search(query), expected[query], query)
+
+    @override_settings(NAME_SEARCH_INDEX_ENABLED=True)
+    def test_writes_reach_the_index(self):
+        name_index.build()
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create_user(username='Annika', phone_number='9200000000')
+            User.objects.get(username='Hannah').delete()
+            contact = Contact.objects.get(name='Zoe')
+            contact.name = 'Zoanna'
+            contact.save()
+            Contact.objects.filter(name='Annie').delete()
+            sync = [{'name': 'Annette', 'phone_number': '7000000000'}, {'name': 'Nanny', 'phone_number': '8000000004'}]
+            self.client.post('/api/contacts/sync/', {'contacts': sync, 'delete_missing': False}, format='json')
+        indexed = self.search('ann')
+        with override_settings(NAME_SEARCH_INDEX_ENABLED=False):
+            self.assertEqual(indexed, self.search('ann'))
+        self.assertEqual(
+            [result['name'] for result in indexed],
+            ['Anna', 'Annabel', 'Annika', 'Joanna', 'Anna', 'Anna', 'Annette', 'Nanny', 'Zoanna'],
+        )
+
+    @override_settings(NAME_SEARCH_INDEX_ENABLED=True)
+    def test_orm_answers_until_built_and_the_change_log_brings_in_other_writers(self):
+        with override_settings(NAME_SEARCH_INDEX_ENABLED=False):
+            expected = self.search('ann')
+        with mock.patch.object(name_index, 'warm') as warm:
+            self.assertEqual(self.search('ann'), expected)
+        warm.assert_called()
+        self.assertFalse(name_index.ready)
+
+        leaving = User.objects.create_user(username='Leaver', phone_number='9300000000')
+        Contact.objects.create(user=leaving, name='Annalise', phone_number='7100000000')
+        name_index.build()
+        # Outside captureOnCommitCallbacks the signals never update the index, as with writes
+        # made by another process; only the change log brings them in.
+        User.objects.create_user(username='Annika', phone_number='9200000000')
+        Contact.objects.filter(name='Annie').delete()
+        leaving.delete()
+        sync = [{'name': 'Annette', 'phone_number': '7000000000'}]
+        self.client.post('/api/contacts/sync/', {'contacts': sync, 'delete_missing': False}, format='json')
+        self.assertNotIn('Annika', [result['name'] for result in self.search('ann')])
+
+        self.assertTrue(name_index.catch_up())
+        indexed = self.search('ann')
+        with override_settings(NAME_SEARCH_INDEX_ENABLED=False):
+            self.assertEqual(indexed, self.search('ann'))
+        self.assertEqual(
+            [result['name'] for result in indexed],
+            ['Anna', 'Annabel', 'Annika', 'Hannah', 'Joanna', 'Anna', 'Anna', 'Annette'],
+        )
+        # A bulk load bypasses the log, so the index has to be loaded in full instead.
+        log_bulk_load()
+        self.assertFalse(name_index.catch_up())
+
+    def test_index_and_orm_pages_continue_each_other(self):
+        for i, name in enumerate(['anne', 'ANNA B', 'Anna_c', 'annA']):
+            Contact.objects.create(user=self.user, name=name, phone_number=f'81{i:08d}')
+        expected = self.search('ann')
+        with override_settings(NAME_SEARCH_INDEX_ENABLED=True):
+            name_index.build()
+            self.assertEqual(self.search('ann'), expected)
+        for first, rest in ((True, False), (False, True)):
+            with override_settings(NAME_SEARCH_INDEX_ENABLED=first):
+                body = self.client.get('/api/search/name/', {'q': 'ann', 'page_size': 7}).json()
+            with override_settings(NAME_SEARCH_INDEX_ENABLED=rest):
+                results = body['results'] + self.client.get(body['next']).json()['results']
+            self.assertEqual(results, expected)
+
+
+class PhoneDirectoryTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='caller', phone_number='9000000000')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def directory(self):
+        return (
+            sorted(PhoneDirectory.objects.values_list('phone_key', 'user_id', 'contact_count', 'names')),
+            sorted(PhoneDirectoryName.objects.values_list('phone_key', 'name', 'count')),
+        )
+
+    def test_is_maintained_incrementally(self):
+        owners = [User.objects.create_user(username=f'owner{i}', phone_number=f'91{i:08d}') for i in range(6)]
+        for i, owner in enumerate(owners):
+            Contact.objects.create(user=owner, name='Pizza' if i % 2 else 'Pizza Hut', phone_number='1800000000')
+        contact = Contact.objects.create(user=owners[0], name='Bob', phone_number='8000000000')
+        contact.name = 'Robert'
+        contact.save()
+        sync = [{'name': 'Pizza', 'phone_number': '+91 18000 00000'}, {'name': 'Owner', 'phone_number': '9100000001'}]
+        self.client.post('/api/contacts/sync/', {'contacts': sync}, format='json')
+        self.assertEqual(PhoneDirectory.objects.get(phone_key=phone_key('1800000000')).names, [['Pizza', 4], ['Pizza Hut', 3]])
+        self.client.post('/api/contacts/sync/', {'contacts': [{**sync[0], 'name': 'Pizza Express'}]}, format='json')
+        owners[1].delete()
+        owners[2].delete()
+
+        entry = PhoneDirectory.objects.get(phone_key=phone_key('1800000000'))
+        self.assertEqual((entry.contact_count, entry.names), (5, [['Pizza', 2], ['Pizza Hut', 2], ['Pizza Express', 1]]))
+        self.assertFalse(PhoneDirectory.objects.filter(phone_key=phone_key('9100000001')).exists())
+        self.assertEqual(PhoneDirectory.objects.get(phone_key=phone_key('8000000000')).names, [['Robert', 1]])
+
+        maintained = self.directory()
+        directory.rebuild()
+        self.assertEqual(self.directory(), maintained)
+
+    @override_settings(PHONE_DIRECTORY_NAMES=1)
+    def test_short_lists_refill_from_counts(self):
+        owners = [User.objects.create_user(username=f'owner{i}', phone_number=f'91{i:08d}') for i in range(5)]
+        for i, owner in enumerate(owners):
+            Contact.objects.create(user=owner, name='Pizza' if i < 3 else 'Pizza Hut', phone_number='1800000000')
+        entry = PhoneDirectory.objects.filter(phone_key=phone_key('1800000000'))
+        self.assertEqual(entry.get().names, [['Pizza', 3]])
+        owners[0].delete()
+        owners[1].delete()
+        self.assertEqual(entry.get().names, [['Pizza Hut', 2]])
+
+        maintained = self.directory()
+        directory.rebuild()
+        self.assertEqual(self.directory(), maintained)
+
+    @override_settings(PHONE_DIRECTORY_NAMES=2)
+    def test_phone_search_reads_one_row(self):
+        for i in range(20):
+            owner = User.objects.create_user(username=f'owner{i}', phone_number=f'91{i:08d}')
+            Contact.objects.create(user=owner, name=f'Name {i % 4}', phone_number='1800000000')
+        file_reports(self.user, ['1800000000'])
+        with self.assertNumQueries(2):
+            results = self.client.get('/api/search/phone/', {'q': '1800000000'}).json()['results']
+        self.assertEqual([result['name'] for result in results], ['Name 0', 'Name 1'])
+        self.assertEqual(results[0]['spam_likelihood'], 100.0)
+
+        results = self.client.get('/api/search/phone/', {'q': '9100000003'}).json()['results']
+        self.assertEqual([result['name'] for result in results], ['owner3'])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='pager', phone_number='9000000000', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def walk(self, path, params):
+        names = []
+        url = path
+        while url:
+            response = self.client.get(url, params)
+            self.assertEqual(response.status_code, 200)
+            body = response.json()
+            names.extend(body['results'])
+            url, params = body['next'], None
+        return names
+
+    def test_name_search_pages_cover_all_results_in_order(self):
+        for i in range(5):
+            User.objects.create_user(username=f'kim{i}', phone_number=f'91{i:08d}')
+            Contact.objects.create(user=self.user, name='Kim', phone_number=f'80{i:08d}')
+            Contact.objects.create(user=self.user, name=f'Old Kim {i}', phone_number=f'70{i:08d}')
+        unpaged = self.client.get('/api/search/name/', {'q': 'kim'}).json()
+        self.assertIsNone(unpaged['next'])
+        paged = self.walk('/api/search/name/', {'q': 'kim', 'page_size': 2})
+        self.assertEqual(paged, unpaged['results'])
+        self.assertEqual(len(paged), 15)
+
+    def test_phone_search_pages(self):
+        for i, name in enumerate(['Pizza', 'Dominos', 'Pizza Hut', 'Pizza', 'Anna', 'Pizza Hut', 'Pizza']):
+            owner = User.objects.create_user(username=f'owner{i}', phone_number=f'91{i:08d}')
+            Contact.objects.create(user=owner, name=name, phone_number='1800000000')
+        paged = self.walk('/api/search/phone/', {'q': '1800000000', 'page_size': 3})
+        self.assertEqual([result['name'] for result in paged], ['Pizza', 'Pizza Hut', 'Anna', 'Dominos'])
+        self.assertEqual(paged, self.client.get('/api/search/phone/', {'q': '1800000000'}).json()['results'])
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get('/api/search/name/', {'q': 'kim', 'cursor': 'garbage'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_spam_numbers_are_paged_and_streamed(self):
+        file_reports(self.user, [f'80{i:08d}' for i in range(7)])
+        paged = self.walk('/api/spam/', {'page_size': 3})
+        self.assertEqual(paged, [{'phone_number': f'80{i:08d}'} for i in range(7)])
+
+        response = self.client.get('/api/spam/', {'stream': '1'})
+        self.assertTrue(response.streaming)
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), paged)
+
+    def test_contacts_are_paged_and_streamed(self):
+        for i in range(4):
+            Contact.objects.create(user=self.user, name=f'Friend {i}', phone_number=f'80{i:08d}')
+        paged = self.walk('/api/contacts/', {'page_size': 3})
+        self.assertEqual([contact['name'] for contact in paged], [f'Friend {i}' for i in range(4)])
+
+        response = self.client.get('/api/contacts/', {'stream': 'true'})
+        self.assertEqual(json.loads(b''.join(response.streaming_content)), paged)
+
+
+class SpamLookupCacheTests(TestCase):
+    def setUp(self):
+        spam_cache.clear()
+        self.user = User.objects.create_user(username='caller', phone_number='9000000000', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_lookups_are_served_from_cache_until_a_report_changes(self):
+        self.assertEqual(self.client.get('/api/spam/9876543210/').json()['report_count'], 0)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/spam/+919876543210/').json()['report_count'], 0)
+
+        self.client.post('/api/spam/create/', {'phone_number': '09876543210'})
+        self.assertEqual(self.client.get('/api/spam/9876543210/').json()['report_count'], 1)
+
+        self.client.delete('/api/spam/9876543210/delete/')
+        self.assertEqual(self.client.get('/api/spam/9876543210/').json()['report_count'], 0)
+
+    def test_statistics_rebuilt_elsewhere_clear_the_cache(self):
+        spam_cache.check_generation()
+        self.client.post('/api/spam/create/', {'phone_number': '09876543210'})
+        PhoneSpamStat.objects.filter(phone_key=919876543210).update(report_count=5)
+        spam_cache.clear()
+        self.assertEqual(self.client.get('/api/spam/9876543210/').json()['report_count'], 5)
+        # As `rebuild_spam_stats` run in another process would, minus its cache clear.
+        stats.rebuild()
+        self.assertEqual(self.client.get('/api/spam/9876543210/').json()['report_count'], 5)
+        spam_cache.check_generation()
+        self.assertEqual(self.client.get('/api/spam/9876543210/').json()['report_count'], 1)
+
+
+@override_settings(SPAM_FILTER_ENABLED=True, SPAM_FILTER_MIN_CAPACITY=1000)
+class SpamFilterTests(TestCase):
+    def setUp(self):
+        spam_cache.clear()
+        spam_filter.reset()
+        self.addCleanup(spam_filter.reset)
+        self.user = User.objects.create_user(username='caller', phone_number='9000000000', password='secret')
+        self.reporter = User.objects.create_user(username='reporter', phone_number='9000000001', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_bloom_filter_has_no_false_negatives(self):
+        bloom = BloomFilter(1000, 0.01)
+        keys = range(918000000000, 918000001000)
+        for key in keys:
+            bloom.add(key)
+        self.assertTrue(all(key in bloom for key in keys))
+        false_positives = sum(key in bloom for key in range(919000000000, 919000010000))
+        self.assertLess(false_positives, 300)
+
+    def test_definite_miss_skips_the_database(self):
+        file_reports(self.reporter, ['8000000001'])
+        spam_filter.build()
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/spam/8000000002/')
+        self.assertEqual(response.json(), {'phone_number': '8000000002', 'is_spam': False, 'report_count': 0})
+        self.assertEqual(self.client.get('/api/spam/8000000001/').json()['report_count'], 1)
+        self.assertEqual(spam_filter.definite_misses, 1)
+
+    def test_reports_filed_elsewhere_are_caught_up_before_a_miss_is_trusted(self):
+        spam_filter.build()
+        # Outside captureOnCommitCallbacks this process's filter never hears of the report,
+        # as if another process had filed it.
+        file_reports(self.reporter, ['8000000001'])
+        self.assertNotIn(918000000001, spam_filter.filter)
+        with override_settings(SPAM_FILTER_POLL_SECONDS=0):
+            response = self.client.get('/api/spam/8000000001/')
+        self.assertEqual(response.json()['report_count'], 1)
+        self.assertIn(918000000001, spam_filter.filter)
+        with self.assertNumQueries(0):
+            self.assertFalse(spam_filter.might_contain(918000000002))
+
+    def test_statistics_rebuild_drops_the_filter(self):
+        spam_filter.build()
+        stats.rebuild()
+        with override_settings(SPAM_FILTER_POLL_SECONDS=0), mock.patch.object(spam_filter, 'warm') as warm:
+            self.assertTrue(spam_filter.might_contain(918000000002))
+        warm.assert_called_once()
+        self.assertFalse(spam_filter.ready)
+
+    def test_rebuild_drops_withdrawn_reports(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            file_reports(self.reporter, ['8000000001'])
+        spam_filter.build()
+        self.assertIn(918000000001, spam_filter.filter)
+        withdraw_report(SpamReport.objects.get(reported_by=self.reporter))
+        spam_filter.build()
+        self.assertNotIn(918000000001, spam_filter.filter)
+        self.assertFalse(spam_filter.might_contain(918000000001))
+
+    def test_stats_endpoint(self):
+        self.assertEqual(self.client.get('/api/spam/filter-stats/').status_code, 403)
+        file_reports(self.reporter, ['8000000001'])
+        spam_filter.build()
+        self.client.get('/api/spam/8000000001/')
+        self.client.get('/api/spam/8000000002/')
+        admin = User.objects.create_superuser(username='admin', phone_number='9000000002', password='secret')
+        self.client.force_authenticate(admin)
+        body = self.client.get('/api/spam/filter-stats/').json()
+        self.assertTrue(body['ready'])
+        self.assertEqual(body['numbers'], 1)
+        self.assertEqual((body['lookups'], body['definite_misses'], body['passed_to_database']), (2, 1, 1))
+        self.assertEqual(body['miss_rate'], 0.5)
+
+
+class PhoneLookupBatchTests(TestCase):
+    def setUp(self):
+        spam_cache.clear()
+        self.user = User.objects.create_user(username='caller', phone_number='9000000000', password='secret')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def lookup(self, phone_numbers):
+        spam_cache.clear()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/search/phone/batch/', {'phone_numbers': phone_numbers}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()['results']
+
+    def test_names_and_counts_for_every_number_in_constant_queries(self):
+        Contact.objects.create(user=self.user, name='Zed', phone_number='9000000000')
+        Contact.objects.create(user=self.user, name='Pizza Place', phone_number='8000000001')
+        other = User.objects.create_user(username='other', phone_number='9000000002')
+        Contact.objects.create(user=other, name='Best Pizza', phone_number='+91 80000 00001')
+        file_reports(other, ['8000000001'])
+
+        small, results = self.lookup(['09000000000', '8000000001', '7000000000'])
+        self.assertEqual([result['name'] for result in results], ['caller', 'Best Pizza', None])
+        self.assertEqual([result['report_count'] for result in results], [0, 1, 0])
+        self.assertEqual(results[1]['spam_likelihood'], 100)
+
+        large, results = self.lookup([f'70{i:08d}' for i in range(500)] + ['8000000001'])
+        self.assertEqual(small, large)
+        self.assertEqual(len(results), 501)
+
+    def test_invalid_numbers_are_rejected(self):
+        response = self.client.post('/api/search/phone/batch/', {'phone_numbers': ['abc']}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+
+class UserDetailBatchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='viewer', phone_number='9000000000')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.users = [
+            User.objects.create_user(username=f'user{i}', phone_number=f'91{i:08d}', email=f'{i}@example.com') for i in range(3)
+        ]
+        Contact.objects.create(user=self.user, name='Saved', phone_number='+91 91000 00001')
+        file_reports(self.user, ['9100000002'])
+
+    def details(self, ids):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/users/batch/', {'ids': ids}, format='json')
+        self.assertEqual(response.status_code, 200)
+        return len(queries), response.json()['results']
+
+    def test_details_in_order_in_constant_queries(self):
+        pks = [user.pk for user in self.users]
+        small, results = self.details([pks[2], pks[1], 999999])
+        self.assertEqual([result['username'] for result in results[:2]], ['user2', 'user1'])
+        self.assertIsNone(results[2])
+        self.assertNotIn('email', results[0])
+        self.assertEqual(results[1]['email'], '1@example.com')
+        self.assertEqual((results[0]['spam_likelihood'], results[1]['spam_likelihood']), (100.0, 0.0))
+
+        large, results = self.details(pks * 100)
+        self.assertEqual(small, large)
+        self.assertEqual(len(results), 300)
+
+    def test_single_user_matches_batch(self):
+        for user in self.users:
+            _, (batched,) = self.details([user.pk])
+            self.assertEqual(self.client.get(f'/api/users/{user.pk}/').json(), batched)
+        self.assertEqual(self.client.get('/api/users/999999/').status_code, 404)
+
+
+class SpamWindowTests(TestCase):
+    def setUp(self):
+        self.reporters = [User.objects.create_user(username=f'reporter{i}', phone_number=f'900000000{i}') for i in range(3)]
+        self.key = phone_key('8000000001')
+
+    def test_windows_roll_off_and_scores_decay(self):
+        for reporter in self.reporters:
+            file_reports(reporter, ['8000000001'])
+        now = timezone.now()
+        scores = stats.spam_scores(self.key)
+        self.assertEqual([scores[column] for column in ('report_count', *stats.WINDOWS)], [3, 3, 3, 3])
+        self.assertAlmostEqual(stats.spam_scores(self.key, now + timedelta(seconds=settings.SPAM_SCORE_HALF_LIFE))['decayed_score'], 1.5, places=3)
+
+        stats.compact_windows(now + timedelta(hours=2))
+        scores = stats.spam_scores(self.key)
+        self.assertEqual([scores[column] for column in ('report_count', *stats.WINDOWS)], [3, 0, 3, 3])
+
+        # A withdrawn report leaves only the windows it still counted in.
+        withdraw_report(SpamReport.objects.get(reported_by=self.reporters[0]))
+        scores = stats.spam_scores(self.key)
+        self.assertEqual([scores[column] for column in ('report_count', *stats.WINDOWS)], [2, 0, 2, 2])
+        self.assertAlmostEqual(scores['decayed_score'], 2, places=3)
+
+        stats.compact_windows(now + timedelta(days=31))
+        self.assertEqual(stats.spam_scores(self.key)['reports_30d'], 0)
+        self.assertFalse(PhoneSpamBucket.objects.exists())
+
+    def test_rebuild_matches_incremental_counts(self):
+        for i, reporter in enumerate(self.reporters):
+            file_reports(reporter, [f'800000000{n}' for n in range(i + 1)])
+        self.reporters[2].delete()
+        keys = [phone_key(f'800000000{n}') for n in range(3)]
+        maintained = [stats.spam_scores(key) for key in keys]
+        stats.rebuild()
+        for before, after in zip(maintained, [stats.spam_scores(key) for key in keys]):
+            self.assertAlmostEqual(before.pop('decayed_score'), after.pop('decayed_score'), places=3)
+            self.assertEqual(before, after)
+
+    def test_likelihood_endpoint(self):
+        file_reports(self.reporters[0], ['8000000001'])
+        client = APIClient()
+        client.force_authenticate(self.reporters[1])
+        with self.assertNumQueries(2):
+            data = client.get('/api/spam/+918000000001/likelihood/').json()
+        self.assertEqual(data['report_count'], 1)
+        self.assertEqual(data['reports_1h'], 1)
+        self.assertEqual(data['spam_likelihood'], '33.33%')
+
+
+@override_settings(SPAM_REPORT_QUEUE_ENABLED=True)
+class SpamReportQueueTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(report_queue, 'start')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(report_queue.flush)
+        self.users = [User.objects.create_user(username=f'reporter{i}', phone_number=f'900000000{i}') for i in range(3)]
+        self.clients = []
+        for user in self.users:
+            client = APIClient()
+            client.force_authenticate(user)
+            self.clients.append(client)
+
+    def test_reports_are_acknowledged_then_written_in_one_batch(self):
+        for client in self.clients:
+            for number in ('8000000001', '+91 80000 00001', '8000000002'):
+                response = client.post('/api/spam/create/', {'phone_number': number})
+                self.assertEqual(response.status_code, 202)
+                self.assertEqual(response.json()['status'], 'queued')
+        self.assertFalse(SpamReport.objects.exists())
+
+        written = report_queue.stats()['written']
+        report_queue.flush()
+        self.assertEqual(SpamReport.objects.count(), 6)
+        self.assertEqual(stats.report_count(phone_key('8000000001')), 3)
+        self.assertEqual(stats.total_reports(), 6)
+        self.assertEqual(report_queue.stats()['written'] - written, 6)
+        self.assertEqual(report_queue.stats()['depth'], 0)
+
+    @override_settings(SPAM_REPORT_QUEUE_MAX=2)
+    def test_full_queue_pushes_back(self):
+        self.clients[0].post('/api/spam/create/', {'phone_number': '8000000001'})
+        self.clients[0].post('/api/spam/create/', {'phone_number': '8000000002'})
+        response = self.clients[0].post('/api/spam/create/', {'phone_number': '8000000003'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+class SpamSnapshotTests(TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.enterContext(override_settings(SPAM_SNAPSHOT_DIR=directory.name))
+        self.user = User.objects.create_user(username='reporter', phone_number='9000000000')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        file_reports(self.user, ['8000000003', '8000000001', '8000000002'])
+
+    def test_snapshot_is_sorted_and_searchable(self):
+        result = export_snapshot()
+        with SpamSnapshot(result['path']) as snapshot:
+            self.assertEqual([key for key, _ in snapshot], sorted(phone_key(f'800000000{n}') for n in (1, 2, 3)))
+            self.assertEqual(snapshot.report_count(phone_key('8000000002')), 1)
+            self.assertEqual(snapshot.report_count(phone_key('8000000009')), 0)
+
+        response = self.client.get('/api/spam/snapshot/')
+        self.assertEqual(response['X-Spam-List-Version'], str(result['version']))
+        with open(result['path'], 'rb') as f:
+            self.assertEqual(b''.join(response.streaming_content), f.read())
+        response.close()
+
+    def test_changes_since_a_snapshot(self):
+        version = export_snapshot()['version']
+        file_reports(self.user, ['8000000004'])
+        withdraw_report(SpamReport.objects.get(phone_key=phone_key('8000000001')))
+
+        data = self.client.get('/api/spam/changes/', {'since': version}).json()
+        self.assertEqual(data['added'], [[phone_key('8000000004'), 1]])
+        self.assertEqual(data['removed'], [phone_key('8000000001')])
+        self.assertEqual(self.client.get('/api/spam/changes/', {'since': data['version']}).json()['added'], [])
+
+        export_snapshot(keep=1)
+        self.assertEqual(self.client.get('/api/spam/changes/', {'since': version}).status_code, 410)
+        self.assertEqual(self.client.get('/api/spam/changes/').status_code, 400)
+
+
+class ConditionalGetTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='poller', phone_number='9000000000')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def poll(self, path, etag, params=None):
+        return self.client.get(path, params, headers={'If-None-Match': etag})
+
+    def test_unchanged_contacts_are_not_resent(self):
+        Contact.objects.create(user=self.user, name='Kim', phone_number='8000000000')
+        etag = self.client.get('/api/contacts/')['ETag']
+        with self.assertNumQueries(1):
+            response = self.poll('/api/contacts/', etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+        self.assertEqual(self.poll('/api/contacts/', etag, {'page_size': 1}).status_code, 200)
+
+        self.client.post('/api/contacts/sync/', {'contacts': [{'name': 'Lee', 'phone_number': '8000000001'}]}, format='json')
+        response = self.poll('/api/contacts/', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([contact['name'] for contact in response.json()['results']], ['Lee'])
+        self.assertEqual(self.poll('/api/contacts/', response['ETag']).status_code, 304)
+
+    def test_profile_changes_invalidate_the_etag(self):
+        etag = self.client.get('/api/profile/')['ETag']
+        self.assertEqual(self.poll('/api/profile/', etag).status_code, 304)
+        self.client.patch('/api/profile/', {'email': 'poller@example.com'})
+        response = self.poll('/api/profile/', etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['email'], 'poller@example.com')
+
+        Contact.objects.create(user=self.user, name='Kim', phone_number='8000000000')
+        self.user.delete()
+        self.assertFalse(UserVersion.objects.exists())
+
+
+class ReadReplicaTests(TransactionTestCase):
+    """Copies of the SQLite test database stand in for replicas; rows written later are lagging."""
+    replicas = ('replica1', 'replica2')
+    serialized_rollback = True
+
+    @classmethod
+    def setUpClass(cls):
+        if connection.vendor != 'sqlite':
+            raise SkipTest('The replicas are copied from an SQLite database.')
+        directory = cls.enterClassContext(tempfile.TemporaryDirectory())
+        for alias in cls.replicas:
+            connections.settings[alias] = {**connections.settings[DEFAULT_DB_ALIAS], 'NAME': f'{directory}/{alias}.sqlite3'}
+        cls.addClassCleanup(cls.remove_replicas)
+        cls.databases = {DEFAULT_DB_ALIAS, *cls.replicas}
+        cls.enterClassContext(override_settings(DATABASE_REPLICAS=list(cls.replicas)))
+        super().setUpClass()
+
+    @classmethod
+    def remove_replicas(cls):
+        for alias in cls.replicas:
+            connections[alias].close()
+            del connections[alias]
+            del connections.settings[alias]
+
+    def setUp(self):
+        self.reader = User.objects.create_user(username='reader', phone_number='9000000001')
+        self.client = APIClient()
+        self.client.force_authenticate(self.reader)
+        caches[settings.REPLICA_PIN_CACHE].clear()
+        spam_cache.clear()
+        connection.ensure_connection()
+        for alias in self.replicas:
+            connections[alias].close()
+            with sqlite3.connect(connections.settings[alias]['NAME']) as copy:
+                connection.connection.backup(copy)
+            copy.close()
+
+    def test_lookups_read_the_replicas_in_turn(self):
+        with CaptureQueriesContext(connection) as primary, \
+                CaptureQueriesContext(connections['replica1']) as first, \
+                CaptureQueriesContext(connections['replica2']) as second:
+            for _ in range(4):
+                self.assertEqual(self.client.get(f'/api/users/{self.reader.pk}/').status_code, 200)
+        self.assertEqual(len(primary), 0)
+        self.assertGreater(len(first), 0)
+        self.assertEqual(len(first), len(second))
+
+        with CaptureQueriesContext(connection) as primary:
+            self.client.get('/api/contacts/')
+        self.assertGreater(len(primary), 0)
+
+    def test_a_user_who_writes_reads_their_writes(self):
+        caller = User.objects.create_user(username='caller', phone_number='9000000002')
+        self.assertEqual(self.client.get(f'/api/users/{caller.pk}/').status_code, 404)
+
+        response = self.client.post('/api/spam/create/', {'phone_number': caller.phone_number})
+        self.assertEqual(response.status_code, 201)
+        response = self.client.get(f'/api/spam/{caller.phone_number}/likelihood/')
+        self.assertEqual(response.json()['report_count'], 1)
+        self.assertEqual(self.client.get(f'/api/users/{caller.pk}/').status_code, 200)
+
+        other = APIClient()
+        other.force_authenticate(User.objects.create_user(username='other', phone_number='9000000003'))
+        self.assertEqual(other.get(f'/api/users/{caller.pk}/').status_code, 404)
+
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        caches['auth'].clear()
+        self.user = User.objects.create_user(username='holder', phone_number='9000000000', password='secret')
+        self.client = APIClient()
+        token = self.client.post('/api/login/', {'phone_number': '9000000000', 'password': 'secret'}).json()['token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        self.token = token
+
+    def test_token_is_resolved_from_cache(self):
+        self.assertEqual(self.client.get('/api/profile/').status_code, 200)
+        spam_cache.clear()
+        self.client.get('/api/spam/9876543210/')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/spam/9876543210/').status_code, 200)
+
+    def test_deactivation_and_logout_revoke_immediately(self):
+        self.assertEqual(self.client.get('/api/profile/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/profile/').status_code, 401)
+
+        self.user.is_active = True
+        self.user.save()
+        self.assertEqual(self.client.get('/api/profile/').status_code, 200)
+        self.assertEqual(self.client.delete('/api/logout/').status_code, 204)
+        self.assertEqual(self.client.get('/api/profile/').status_code, 401)
+
+    def test_async_path_reads_the_cache_without_blocking(self):
+        self.assertEqual(self.client.get('/api/profile/').status_code, 200)
+        cached = caches['auth'].get(f'auth-token:{self.token}')
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Token {self.token}')
+        with mock.patch('core.authentication.token_cache') as token_cache, self.assertNumQueries(0):
+            token_cache.return_value.aget = mock.AsyncMock(return_value=cached)
+            token_cache.return_value.get.side_effect = AssertionError('blocking cache read in the event loop')
+            user, _ = async_to_sync(CachedTokenAuthentication().aauthenticate)(request)
+        self.assertEqual(user, self.user)
+
+
+@override_settings(THROTTLE_ENABLED=True, THROTTLE_BURST=30, THROTTLE_RATE=1, THROTTLE_COSTS={'search-name': 10, 'search-phone': 2})
+class ThrottleTests(TestCase):
+    def setUp(self):
+        caches[settings.THROTTLE_CACHE].clear()
+        self.user = User.objects.create_user(username='scraper', phone_number='9000000000', password='secret')
+        self.client = APIClient()
+        token = self.client.post('/api/login/', {'phone_number': '9000000000', 'password': 'secret'}).json()['token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        patcher = mock.patch('core.throttling.time.time', return_value=1000.0)
+        self.clock = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_routes_spend_their_cost_and_short_queries_cost_more(self):
+        response = self.client.get('/api/search/phone/', {'q': '9000000000'})
+        self.assertEqual((response.status_code, response['X-RateLimit-Remaining']), (200, '28'))
+        response = self.client.get('/api/search/name/', {'q': 'scr'})
+        self.assertEqual(response['X-RateLimit-Remaining'], '18')
+        response = self.client.get('/api/async/search/name/', {'q': 'sc'})
+        self.assertEqual((response.status_code, response['X-RateLimit-Remaining']), (429, '18'))
+        self.assertEqual(response['Retry-After'], '2')
+
+        self.clock.return_value += 2
+        self.assertEqual(self.client.get('/api/async/search/name/', {'q': 'sc'}).status_code, 200)
+        response = self.client.get('/api/search/name/', {'q': 's'})
+        self.assertEqual((response.status_code, response['Retry-After']), (429, '30'))
+        self.assertEqual(response['X-RateLimit-Limit'], '30')
+
+    def test_refused_requests_spend_nothing_and_query_nothing(self):
+        for _ in range(15):
+            self.assertEqual(self.client.get('/api/search/phone/', {'q': '9000000000'}).status_code, 200)
+        with self.assertNumQueries(0):
+            response = self.client.get('/api/search/phone/', {'q': '9000000000'})
+        self.assertEqual(response.status_code, 429)
+        self.client.get('/api/search/phone/', {'q': '9000000000'})
+        self.clock.return_value += 2
+        self.assertEqual(self.client.get('/api/search/phone/', {'q': '9000000000'}).status_code, 200)
+        self.assertEqual(self.client.get('/api/search/phone/', {'q': '9000000000'}).status_code, 429)
+
+
+class AsyncViewTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='annie', phone_number='9000000000', password='secret', email='a@example.com')
+        for i in range(3):
+            owner = User.objects.create_user(username=f'anna{i}', phone_number=f'91{i:08d}', email=f'{i}@example.com')
+            Contact.objects.create(user=owner, name=f'Annabel {i}', phone_number='1800000000')
+            file_reports(owner, ['1800000000'])
+        Contact.objects.create(user=self.user, name='Anna', phone_number='9100000001')
+        self.client = APIClient()
+        token = self.client.post('/api/login/', {'phone_number': '9000000000', 'password': 'secret'}).json()['token']
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+
+    def assertSameResponse(self, path, params=None):
+        expected = self.client.get(f'/api{path}', params)
+        actual = self.client.get(f'/api/async{path}', params)
+        self.assertEqual(actual.status_code, expected.status_code)
+        body = actual.json()
+        if body.get('next'):
+            body['next'] = body['next'].replace('/api/async/', '/api/')
+        self.assertEqual(body, expected.json())
+
+    def test_async_views_match_sync_views(self):
+        self.assertSameResponse('/search/name/', {'q': 'ann'})
+        self.assertSameResponse('/search/name/', {'q': 'ann', 'page_size': 2})
+        self.assertSameResponse('/search/phone/', {'q': '1800000000'})
+        self.assertSameResponse('/search/phone/', {'q': '+91 91000 00001'})
+        self.assertSameResponse('/spam/1800000000/')
+        self.assertSameResponse(f'/users/{self.user.pk}/')
+        self.assertSameResponse(f'/users/{self.user.pk + 1}/')
+        self.assertSameResponse('/users/999999/')
+
+    def test_async_views_require_authentication(self):
+        self.client.credentials()
+        response = self.client.get('/api/async/search/name/', {'q': 'ann'})
+        self.assertEqual(response.status_code, 401)
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get('/api/async/search/name/', {'q': 'ann'}).status_code, 200)
+
+
+class FastSerializerTests(TestCase):
+    names = ['Kim', 'Zoë "Z" O\'Neil', 'back\\slash', 'line\u2028para\u2029sep', '\U0001f4de ☎', '<script>', '']
+
+    def assertSameJSON(self, fast, rows):
+        expected = fast.drf_serializer(rows, many=True).data
+        self.assertEqual(fast(rows, many=True).data, expected)
+        # orjson may spell a float differently (0.00001 for 1e-05), so compare what the JSON parses to.
+        self.assertEqual(json.loads(FastJSONRenderer().render(fast(rows, many=True).data)), json.loads(JSONRenderer().render(expected)))
+
+    def test_row_serializers_match_drf_serializers(self):
+        numbers = [f'80{i:08d}' for i in range(len(self.names))]
+        self.assertSameJSON(ContactRowSerializer, [
+            {'id': i, 'name': name, 'phone_number': number} for i, (name, number) in enumerate(zip(self.names, numbers))
+        ])
+        self.assertSameJSON(SearchResultRowSerializer, [
+            {'name': name, 'phone_number': number, 'spam_likelihood': likelihood}
+            for name, number, likelihood in zip(self.names, numbers, [0, 100, 100 / 3, 12.5, 2 / 7, 99.99, 1e-05])
+        ])
+        self.assertSameJSON(SpamNumberRowSerializer, [{'phone_key': i, 'phone_number': number} for i, number in enumerate(numbers)])
+        self.assertEqual(
+            ContactRowSerializer([(1, 'Kim', '8000000000')], many=True).data,
+            [{'id': 1, 'name': 'Kim', 'phone_number': '8000000000'}],
+        )
+
+    def test_renderer_falls_back_to_the_drf_encoder(self):
+        data = {'results': [{'name': name} for name in self.names], 'next': None, 'ratio': 2 / 3, 'at': timezone.now()}
+        expected = JSONRenderer().render(data)
+        self.assertEqual(FastJSONRenderer().render(data), expected)
+        with mock.patch.object(renderers, 'orjson', None):
+            self.assertEqual(FastJSONRenderer().render(data), expected)
+        self.assertEqual(json.loads(renderers.dumps({'count': 2 ** 70})), {'count': 2 ** 70})
+
+    def test_list_endpoints_keep_their_schema(self):
+        user = User.objects.create_user(username='lister', phone_number='9000000000')
+        for i, name in enumerate(self.names):
+            Contact.objects.create(user=user, name=name, phone_number=f'80{i:08d}')
+        file_reports(user, ['8000000001', '8000000003'])
+        client = APIClient()
+        client.force_authenticate(user)
+
+        response = client.get('/api/contacts/')
+        expected = ContactSerializer(Contact.objects.filter(user=user).order_by('id'), many=True).data
+        self.assertEqual(response.json()['results'], json.loads(JSONRenderer().render(expected)))
+        streamed = b''.join(client.get('/api/contacts/', {'stream': '1'}).streaming_content)
+        self.assertEqual(json.loads(streamed), response.json()['results'])
+        response = client.get('/api/spam/')
+        self.assertEqual(response.json()['results'], [{'phone_number': '8000000001'}, {'phone_number': '8000000003'}])
+
+
+class BenchmarkTests(TestCase):
+    def test_every_route_is_benchmarked(self):
+        routes = {pattern.name for pattern in urls.urlpatterns + async_urls.urlpatterns}
+        covered = {endpoint.route for endpoint in benchmark.ENDPOINTS} | set(benchmark.SKIPPED_ROUTES)
+        self.assertEqual(routes, covered)
+
+    def test_small_dataset_stays_within_query_budgets(self):
+        result = benchmark.run_scale(300, iterations=2)
+        violations = benchmark.check_budgets('test', result['endpoints'], benchmark.load_budgets(), latency=False)
+        self.assertEqual(violations, [])
+
+
+class ProfilerTests(TestCase):
+    def setUp(self):
+        profile_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(profile_dir.cleanup)
+        # A sampler thread that never wakes up in time; the test takes the samples itself.
+        settings_override = self.settings(PROFILER_DIR=profile_dir.name, PROFILER_CONFIG_SECONDS=0, PROFILER_INTERVAL=3600)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        profiler.reset()
+        self.addCleanup(profiler.reset)
+        self.admin = User.objects.create_user(username='root', phone_number='9000000000', is_staff=True)
+        Contact.objects.create(user=self.admin, name='Kim', phone_number='8000000000')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def sampled_get(self, path, params):
+        """GET `path`, taking a sample in every SQL query and JSON encoding; return the number of queries."""
+        queries = []
+
+        def sample_query(execute, *args):
+            profiler.take_sample()
+            queries.append(args)
+            return execute(*args)
+
+        def sample_dumps(data):
+            profiler.take_sample()
+            return dumps(data)
+
+        dumps = renderers.dumps
+        with connection.execute_wrapper(sample_query), mock.patch.object(renderers, 'dumps', sample_dumps):
+            self.assertEqual(self.client.get(path, params).status_code, 200)
+        return len(queries)
+
+    def test_sessions_sample_the_chosen_routes_by_category(self):
+        response = self.client.post('/api/profiler/', {'rate': 1, 'routes': ['search-name']}, format='json')
+        self.assertEqual((response.status_code, response.json()['routes']), (201, ['search-name']))
+        queries = self.sampled_get('/api/search/name/', {'q': 'kim'})
+        self.sampled_get('/api/search/phone/', {'q': '8000000000'})
+
+        profile = self.client.get('/api/profiler/').json()
+        self.assertEqual(list(profile['routes']), ['search-name'])
+        self.assertEqual(profile['routes']['search-name'], {
+            'requests': 1, 'samples': {'orm': queries, 'serialization': 1, 'view': 0, 'framework': 0},
+        })
+        stacks = self.client.get('/api/profiler/stacks/', {'route': 'search-name'}).content.decode().splitlines()
+        self.assertEqual(sum(int(line.rsplit(' ', 1)[1]) for line in stacks), queries + 1)
+        self.assertTrue(all(line.startswith('search-name;') for line in stacks))
+        self.assertTrue(any('core.views.NameSearchView.get_queryset;' in line and ';django.db.' in line for line in stacks))
+        self.assertTrue(any(';core.renderers.FastJSONRenderer.render;' in line for line in stacks))
+
+        profiler.write_snapshot()
+        out = StringIO()
+        call_command('dump_profile', stdout=out)
+        self.assertEqual(out.getvalue().splitlines(), sorted(stacks))
+
+        self.assertEqual(self.client.delete('/api/profiler/').status_code, 200)
+        self.sampled_get('/api/search/name/', {'q': 'kim'})
+        self.assertEqual(self.client.get('/api/profiler/').json()['routes']['search-name']['requests'], 1)
+
+        self.client.post('/api/profiler/', {'rate': 1}, format='json')
+        self.assertEqual(self.client.get('/api/profiler/').json()['routes'], {})
+        # The previous session's profile is deleted once read under the new one.
+        self.assertEqual(list(Path(settings.PROFILER_DIR).glob('profile-*.json')), [])
+        self.client.force_authenticate(User.objects.create_user(username='viewer', phone_number='9000000001'))
+        self.assertEqual(self.client.get('/api/profiler/stacks/').status_code, 403)
+
+
+class PopulateDataTests(TestCase):
+    def generate(self):
+        written = populate(users=30, contacts_per_user=5, spam_reports=200, seed=7, log=lambda message: None)
+        rows = (
+            list(User.objects.order_by('pk').values_list('username', 'phone_number')),
+            list(Contact.objects.order_by('pk').values_list('name', 'phone_number')),
+            sorted(SpamReport.objects.values_list('phone_number', 'reported_by__username')),
+        )
+        return written, rows
+
+    def test_generates_the_requested_rows_reproducibly(self):
+        written, (users, contacts, reports) = self.generate()
+        self.assertEqual(written, {'users': 30, 'contacts': 150, 'spam reports': 200})
+        self.assertEqual(len({number for _, number in users + contacts}), 180)
+        self.assertEqual(stats.total_reports(), 200)
+        self.assertEqual(stats.total_users(), 30)
+
+        User.objects.all().delete()
+        self.assertEqual(self.generate()[1], (users, contacts, reports))
+
+
+class RequestMetricsTests(TestCase):
+    def setUp(self):
+        snapshot_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(snapshot_dir.cleanup)
+        settings_override = self.settings(METRICS_SNAPSHOT_DIR=snapshot_dir.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+        metrics.reset()
+        self.user = User.objects.create_user(username='watcher', phone_number='9000000000', is_staff=True)
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_requests_are_recorded_per_route(self):
+        Contact.objects.create(user=self.user, name='Kim', phone_number='8000000000')
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/search/name/', {'q': 'kim'})
+        search_queries = len(queries)
+        streamed = b''.join(self.client.get('/api/contacts/', {'stream': '1'}).streaming_content)
+        self.client.get('/api/no-such-route/')
+
+        routes = metrics.snapshot()['routes']
+        search = routes['search-name GET']
+        self.assertEqual(search['statuses'], {'200': 1})
+        self.assertEqual(sum(search['buckets']), 1)
+        self.assertEqual(search['queries'], search_queries)
+        self.assertEqual(search['response_bytes'], len(response.content))
+        self.assertEqual(routes['list-contacts GET']['response_bytes'], len(streamed))
+        self.assertEqual(routes['list-contacts GET']['queries'], 2)
+        self.assertEqual(routes['unmatched GET']['statuses'], {'404': 1})
+
+    def test_shards_of_exited_threads_are_folded_into_the_total(self):
+        def record():
+            metrics.record('search-name', 'GET', 200, 0.002, 3, 0.001, 100)
+
+        threads = [threading.Thread(target=record) for _ in range(5)]
+        for thread in threads:
+            thread.start()
+            thread.join()
+        record()
+        search = metrics.snapshot()['routes']['search-name GET']
+        self.assertEqual((search['statuses'], search['queries'], search['response_bytes']), ({'200': 6}, 18, 600))
+        self.assertEqual(list(metrics._shards), [threading.current_thread()])
+
+    def test_snapshots_of_exited_processes_are_deleted(self):
+        directory = Path(settings.METRICS_SNAPSHOT_DIR)
+        metrics.record('search-name', 'GET', 200, 0.002, 3, 0.001, 100)
+        metrics.write_snapshot()
+        live = directory / f'metrics-{os.getpid()}.json'
+        exited = directory / 'metrics-1.json'
+        exited.write_text(live.read_text().replace(f'"pid": {os.getpid()}', '"pid": 1'))
+        self.assertEqual(len(read_metric_snapshots()), 2)
+
+        expired = time.time() - settings.METRICS_SNAPSHOT_MAX_AGE - 60
+        os.utime(exited, (expired, expired))
+        self.assertEqual([snapshot['pid'] for snapshot in read_metric_snapshots()], [os.getpid()])
+        self.assertFalse(exited.exists())
+        self.assertTrue(live.exists())
+
+    def test_metrics_are_exported_for_all_processes(self):
+        self.client.get('/api/search/name/', {'q': 'kim'})
+        metrics.write_snapshot()
+        body = self.client.get('/api/metrics/').content.decode()
+        self.assertIn('phonebook_http_requests_total{route="search-name",method="GET",status="200"} 1', body)
+        self.assertIn('phonebook_http_request_duration_seconds_count{route="search-name",method="GET"} 1', body)
+
+        out = StringIO()
+        call_command('dump_metrics', stdout=out)
+        self.assertEqual(json.loads(out.getvalue())['routes']['search-name GET']['statuses'], {'200': 1})
+
+        self.client.force_authenticate(User.objects.create_user(username='viewer', phone_number='9000000001'))
+        self.assertEqual(self.client.get('/api/metrics/').status_code, 403)
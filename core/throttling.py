@@ -0,0 +1,145 @@
+"""
+Token-bucket request throttling, with a cost per route, when THROTTLE_ENABLED is set.
+
+Every caller (a user, or the client address of an anonymous request) has a bucket of
+THROTTLE_BURST tokens that refills at THROTTLE_RATE tokens a second. A request spends the cost
+of its route, THROTTLE_COSTS[url name] or 1, and a view can price single requests with a
+`throttle_cost(request, cost)` method; a short name search matches far more rows than a long
+one, so it costs more. A request the bucket can't cover is refused with 429 and spends
+nothing. ThrottleHeadersMiddleware reports the remaining budget on every response.
+
+A bucket is one integer in the THROTTLE_CACHE cache: the time, in microseconds, at which it
+will be full again (the generic cell rate algorithm's "theoretical arrival time"). Spending is
+an atomic `incr` by the time the cost takes to refill, and a refused request takes its
+increment back with `decr`, so concurrent requests through a shared backend never overspend.
+When a bucket was already full its time lags the clock and is moved up to now with `set`;
+a request racing with that move can go uncounted, which only ever forgives a request or two
+from a caller who was idle. Nothing here touches the database.
+"""
+import math
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from rest_framework.throttling import BaseThrottle
+
+KEY = 'throttle:{}'
+MICROSECONDS = 1000000
+
+
+class Budget:
+    """What a request's spending came to: whether it was allowed, the tokens left and, if refused, the seconds to wait."""
+    __slots__ = ('allowed', 'remaining', 'retry_after')
+
+    def __init__(self, allowed, remaining, retry_after=0):
+        self.allowed = allowed
+        self.remaining = remaining
+        self.retry_after = retry_after
+
+def bucket_cache():
+    return caches[settings.THROTTLE_CACHE]
+
+def caller(request):
+    """The bucket a request spends from: its user's, or its client address's when anonymous."""
+    user = getattr(request, 'user', None)
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}'
+    return f'address:{BaseThrottle().get_ident(request)}'
+
+def route_cost(request, view):
+    match = request.resolver_match
+    # The async routes cost the same as their synchronous twins.
+    route = match.url_name.removeprefix('async-') if match is not None and match.url_name else ''
+    cost = settings.THROTTLE_COSTS.get(route, 1)
+    price = getattr(view, 'throttle_cost', None)
+    return price(request, cost) if price is not None else cost
+
+def short_query_cost(query, cost):
+    """The cost of a substring search for `query`: one- and two-character queries cost 3x and 2x."""
+    return cost * max(1, 4 - len((query or '').strip()))
+
+def _interval():
+    """Microseconds to refill one token."""
+    return MICROSECONDS / settings.THROTTLE_RATE
+
+def _timeout():
+    # An untouched bucket is full again after this long, so its key can expire.
+    return math.ceil(settings.THROTTLE_BURST / settings.THROTTLE_RATE) + 1
+
+def _budget(full_at, now, price):
+    """The outcome for a bucket that is full at `full_at` after spending `price` microseconds."""
+    interval = _interval()
+    window = settings.THROTTLE_BURST * interval
+    if full_at - now <= window:
+        return Budget(True, int((window - (full_at - now)) / interval))
+    return Budget(
+        False,
+        max(0, int((window - (full_at - price - now)) / interval)),
+        math.ceil((full_at - now - window) / MICROSECONDS),
+    )
+
+def spend(ident, cost):
+    """Spend `cost` tokens from the bucket of `ident` and return the Budget."""
+    cache = bucket_cache()
+    key = KEY.format(ident)
+    now = int(time.time() * MICROSECONDS)
+    price = round(cost * _interval())
+    if cache.add(key, now + price, _timeout()):
+        full_at = now + price
+    else:
+        try:
+            full_at = cache.incr(key, price)
+        except ValueError:
+            # The key expired between add() and incr().
+            full_at = None
+        if full_at is None or full_at - price < now:
+            full_at = now + price
+            cache.set(key, full_at, _timeout())
+        else:
+            cache.touch(key, _timeout())
+    budget = _budget(full_at, now, price)
+    if not budget.allowed:
+        try:
+            cache.decr(key, price)
+        except ValueError:
+            pass
+    return budget
+
+async def aspend(ident, cost):
+    cache = bucket_cache()
+    key = KEY.format(ident)
+    now = int(time.time() * MICROSECONDS)
+    price = round(cost * _interval())
+    if await cache.aadd(key, now + price, _timeout()):
+        full_at = now + price
+    else:
+        try:
+            full_at = await cache.aincr(key, price)
+        except ValueError:
+            full_at = None
+        if full_at is None or full_at - price < now:
+            full_at = now + price
+            await cache.aset(key, full_at, _timeout())
+        else:
+            await cache.atouch(key, _timeout())
+    budget = _budget(full_at, now, price)
+    if not budget.allowed:
+        try:
+            await cache.adecr(key, price)
+        except ValueError:
+            pass
+    return budget
+
+class TokenBucketThrottle(BaseThrottle):
+    """DRF throttle spending from the caller's token bucket; see the module docstring."""
+
+    def allow_request(self, request, view):
+        if not settings.THROTTLE_ENABLED:
+            return True
+        self.budget = spend(caller(request), route_cost(request, view))
+        # Read by ThrottleHeadersMiddleware, which sees the Django request.
+        request._request.throttle_budget = self.budget
+        return self.budget.allowed
+
+    def wait(self):
+        return self.budget.retry_after
@@ -10,6 +10,7 @@ from .views import (
     PhoneSearchView,
     UserDetailView,
     ContactCreateView,
+    ContactSyncView,
     AllSpamNumbersListView,
 )
 from . import views
@@ -20,14 +21,27 @@ urlpatterns = [
        path('logout/', LogoutView.as_view(), name='logout'),
        path('profile/', ProfileView.as_view(), name='profile'),
        path('contacts/create/', ContactCreateView.as_view(), name='add-contact'),  
+       path('contacts/sync/', ContactSyncView.as_view(), name='sync-contacts'),
        path('contacts/', ContactListView.as_view(), name='list-contacts'),
        path('spam/create/', SpamCreateReportView.as_view(), name='spam-report'),
        path('spam/', AllSpamNumbersListView.as_view(), name='all-spam-numbers'),  
-       path('spam/<str:phone_number>/delete/', views.SpamReportDeleteView.as_view(), name='remove-spam'),
-       path('spam/<str:phone_number>/', views.SpamNumberDetailView.as_view(), name='spam-number-detail'),
+       path('spam/batch/', views.SpamBatchReportView.as_view(), name='spam-report-batch'),
+       path('spam/filter-stats/', views.SpamFilterStatsView.as_view(), name='spam-filter-stats'),
+       path('spam/cache-stats/', views.SpamCacheStatsView.as_view(), name='spam-cache-stats'),
+       path('spam/queue-stats/', views.SpamReportQueueStatsView.as_view(), name='spam-queue-stats'),
+       path('spam/snapshot/', views.SpamSnapshotView.as_view(), name='spam-snapshot'),
+       path('spam/changes/', views.SpamListChangesView.as_view(), name='spam-list-changes'),
+       path('spam/<phone:phone_number>/delete/', views.SpamReportDeleteView.as_view(), name='remove-spam'),
+       path('spam/<phone:phone_number>/likelihood/', views.SpamLikelihoodView.as_view(), name='spam-likelihood'),
+       path('spam/<phone:phone_number>/', views.SpamNumberDetailView.as_view(), name='spam-number-detail'),
        path('search/name/', NameSearchView.as_view(), name='search-name'),
        path('search/phone/', PhoneSearchView.as_view(), name='search-phone'),
+       path('search/phone/batch/', views.PhoneLookupBatchView.as_view(), name='search-phone-batch'),
+       path('users/batch/', views.UserDetailBatchView.as_view(), name='user-detail-batch'),
        path('users/<int:id>/', UserDetailView.as_view(), name='user-detail'),
        path('populate-test-data/', views.PopulateTestDataView.as_view(), name='populate-test-data'),
+       path('metrics/', views.MetricsView.as_view(), name='metrics'),
+       path('profiler/', views.ProfilerView.as_view(), name='profiler'),
+       path('profiler/stacks/', views.ProfilerStacksView.as_view(), name='profiler-stacks'),
     
 ]
\ No newline at end of file
@@ -0,0 +1,75 @@
+"""
+Conditional GET for per-user resources.
+
+Every change to a user's contacts or profile bumps a counter in UserVersion, in the same
+transaction as the change. The ETag of a response is derived from that counter and the request
+path, so an If-None-Match poll is answered 304 after reading one row, without loading or
+serialising what it covers. The counter is read before the rows. A response can therefore pair
+an old version with newer rows, but never the reverse, so the client's next poll fetches again
+rather than being told that stale data is current.
+"""
+import hashlib
+import threading
+from contextlib import contextmanager
+
+from django.db.models import F
+from django.utils.cache import get_conditional_response, patch_cache_control, patch_vary_headers
+
+from .models import UserVersion
+
+CONTACTS = 'contacts'
+PROFILE = 'profile'
+
+_local = threading.local()
+
+
+def start(user_id):
+    """Create a new user's counters, so their first change is a single UPDATE."""
+    UserVersion.objects.create(user_id=user_id, profile=1)
+
+def start_many(user_ids):
+    """start() for users created with bulk_create; users that already have counters are skipped."""
+    UserVersion.objects.bulk_create([UserVersion(user_id=user_id, profile=1) for user_id in user_ids], ignore_conflicts=True)
+
+def bump(user_id, kind):
+    if user_id in getattr(_local, 'batched', ()):
+        return
+    updated = UserVersion.objects.filter(user_id=user_id).update(**{kind: F(kind) + 1})
+    if not updated:
+        # Users created by bulk_create have no counters until their first change.
+        UserVersion.objects.bulk_create([UserVersion(user_id=user_id)], ignore_conflicts=True)
+        UserVersion.objects.filter(user_id=user_id).update(**{kind: F(kind) + 1})
+
+@contextmanager
+def batched(user_id, kind):
+    """Bump `kind` once for a block of writes that would otherwise bump it row by row."""
+    _local.batched = getattr(_local, 'batched', set()) | {user_id}
+    try:
+        yield
+    finally:
+        _local.batched = _local.batched - {user_id}
+    bump(user_id, kind)
+
+def version(user_id, kind):
+    value = UserVersion.objects.filter(user_id=user_id).values_list(kind, flat=True).first()
+    return value or 0
+
+def etag(request, kind):
+    """A strong ETag for `kind` of the requesting user, as requested (path and query string)."""
+    resource = hashlib.sha256(f'{request.user.pk}:{request.get_full_path()}'.encode()).hexdigest()[:16]
+    return f'"{kind}-{version(request.user.pk, kind)}-{resource}"'
+
+class ConditionalGetMixin:
+    """Answers a GET whose If-None-Match is current with 304 before the view touches any rows."""
+    version_kind = None
+
+    def get(self, request, *args, **kwargs):
+        tag = etag(request, self.version_kind)
+        response = get_conditional_response(request, etag=tag)
+        if response is None:
+            response = super().get(request, *args, **kwargs)
+        if response.status_code in (200, 304):
+            response['ETag'] = tag
+            patch_cache_control(response, private=True, no_cache=True)
+            patch_vary_headers(response, ['Authorization'])
+        return response
@@ -1,27 +1,130 @@
-from rest_framework import generics, permissions, status, views, response
+from rest_framework import generics, permissions, serializers, status, views, response
 from rest_framework.response import Response
 from rest_framework.authtoken.models import Token
 from django.contrib.auth import authenticate, get_user_model
-from django.db.models import Count, Q
-from .models import Contact, SpamReport, User
+from django.db import IntegrityError, transaction
+from django.db.models import Case, Exists, OuterRef, When
+from .models import Contact, PhoneDirectory, PhoneSpamStat, SpamReport, User
 from .serializers import (
     RegistrationSerializer,
     LoginSerializer,
     UserProfileSerializer,
     ContactSerializer,
+    ContactSyncSerializer,
     SpamReportSerializer,
-    SearchResultSerializer,
+    SpamBatchReportSerializer,
+    PhoneLookupBatchSerializer,
+    PopulateTestDataSerializer,
+    ProfilerSessionSerializer,
     UserDetailSerializer,
+    UserDetailBatchSerializer,
 )
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.permissions import AllowAny
-from django.db import models
-from django.core.management import call_command
 from django.conf import settings
+from django.http import FileResponse, HttpResponse
 from django.shortcuts import get_object_or_404
+from . import stats, versions
+from .authentication import forget_token
+from .bloom import spam_filter
+from .caller_id import caller_ids
+from .fast_serializers import ContactRowSerializer, SearchResultRowSerializer, SpamNumberRowSerializer
+from .spam_cache import spam_cache
+from .versions import ConditionalGetMixin
+from .replicas import ReplicaReadMixin
+from .contacts import sync_contacts
+from .datagen import start_population
+from .metrics import render_prometheus, service_snapshot
+from .profiling import profiler, render_collapsed, service_profile, summary
+from .report_queue import QueueFull, report_queue
+from .reports import file_reports, withdraw_report
+from .pagination import (
+    ContactCursorPagination,
+    SearchCursorPagination,
+    SortName,
+    SpamNumberCursorPagination,
+    keyset_after,
+    streaming_json_response,
+    wants_stream,
+)
+from .phone import phone_key
+from .throttling import short_query_cost
+from .search_index import CONTACT, USER, name_index
+from .snapshot import SnapshotExpired, changes_since, latest_snapshot
 
 User = get_user_model()
 
+REPORT_CREATED = 'created'
+REPORT_ALREADY_REPORTED = 'already_reported'
+REPORT_QUEUED = 'queued'
+
+def search_rows(matches, total_reports):
+    """Turn (kind, rank, name, pk, phone_number, spam_count) matches into (cursor key, result) rows."""
+    return [
+        ((kind, rank, name, pk), {'name': name, 'phone_number': phone_number, 'spam_likelihood': stats.spam_likelihood(spam_count, total_reports)})
+        for kind, rank, name, pk, phone_number, spam_count in matches
+    ]
+
+def name_search_users(query, after):
+    """(rank, username, pk, phone_number, spam_count) rows of users matching `query`, resuming after `after`."""
+    users = (
+        stats.with_report_count(User.objects.filter(username__icontains=query))
+        .annotate(rank=Case(When(username__istartswith=query, then=0), default=1), sort_name=SortName('username'))
+        .order_by('rank', 'sort_name', 'pk')
+    )
+    if after is not None:
+        users = users.filter(keyset_after(after, 'sort_name', 'rank'))
+    return users.values_list('rank', 'username', 'pk', 'phone_number', 'spam_count')
+
+def name_search_contacts(query, after):
+    """Contact rows matching `query` whose number is not one of the matched users'."""
+    matched_users = User.objects.filter(username__icontains=query).exclude(phone_key=None)
+    contacts = (
+        stats.with_report_count(Contact.objects.filter(name__icontains=query))
+        .exclude(phone_key__in=matched_users.values('phone_key'))
+        .annotate(rank=Case(When(name__istartswith=query, then=0), default=1), sort_name=SortName('name'))
+        .order_by('rank', 'sort_name', 'pk')
+    )
+    if after is not None and after[0] == CONTACT:
+        contacts = contacts.filter(keyset_after(after, 'sort_name', 'rank'))
+    return contacts.values_list('rank', 'name', 'pk', 'phone_number', 'spam_count')
+
+def phone_directory_entry(key):
+    """The directory row for `key`, with its user's name and number and its spam count, as one query."""
+    return stats.with_report_count(PhoneDirectory.objects.filter(phone_key=key)).values_list(
+        'user__username', 'user_id', 'user__phone_number', 'phone_number', 'names', 'spam_count',
+    )
+
+def phone_search_matches(entry, after):
+    """Matches for a directory row: its registered user, or else the names it is most often saved under."""
+    if entry is None:
+        return []
+    username, user_id, user_number, phone_number, names, spam_count = entry
+    if user_id is not None:
+        # A registered number resolves to exactly one row, so there is never a second page.
+        return [(USER, 0, username, user_id, user_number, spam_count)] if after is None else []
+    # Names are ranked by how many contacts use them; the cursor resumes after a rank.
+    start = 0 if after is None else after[1] + 1
+    return [(CONTACT, rank, name, 0, phone_number, spam_count) for rank, (name, _) in enumerate(names) if rank >= start]
+
+def user_details(viewer):
+    """
+    Users with their `spam_count` and `in_contacts`, whether `viewer` has saved their number.
+    Both come from correlated subqueries, so any number of users costs one query; the contact
+    check is an index lookup on (phone_key, user).
+    """
+    saved = Contact.objects.filter(user=viewer, phone_key=OuterRef('phone_key'))
+    return stats.with_report_count(User.objects.all()).annotate(in_contacts=Exists(saved))
+
+def user_detail_data(users, total_reports):
+    """UserDetailSerializer data for users from `user_details()`; the email only shows to viewers who saved them."""
+    data = UserDetailSerializer(users, many=True).data
+    for user, item in zip(users, data):
+        item['spam_likelihood'] = stats.spam_likelihood(user.spam_count, total_reports)
+        if not user.in_contacts:
+            item.pop('email', None)
+    return data
+
 class RegistrationView(generics.CreateAPIView):
     serializer_class = RegistrationSerializer
     permission_classes = [AllowAny]
@@ -45,164 +148,238 @@ class LogoutView(generics.DestroyAPIView):
 
     def delete(self, request, *args, **kwargs):
         try:
-            request.user.auth_token.delete()
+            token = request.user.auth_token
+            token.delete()
+            forget_token(token.key)
             return Response(status=status.HTTP_204_NO_CONTENT)
         except:
             return Response({'error': 'Something went wrong'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
 
-class ProfileView(generics.RetrieveUpdateAPIView):
+class ProfileView(ConditionalGetMixin, generics.RetrieveUpdateAPIView):
     permission_classes = [IsAuthenticated]
+    version_kind = versions.PROFILE
     serializer_class = UserProfileSerializer
 
     def get_object(self):
         return self.request.user
 
-class ContactListView(generics.ListCreateAPIView):
-    permission_classes = [IsAuthenticated]
-    serializer_class = ContactSerializer
-
-    def get_queryset(self):
-        return self.request.user.contacts.all()
-
-    def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
-
 class SpamCreateReportView(generics.CreateAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = SpamReportSerializer
 
-    def perform_create(self, serializer):
-        serializer.save(reported_by=self.request.user)
+    def create(self, request, *args, **kwargs):
+        """
+        Idempotent: reporting a number twice answers 200 'already_reported' instead of failing.
+        With SPAM_REPORT_QUEUE_ENABLED the report is queued and answered 202 'queued' at once.
+        """
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        phone_number = serializer.validated_data['phone_number']
+        if settings.SPAM_REPORT_QUEUE_ENABLED:
+            try:
+                report_queue.put(request.user.pk, phone_number)
+            except QueueFull:
+                return Response(
+                    {'error': 'Too many spam reports are waiting to be saved. Try again shortly.'},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    headers={'Retry-After': str(report_queue.retry_after())},
+                )
+            return Response({'phone_number': phone_number, 'status': REPORT_QUEUED}, status=status.HTTP_202_ACCEPTED)
+        if phone_key(phone_number) in file_reports(request.user, [phone_number]):
+            return Response({'phone_number': phone_number, 'status': REPORT_CREATED}, status=status.HTTP_201_CREATED)
+        return Response({'phone_number': phone_number, 'status': REPORT_ALREADY_REPORTED}, status=status.HTTP_200_OK)
+
+class SpamBatchReportView(generics.GenericAPIView):
+    """Report many numbers at once; duplicates are reported back rather than raised."""
+    permission_classes = [IsAuthenticated]
+    serializer_class = SpamBatchReportSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        numbers = {}
+        for phone_number in serializer.validated_data['phone_numbers']:
+            numbers.setdefault(phone_key(phone_number), phone_number)
+        created = file_reports(request.user, numbers.values())
+        return Response({
+            'created': len(created),
+            'results': [
+                {'phone_number': phone_number, 'status': REPORT_CREATED if key in created else REPORT_ALREADY_REPORTED}
+                for key, phone_number in numbers.items()
+            ],
+        })
 
-class NameSearchView(generics.ListAPIView):
+class NameSearchView(ReplicaReadMixin, generics.ListAPIView):
     permission_classes = [IsAuthenticated]
-    serializer_class = SearchResultSerializer
+    serializer_class = SearchResultRowSerializer
+    pagination_class = SearchCursorPagination
+
+    def throttle_cost(self, request, cost):
+        return short_query_cost(request.query_params.get('q'), cost)
 
     def get_queryset(self):
+        """Return the next page of (sort key, result) rows, plus one row to detect a following page."""
         query = self.request.query_params.get('q', None)
         if query:
-            registered_users = User.objects.annotate(
-                spam_count=Count('spamreport', filter=Q(spamreport__phone_number=models.F('phone_number')))
-            ).filter(Q(username__istartswith=query) | Q(username__icontains=query)).distinct()
-
-            contacts = Contact.objects.filter(
-                Q(name__istartswith=query) | Q(name__icontains=query),
-                user__in=User.objects.all()  
-            ).exclude(phone_number__in=registered_users.values_list('phone_number', flat=True)).distinct()
-
-            results = []
-            for user in registered_users.order_by('username'):
-                spam_reports = SpamReport.objects.filter(phone_number=user.phone_number).count()
-                total_reports = SpamReport.objects.count()
-                spam_likelihood = (spam_reports / total_reports) * 100 if total_reports > 0 else 0
-                results.append({'name': user.username, 'phone_number': user.phone_number, 'spam_likelihood': spam_likelihood})
-
-            for contact in contacts.order_by('name'):
-                spam_reports = SpamReport.objects.filter(phone_number=contact.phone_number).count()
-                total_reports = SpamReport.objects.count()
-                spam_likelihood = (spam_reports / total_reports) * 100 if total_reports > 0 else 0
-                results.append({'name': contact.name, 'phone_number': contact.phone_number, 'spam_likelihood': spam_likelihood})
-
-            return results
+            after = self.paginator.decode_cursor(self.request)
+            limit = self.paginator.get_fetch_size(self.request)
+            indexed = name_index.search(query, limit, after)
+            if indexed is not None:
+                return self.indexed_results(indexed)
+
+            registered_users = []
+            if after is None or after[0] == USER:
+                registered_users = [(USER, *row) for row in name_search_users(query, after)[:limit]]
+
+            contacts = []
+            if len(registered_users) < limit:
+                contacts = [
+                    (CONTACT, *row) for row in name_search_contacts(query, after)[:limit - len(registered_users)]
+                ]
+
+            return search_rows(registered_users + contacts, stats.total_reports())
         return []
+
+    def indexed_results(self, matches):
+        spam_counts = stats.report_counts({key for *_, key in matches})
+        return search_rows(
+            [(*match[:5], spam_counts[match[5]]) for match in matches],
+            stats.total_reports(),
+        )
     
-class SpamNumberDetailView(views.APIView):
+class SpamNumberDetailView(ReplicaReadMixin, views.APIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request, phone_number):
-        is_spam = SpamReport.objects.filter(phone_number=phone_number).exists()
-        report_count = SpamReport.objects.filter(phone_number=phone_number).count()
+        if not spam_filter.might_contain(phone_number.key):
+            return response.Response({'phone_number': phone_number, 'is_spam': False, 'report_count': 0})
+        report_count = spam_cache.report_count(phone_number.key)
+        if not report_count and spam_filter.ready:
+            spam_filter.record_false_positive()
         return response.Response({
             'phone_number': phone_number,
-            'is_spam': is_spam,
+            'is_spam': report_count > 0,
             'report_count': report_count
         })
 
-class PhoneSearchView(generics.ListAPIView):
+class PhoneSearchView(ReplicaReadMixin, generics.ListAPIView):
     permission_classes = [IsAuthenticated]
-    serializer_class = SearchResultSerializer
+    serializer_class = SearchResultRowSerializer
+    pagination_class = SearchCursorPagination
 
     def get_queryset(self):
         query = self.request.query_params.get('q', None)
-        if query:
-            registered_user = User.objects.annotate(
-                spam_count=Count('spamreport', filter=Q(spamreport__phone_number=models.F('phone_number')))
-            ).filter(phone_number=query).first()
-
-            if registered_user:
-                spam_reports = SpamReport.objects.filter(phone_number=registered_user.phone_number).count()
-                total_reports = SpamReport.objects.count()  
-                spam_likelihood = (spam_reports / total_reports) * 100 if total_reports > 0 else 0
-                return [{'name': registered_user.username, 'phone_number': registered_user.phone_number, 'spam_likelihood': spam_likelihood}]
-            else:
-                contacts = Contact.objects.filter(phone_number=query, user__in=User.objects.all()).distinct()
-                results = []
-                for contact in contacts:
-                    spam_reports = SpamReport.objects.filter(phone_number=contact.phone_number).count()
-                    total_reports = SpamReport.objects.count()
-                    spam_likelihood = (spam_reports / total_reports) * 100 if total_reports > 0 else 0
-                    results.append({'name': contact.name, 'phone_number': contact.phone_number, 'spam_likelihood': spam_likelihood})
-                return results
+        key = phone_key(query)
+        if key is not None:
+            after = self.paginator.decode_cursor(self.request)
+            limit = self.paginator.get_fetch_size(self.request)
+            matches = phone_search_matches(phone_directory_entry(key).first(), after)
+            return search_rows(matches[:limit], stats.total_reports())
         return []
 
-class UserDetailView(generics.RetrieveAPIView):
+class PhoneLookupBatchView(generics.GenericAPIView):
+    """Caller ID for a whole call log at once: name, report count and likelihood per number."""
+    permission_classes = [IsAuthenticated]
+    serializer_class = PhoneLookupBatchSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response({'results': caller_ids(serializer.validated_data['phone_numbers'])})
+
+class UserDetailView(ReplicaReadMixin, generics.RetrieveAPIView):
     permission_classes = [IsAuthenticated]
     serializer_class = UserDetailSerializer
-    queryset = User.objects.all()
     lookup_field = 'id'
 
+    def get_queryset(self):
+        return user_details(self.request.user)
+
     def retrieve(self, request, *args, **kwargs):
         instance = self.get_object()
-        spam_reports = SpamReport.objects.filter(phone_number=instance.phone_number).count()
-        total_reports = SpamReport.objects.count() 
-        spam_likelihood = (spam_reports / total_reports) * 100 if total_reports > 0 else 0
-
-        is_contact = Contact.objects.filter(user=request.user, phone_number=instance.phone_number).exists()
-
-        serializer = self.get_serializer(instance)
-        data = serializer.data
-        data['spam_likelihood'] = spam_likelihood
-        if not is_contact:
-            data.pop('email', None)
-        return Response(data)
-    
-class SpamLikelihoodView(views.APIView):
+        return Response(user_detail_data([instance], stats.total_reports())[0])
+
+class UserDetailBatchView(ReplicaReadMixin, generics.GenericAPIView):
+    """Details of many users in one request, in the order asked, with `null` for unknown ids."""
+    permission_classes = [IsAuthenticated]
+    serializer_class = UserDetailBatchSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        ids = serializer.validated_data['ids']
+        users = list(user_details(request.user).filter(pk__in=set(ids)))
+        details = dict(zip([user.pk for user in users], user_detail_data(users, stats.total_reports())))
+        return Response({'results': [details.get(pk) for pk in ids]})
+
+class SpamLikelihoodView(ReplicaReadMixin, views.APIView):
+    """Lifetime, recent and time-decayed spam activity for a number, read from its stats row."""
     permission_classes = [permissions.IsAuthenticated]
 
     def get(self, request, phone_number):
-        total_reporting_users = User.objects.count()
-        spam_reports_count = SpamReport.objects.filter(phone_number=phone_number).count()
+        total_reporting_users = stats.total_users()
+        scores = stats.spam_scores(phone_number.key)
 
         if total_reporting_users > 0:
-            likelihood_percentage = (spam_reports_count / total_reporting_users) * 100
-            return response.Response({'phone_number': phone_number, 'spam_likelihood': f'{likelihood_percentage:.2f}%'})
+            likelihood_percentage = (scores['report_count'] / total_reporting_users) * 100
+            likelihood = f'{likelihood_percentage:.2f}%'
         else:
-            return response.Response({'phone_number': phone_number, 'spam_likelihood': '0.00% (No users to report)'})
-        
+            likelihood = '0.00% (No users to report)'
+        return response.Response({'phone_number': phone_number, 'spam_likelihood': likelihood, **scores})
+
 class ContactCreateView(generics.CreateAPIView):
     serializer_class = ContactSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def perform_create(self, serializer):
-        serializer.save(user=self.request.user)
+        # The phone directory is updated by the save signals; keep it in the contact's transaction.
+        try:
+            with transaction.atomic():
+                serializer.save(user=self.request.user)
+        except IntegrityError:
+            raise serializers.ValidationError({'phone_number': ['You already have a contact with this phone number.']})
+
+class ContactSyncView(generics.GenericAPIView):
+    """Replace the caller's contacts with an uploaded address book in one request."""
+    serializer_class = ContactSyncSerializer
+    permission_classes = [permissions.IsAuthenticated]
 
-class ContactListView(generics.ListAPIView):
-    serializer_class = ContactSerializer
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        summary = sync_contacts(
+            request.user,
+            serializer.validated_data['contacts'],
+            delete_missing=serializer.validated_data['delete_missing'],
+        )
+        return Response(summary, status=status.HTTP_200_OK)
+
+class ContactListView(ConditionalGetMixin, generics.ListAPIView):
+    serializer_class = ContactRowSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = ContactCursorPagination
+    version_kind = versions.CONTACTS
 
     def get_queryset(self):
-        return Contact.objects.filter(user=self.request.user)
+        return Contact.objects.filter(user=self.request.user).values(*ContactRowSerializer.fields)
+
+    def list(self, request, *args, **kwargs):
+        if wants_stream(request):
+            rows = self.get_queryset().order_by('id')
+            return streaming_json_response(rows.iterator(chunk_size=2000))
+        return super().list(request, *args, **kwargs)
 
 class PopulateTestDataView(views.APIView):
+    """Starts the sample data generator in the background and answers immediately."""
     permission_classes = [permissions.IsAuthenticated]   
 
     def post(self, request):
         if settings.DEBUG:
-            try:
-                call_command('populate_data') 
-                return response.Response({'message': 'Test data population initiated successfully.'}, status=status.HTTP_200_OK)
-            except Exception as e:
-                return response.Response({'error': f'Error during data population: {str(e)}'}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            serializer = PopulateTestDataSerializer(data=request.data)
+            serializer.is_valid(raise_exception=True)
+            if start_population(**serializer.validated_data):
+                return response.Response({'message': 'Test data population started.'}, status=status.HTTP_202_ACCEPTED)
+            return response.Response({'error': 'Test data population is already running.'}, status=status.HTTP_409_CONFLICT)
         else:
             return response.Response({'error': 'This endpoint is only available in DEBUG mode.'}, status=status.HTTP_403_FORBIDDEN)
         
@@ -225,7 +402,7 @@ class ContactDeleteView(generics.DestroyAPIView):
         
 class SpamReportDeleteView(generics.DestroyAPIView):
     permission_classes = [permissions.IsAuthenticated]
-    lookup_field = 'phone_number'
+    lookup_field = 'phone_key'
     lookup_url_kwarg = 'phone_number'
 
     def get_queryset(self):
@@ -236,21 +413,108 @@ class SpamReportDeleteView(generics.DestroyAPIView):
         try:
             queryset = self.get_queryset()
             phone_number = self.kwargs.get('phone_number')
-            instance = get_object_or_404(queryset, phone_number=phone_number)
-            self.perform_destroy(instance)
+            instance = get_object_or_404(queryset, phone_key=phone_number.key)
+            withdraw_report(instance)
             return response.Response({'message': 'Spam report removed successfully.'}, status=status.HTTP_200_OK)
         except SpamReport.DoesNotExist:
             return Response({'error': 'You have not reported this number as spam.'}, status=status.HTTP_404_NOT_FOUND)
 
-class AllSpamNumbersListView(generics.ListAPIView):
+class MetricsView(views.APIView):
+    """Per-route request metrics of every worker process, in Prometheus text format."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(render_prometheus(service_snapshot()), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+class ProfilerView(generics.GenericAPIView):
+    """
+    The current profiling session (core/profiling.py) and its samples by route and category.
+    POST starts a new session, DELETE ends the current one.
+    """
+    permission_classes = [permissions.IsAdminUser]
+    serializer_class = ProfilerSessionSerializer
+
+    def get(self, request):
+        return Response(summary(service_profile()))
+
+    def post(self, request):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        return Response(profiler.start_session(**serializer.validated_data), status=status.HTTP_201_CREATED)
+
+    def delete(self, request):
+        return Response(profiler.stop_session())
+
+class ProfilerStacksView(views.APIView):
+    """The current session's samples as collapsed stacks, for flame graphs; `?route=` keeps one route's."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        collapsed = render_collapsed(service_profile(), request.query_params.get('route'))
+        return HttpResponse(collapsed, content_type='text/plain; charset=utf-8')
+
+class SpamFilterStatsView(views.APIView):
+    """Size and effectiveness of this process's spam number Bloom filter."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return response.Response(spam_filter.stats())
+
+class SpamCacheStatsView(views.APIView):
+    """Hit ratio and churn of the spam lookup cache as seen by this process."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return response.Response(spam_cache.stats())
+
+class SpamReportQueueStatsView(views.APIView):
+    """Depth, batch sizes and flush latency of this process's spam report write-behind queue."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return response.Response(report_queue.stats())
+
+class SpamSnapshotView(views.APIView):
+    """The newest binary spam list snapshot (format in core/snapshot.py), sent straight from disk."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        snapshot = latest_snapshot()
+        if snapshot is None:
+            return Response({'error': 'No current spam list snapshot has been exported.'}, status=status.HTTP_404_NOT_FOUND)
+        version, path = snapshot
+        response = FileResponse(open(path, 'rb'), as_attachment=True, filename=path.name, content_type='application/octet-stream')
+        response['X-Spam-List-Version'] = str(version)
+        return response
+
+class SpamListChangesView(views.APIView):
+    """Numbers added to or removed from the spam list since the snapshot version `?since=`."""
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request):
+        try:
+            since = int(request.query_params['since'])
+        except (KeyError, ValueError):
+            return Response({'error': 'Pass the version of your snapshot as ?since=<version>.'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            return Response(changes_since(since))
+        except SnapshotExpired:
+            return Response(
+                {'error': 'Changes since this version are no longer kept. Download /api/spam/snapshot/ again.'},
+                status=status.HTTP_410_GONE,
+            )
+
+class AllSpamNumbersListView(ReplicaReadMixin, generics.ListAPIView):
     permission_classes = [permissions.IsAuthenticated]
-    serializer_class = SpamReportSerializer 
+    serializer_class = SpamNumberRowSerializer
+    pagination_class = SpamNumberCursorPagination
 
     def get_queryset(self):
         """Return a queryset of unique spam phone numbers."""
-        return SpamReport.objects.values('phone_number').distinct()
+        return PhoneSpamStat.objects.filter(report_count__gt=0).values('phone_key', 'phone_number')
 
     def list(self, request, *args, **kwargs):
-        queryset = self.filter_queryset(self.get_queryset())
-        results = [{'phone_number': item['phone_number']} for item in queryset]
-        return Response(results)
+        if wants_stream(request):
+            rows = self.get_queryset().order_by('phone_key').values('phone_number')
+            return streaming_json_response(rows.iterator(chunk_size=2000))
+        return super().list(request, *args, **kwargs)
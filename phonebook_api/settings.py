@@ -44,6 +44,10 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "core.middleware.RequestMetricsMiddleware",
+    "core.middleware.ReplicaPinningMiddleware",
+    "core.middleware.ThrottleHeadersMiddleware",
+    "core.middleware.ProfilerMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -88,6 +92,21 @@ DATABASES = {
     }
 }
 
+# Read replicas: each host in DATABASE_REPLICA_HOSTS (comma-separated) gets an alias,
+# 'replica1' and so on, with the primary's other settings. The search and lookup views read
+# from them in turn (core/replicas.py); everything else uses 'default'.
+DATABASE_REPLICAS = []
+for number, host in enumerate(filter(None, os.environ.get('DATABASE_REPLICA_HOSTS', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], 'HOST': host.strip(), 'TEST': {'MIRROR': 'default'}}
+    DATABASE_REPLICAS.append(f'replica{number}')
+
+DATABASE_ROUTERS = ['core.replicas.ReplicaRouter']
+
+# After a request writes, its user reads from the primary for this many seconds, which should
+# exceed replication lag. Use a cache shared by every process serving the API.
+REPLICA_PIN_CACHE = 'default'
+REPLICA_PIN_SECONDS = 5
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.1/ref/settings/#auth-password-validators
@@ -111,16 +130,177 @@ AUTH_USER_MODEL = 'core.User'
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'core.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
         'rest_framework.authentication.BasicAuthentication',
     ],
     'DEFAULT_PERMISSION_CLASSES': [
         'rest_framework.permissions.IsAuthenticated',
-    ]
+    ],
+    'DEFAULT_THROTTLE_CLASSES': [
+        'core.throttling.TokenBucketThrottle',
+    ],
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
     # Add other REST FRAMEWORK settings as needed
 }
 
+# Token-bucket throttling (core/throttling.py), enabled with THROTTLE_ENABLED=True. Each user,
+# or anonymous client address, may spend up to THROTTLE_BURST tokens at once, refilled at
+# THROTTLE_RATE tokens a second. Requests cost 1 token unless their URL name is listed in
+# THROTTLE_COSTS; name searches of one or two characters cost 3x or 2x their route's cost.
+THROTTLE_ENABLED = os.environ.get('THROTTLE_ENABLED', 'False') == 'True'
+THROTTLE_CACHE = 'throttle'
+THROTTLE_RATE = 20
+THROTTLE_BURST = 1000
+THROTTLE_COSTS = {
+    'search-name': 10,
+    'search-phone': 2,
+    'search-phone-batch': 50,
+    'user-detail-batch': 10,
+    'spam-report-batch': 10,
+    'sync-contacts': 10,
+    'populate-test-data': 100,
+}
+
+# Maximum number of rows returned by the name and phone search endpoints.
+SEARCH_RESULT_LIMIT = 100
+
+# Serve name searches from an in-process n-gram index (core/search_index.py) instead of
+# ILIKE scans. Each process builds its own copy in the background at startup, then every
+# NAME_SEARCH_INDEX_POLL_SECONDS re-reads the users and contacts other processes logged as
+# changed. It loads everything again only when the log can't cover the gap (more than
+# NAME_SEARCH_INDEX_MAX_CATCH_UP changes, pruned past NAME_SEARCH_INDEX_LOG_KEEP, a bulk load)
+# and once every NAME_SEARCH_INDEX_REBUILD_SECONDS.
+NAME_SEARCH_INDEX_ENABLED = os.environ.get('NAME_SEARCH_INDEX_ENABLED', 'False') == 'True'
+NAME_SEARCH_INDEX_POLL_SECONDS = 1
+NAME_SEARCH_INDEX_MAX_CATCH_UP = 10000
+NAME_SEARCH_INDEX_GAP_SECONDS = 60
+NAME_SEARCH_INDEX_LOG_KEEP = 100000
+NAME_SEARCH_INDEX_REBUILD_SECONDS = 24 * 60 * 60
+
+# Answer lookups for never-reported numbers from an in-process Bloom filter (core/bloom.py)
+# without a query. Reports filed through other processes are read from the spam list change
+# log before a miss is trusted, at most once every SPAM_FILTER_POLL_SECONDS; the full rebuild
+# every SPAM_FILTER_REBUILD_SECONDS ages out withdrawn reports.
+SPAM_FILTER_ENABLED = os.environ.get('SPAM_FILTER_ENABLED', 'False') == 'True'
+SPAM_FILTER_ERROR_RATE = 0.01
+SPAM_FILTER_HEADROOM = 2
+SPAM_FILTER_MIN_CAPACITY = 100000
+SPAM_FILTER_REBUILD_SECONDS = 300
+SPAM_FILTER_POLL_SECONDS = 1
+# More changes than this since the filter's version rebuild it instead.
+SPAM_FILTER_MAX_CATCH_UP = 10000
+
+# Rolling spam report windows are kept in buckets of this many seconds; `compact_spam_windows`
+# rolls expired buckets off the window counts. Run `rebuild_spam_stats` after changing it.
+SPAM_WINDOW_BUCKET_SECONDS = 300
+# A report's weight in the decayed spam score halves every this many seconds.
+SPAM_SCORE_HALF_LIFE = 7 * 24 * 60 * 60
+
+# Largest address book accepted by a single POST /api/contacts/sync/.
+CONTACT_SYNC_MAX_CONTACTS = 10000
+
+# Numbers without an international prefix are read as national numbers of this country.
+PHONE_DEFAULT_COUNTRY_CODE = '91'
+PHONE_NATIONAL_NUMBER_LENGTH = 10
+
+# Most numbers accepted by a single POST /api/spam/batch/.
+SPAM_REPORT_BATCH_MAX = 1000
+
+# Write-behind spam reports: POST /api/spam/create/ queues the report and answers 202, and a
+# background thread writes the queue in batches of up to SPAM_REPORT_QUEUE_BATCH_SIZE, at the
+# latest SPAM_REPORT_QUEUE_FLUSH_SECONDS after a report arrives. With SPAM_REPORT_QUEUE_MAX
+# reports waiting, new ones are refused with 503 and Retry-After.
+SPAM_REPORT_QUEUE_ENABLED = os.environ.get('SPAM_REPORT_QUEUE_ENABLED', 'False') == 'True'
+SPAM_REPORT_QUEUE_MAX = 50000
+SPAM_REPORT_QUEUE_BATCH_SIZE = 1000
+SPAM_REPORT_QUEUE_FLUSH_SECONDS = 0.5
+
+# Binary spam list snapshots written by `export_spam_snapshot` and served at /api/spam/snapshot/.
+# Changes are kept for delta sync back to the oldest of the newest SPAM_SNAPSHOT_KEEP snapshots.
+SPAM_SNAPSHOT_DIR = os.environ.get('SPAM_SNAPSHOT_DIR', str(BASE_DIR / 'spam-snapshots'))
+SPAM_SNAPSHOT_KEEP = 7
+
+# Most numbers accepted by a single POST /api/search/phone/batch/.
+PHONE_LOOKUP_BATCH_MAX = 5000
+
+# Most users accepted by a single POST /api/users/batch/.
+USER_DETAIL_BATCH_MAX = 500
+
+# Contact names kept per number in the phone directory (core/directory.py), most common first;
+# a phone search for an unregistered number returns these. Run `rebuild_phone_directory`
+# after changing it.
+PHONE_DIRECTORY_NAMES = 10
+
+# Caches
+# https://docs.djangoproject.com/en/5.1/topics/cache/
+# The 'spam' alias holds per-number report counts for the lookup endpoints. Point it at a
+# shared backend (e.g. django.core.cache.backends.redis.RedisCache) to share it across hosts.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'spam': {
+        'BACKEND': 'core.cache.CountingLocMemCache',
+        'LOCATION': 'spam-lookups',
+        'TIMEOUT': 300,
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            # Evict the least recently used 1% at a time rather than a third of the cache.
+            'CULL_FREQUENCY': 100,
+        },
+    },
+    'auth': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'auth-tokens',
+        'OPTIONS': {
+            'MAX_ENTRIES': 50000,
+            'CULL_FREQUENCY': 100,
+        },
+    },
+    # Point this at a shared backend (Redis, Memcached) when several processes serve the API,
+    # so a caller's requests all spend from one bucket.
+    'throttle': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'throttle-buckets',
+        'OPTIONS': {
+            'MAX_ENTRIES': 100000,
+            'CULL_FREQUENCY': 100,
+        },
+    },
+}
+
+SPAM_LOOKUP_CACHE = 'spam'
+# How often each process checks whether the spam statistics were rebuilt (core/spam_cache.py).
+SPAM_LOOKUP_CACHE_GENERATION_SECONDS = 5
+# How often each process checks whether the spam statistics were rebuilt (core/spam_cache.py).
+SPAM_LOOKUP_CACHE_GENERATION_SECONDS = 5
+
+# Resolved API tokens are cached briefly so most requests skip the Token/User query.
+AUTH_TOKEN_CACHE = 'auth'
+AUTH_TOKEN_CACHE_TIMEOUT = 30
+
+# Request metrics (core/metrics.py). Every process writes its totals to this directory so
+# GET /api/metrics/ and `manage.py dump_metrics` can report on all of them; empty disables it.
+METRICS_SNAPSHOT_DIR = os.environ.get('METRICS_SNAPSHOT_DIR', str(BASE_DIR / 'metrics-snapshots'))
+METRICS_SNAPSHOT_SECONDS = 15
+# Snapshots not refreshed for this long belong to processes that have gone away.
+METRICS_SNAPSHOT_MAX_AGE = 3600
+
+# Sampling request profiler (core/profiling.py), off until an admin starts a session through
+# POST /api/profiler/. Sessions and every process's samples are kept in PROFILER_DIR.
+PROFILER_DIR = os.environ.get('PROFILER_DIR', METRICS_SNAPSHOT_DIR)
+PROFILER_CONFIG_SECONDS = 1
+PROFILER_INTERVAL = 0.005
+PROFILER_SNAPSHOT_SECONDS = 15
+PROFILER_MAX_SECONDS = 3600
+PROFILER_MAX_STACKS = 5000
+PROFILER_MAX_DEPTH = 100
+
 # Internationalization
 # https://docs.djangoproject.com/en/5.1/topics/i18n/
 
@@ -14,3 +14,11 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "phonebook_api.settings")
 
 application = get_wsgi_application()
+
+from core.bloom import spam_filter  # noqa: E402
+from core.search_index import name_index  # noqa: E402
+from core.spam_cache import spam_cache  # noqa: E402
+
+name_index.warm()
+spam_filter.warm()
+spam_cache.watch()